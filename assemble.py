@@ -7,6 +7,7 @@ import subprocess
 #from datetime import datetime
 #import Lib/fnmatch.py
 import fnmatch
+import functools
 
 import dxpy
 #import dxencode
@@ -21,8 +22,9 @@ import encd
 #   Its purpose is to recognize all files (for a given experiment) that are available in ENCODEd and are needed to
 #   complete a pipeline run (including fastqs and intermediate results); then if they are not already on DX copy them there.
 #   Ideally assemble.py is run for a single experiment, but can act on a list of experiments.  The files are "fetched" to
-#   DX by a DX applet and assemble.py waits for the fetch to complete for one experiment, before moving on to the next.
-#   After a successful fetch, assemble.py can kick-off (ignite) the appropriate Launcher, so that the pipeline will be run.
+#   DX by a DX applet, one fetch job per experiment.  The fetch jobs of all experiments run at once, watched together by
+#   a single dx.ExecutionWatcher, and as each fetch completes assemble.py can kick-off (ignite) the appropriate Launcher,
+#   so that the pipeline will be run.
 
 class Assemble(object):
     '''
@@ -113,6 +115,9 @@ class Assemble(object):
         self.full_mapping = None
         self.psv = {} # will hold pipeline specific variables.
         self.statuses_accepted = self.FILE_STATUSES_ACCEPTED
+        self.watcher = dx.ExecutionWatcher() # Follows all fetch jobs together
+        self.fetches = [] # (job id, exp_id, needed count) of each fetch left to the watcher
+        self.totals = { 'copied': 0, 'failed': 0, 'launched': 0 }
         print # TEMPORARY: adds a newline to "while retrieving session configuration" unknown error
 
     def get_args(self,parse=True):
@@ -214,6 +219,7 @@ class Assemble(object):
 
     def load_variables(self,args,key='default'):
         '''Loads common variables to self.'''
+        self.args = args
         self.test = args.test
         self.inputs_only = args.inputs_only
         self.server_key = args.server
@@ -379,17 +385,18 @@ class Assemble(object):
     def subtract_files_already_in_dx(self, enc_files, exp_id, exp_folder,verbose=False):
         '''Subtracts from an enc file_objs list any files that are already in the dx exp_folder.'''
         needed_files = []
+        # Input files may be at exp folder level!
+        # Actually input files can be found anywhere in the project, so look for all of them at once with recurse
+        fastq_names = [ os.path.basename(f_obj['href']) for f_obj in enc_files if f_obj.get('file_format') == 'fastq' ]
+        fastqs_found = dx.find_files_by_name(fastq_names, '/', self.proj_id, recurse=True)
         for f_obj in enc_files:
             # Inputs are handled one way:
             if f_obj.get('file_format') == 'fastq':
                 dx_file_name = os.path.basename(f_obj['href'])
                 #file_path = exp_folder + dx_file_name
                 file_path = dx_file_name
-                # Input files may be at exp folder level!
-                # Actually input files can be found anywhere in the project, so use recurse
                 #fid = dx.find_file(exp_folder + dx_file_name,self.proj_id,recurse=True)
-                fid = dx.find_file(dx_file_name,self.proj_id,recurse=True)
-                if fid == None:
+                if len(fastqs_found[dx_file_name]) != 1: # As with find_file(), duplicates are as good as missing
                     f_obj['dx_file_name'] = dx_file_name
                     br = f_obj['replicate']['biological_replicate_number']
                     tr = f_obj['replicate']['technical_replicate_number']
@@ -456,14 +463,21 @@ class Assemble(object):
         return f2f_json
 
 
-    def fetch_to_dx(self,exp_id,dx_folder,needed_files,test=True):
-        '''Runs fetch-to-dx app to fetch of all files for a given experiment from encoded to dnanexus.'''
+    def fetch_to_dx(self,exp_id,dx_folder,needed_files,test=True,when_fetched=None):
+        '''
+        Runs fetch-to-dx app to fetch of all files for a given experiment from encoded to dnanexus.
+        Returns the number of files NOT successfully fetched, unless when_fetched is given, in which case the job is
+        left to self.watcher and when_fetched(failed) is called once it finishes.
+        '''
         needed_count = len(needed_files)
         files_to_fetch = self.prepare_files_to_fetch_json(needed_files,verbose=False)
         assert (files_to_fetch != None)
 
         if test:
             print "  - Test fetch %d files from encoded:%s to dnanexus:%s" % (needed_count,exp_id,dx_folder)
+            if when_fetched != None:
+                when_fetched(0)
+                return None
             return 0 # Returns the number of files NOT successfully fetched
         else:
             applet = dx.find_applet_by_name('fetch-to-dx', self.proj_id )
@@ -478,21 +492,76 @@ class Assemble(object):
             print "  - Fetching %d files from encoded:%s to dnanexus:%s  (job:%s)" % \
                     (needed_count,exp_id,dx_folder,job.id)
             sys.stdout.flush() # Slow running job should flush to piped log
+            if when_fetched != None:
+                self.watcher.watch(job.id, \
+                    callback=lambda watched: when_fetched(self.fetch_failures(exp_id,watched,needed_count)))
+                self.fetches.append((job.id,exp_id,needed_count))
+                return None
             try:
-                job.wait_on_done(interval=3)
+                watched = self.watcher.wait([job.id])[0]
             except Exception as e:
                 print "  " + e.message
                 return needed_count
-
-            job_dict = job.describe()
-            #error = job_dict['output'].get('error', None)
-            if job_dict["state"] == "done":
-                fetched_count = job_dict['output'].get('fetched_count', 0)
-                return needed_count - fetched_count
+            return self.fetch_failures(exp_id,watched,needed_count)
 
         return needed_count # Returns the number of files NOT successfully fetched
 
 
+    def fetch_failures(self,exp_id,watched,needed_count):
+        '''Returns the number of files NOT successfully fetched by a finished fetch-to-dx job.'''
+        job_dict = watched.desc
+        #error = job_dict['output'].get('error', None)
+        if watched.succeeded():
+            fetched_count = job_dict['output'].get('fetched_count', 0)
+            return needed_count - fetched_count
+        print "  - Fetch for %s %s: %s" % (exp_id,watched.state,job_dict.get('failureMessage',''))
+        return needed_count
+
+
+    def unfinished_fetches(self):
+        '''Reports each fetch that was never followed up on, or whose follow-up failed, counting its files as failed.'''
+        for (job_id,exp_id,needed_count) in self.fetches:
+            watched = self.watcher.executions[job_id]
+            if watched.error != None:
+                print "  - Follow up on fetch for %s failed: %s" % (exp_id,str(watched.error))
+            elif not watched.done():
+                print "  - Fetch for %s (job:%s) did not finish" % (exp_id,job_id)
+            else:
+                continue
+            print "- For %s Processed %d file(s), copied 0, failed %d, launched 0" % (exp_id, needed_count, needed_count)
+            self.totals['failed'] += needed_count
+
+
+    def fetched(self,exp_id,exp_type,replicates,genome,annotation,needed_count,already_processed_files,failed):
+        '''Follows up on an experiment's completed fetch: marks it pipeline ready and ignites its launcher.'''
+        copied = needed_count - failed
+        launched = 0
+
+        if failed == 0 and not already_processed_files:
+            encd.exp_patch_internal_status(exp_id, 'pipeline ready', test=self.test)
+        #else:
+        #    encd.exp_patch_internal_status(exp_id, 'unrunnable', test=self.test)
+
+        # Ignite a launcher here...
+        if self.args.launch:
+            pid = self.launch(exp_id,exp_type,replicates,genome,annotation,test=self.test)
+            if pid > 0:
+                #print "- Launcher ignited for %s, pid %d" % (exp_id, pid)
+                launched = 1
+
+        if self.test:
+            print "- For %s Processed %d file(s), would try to copy %d file(s)" % \
+                                                        (exp_id, needed_count, copied)
+        else:
+            print "- For %s Processed %d file(s), copied %d, failed %d, launched %d" % \
+                                                        (exp_id, needed_count, copied, failed, launched)
+        sys.stdout.flush() # Slow running job should flush to piped log
+
+        self.totals['copied'] += copied
+        self.totals['failed'] += failed
+        self.totals['launched'] += launched
+
+
     def launch(self,exp_id,exp_type,replicates,genome,annotation,test=True,verbose=False):
         '''
         Spawns the appropriate launcher, not waiting around for the results.
@@ -563,9 +632,6 @@ class Assemble(object):
 
         exp_count = 0
         skipped = 0
-        total_copied = 0
-        total_failed = 0
-        total_launched = 0
         for exp_id in args.experiments:
             sys.stdout.flush() # Slow running job should flush to piped log
             exp_count += 1
@@ -636,22 +702,17 @@ class Assemble(object):
             self.exp_folder = dx.find_exp_folder(self.project,self.exp_id,self.umbrella_folder)
             if self.exp_folder == None:
                 self.exp_folder = self.umbrella_folder + exp_id + '/'
-                # create it!
-                if not self.test:
-                    self.project.new_folder(self.exp_folder,parents=True)
-                    print "- Have created folder: %s:%s" % (self.proj_name, self.exp_folder)
-                else:
-                    print "- Test created folder: %s:%s" % (self.proj_name, self.exp_folder)
+            rep_folders = [ self.exp_folder + rep['rep_tech'] + '/' for rep in self.replicates ]
+            # Create whatever is missing all at once
+            created = dx.materialize_folders(self.project, [ self.exp_folder ] + rep_folders, test=self.test)
+            verb = "Test created" if self.test else "Have created"
+            if self.exp_folder in created:
+                print "- %s folder: %s:%s" % (verb, self.proj_name, self.exp_folder)
             else:
                 print "- Will examine folder: %s:%s" % (self.proj_name, self.exp_folder)
-            for rep in self.replicates:
-                rep_folder = self.exp_folder + rep['rep_tech'] + '/'
-                if not dx.project_has_folder(self.project, rep_folder):
-                    if not self.test:
-                        self.project.new_folder(rep_folder)
-                        print "  - Have created rep folder:      " + rep_folder
-                    else:
-                        print "  - Test created rep folder:      " + rep_folder
+            for rep_folder in rep_folders:
+                if rep_folder in created:
+                    print "  - %s rep folder:      %s" % (verb, rep_folder)
                 else:
                     print "  - Will examine rep folder:      " + rep_folder
 
@@ -678,33 +739,27 @@ class Assemble(object):
                 if not f_obj['dx_file_name'].endswith('.fastq.gz') and not f_obj['dx_file_name'].endswith('.fq.gz'):
                     already_processed_files = True
 
-            failed = 0
-            failed = self.fetch_to_dx(self.exp_id,self.exp_folder,needed_files,test=self.test)
-            copied = len(needed_files) - failed
-            launched = 0
-
-            if failed == 0 and not already_processed_files:
-                encd.exp_patch_internal_status(self.exp_id, 'pipeline ready', test=self.test)
-            #else:
-            #    encd.exp_patch_internal_status(self.exp_id, 'unrunnable', test=self.test)
-
-            # Ignite a launcher here...
-            if args.launch:
-                pid = self.launch(self.exp_id,self.exp_type,self.replicates,self.genome,args.annotation,test=self.test)
-                if pid > 0:
-                    #print "- Launcher ignited for %s, pid %d" % (self.exp_id, pid)
-                    launched = 1
-
-            if self.test:
-                print "- For %s Processed %d file(s), would try to copy %d file(s)" % \
-                                                            (self.exp_id, len(needed_files), copied)
-            else:
-                print "- For %s Processed %d file(s), copied %d, failed %d, launched %d" % \
-                                                            (self.exp_id, len(needed_files), copied, failed, launched)
+            # Don't wait: the fetch is followed up on once it completes, while the next experiment is assembled
+            when_fetched = functools.partial(self.fetched,self.exp_id,self.exp_type,self.replicates,self.genome, \
+                                             args.annotation,len(needed_files),already_processed_files)
+            self.fetch_to_dx(self.exp_id,self.exp_folder,needed_files,test=self.test,when_fetched=when_fetched)
+            try:
+                self.watcher.poll() # Follow up on any fetches that have already completed
+            except Exception as e:
+                print "  " + e.message # Those fetches will be polled again
 
-            total_copied += copied
-            total_failed += failed
-            total_launched += launched
+        pending = len(self.watcher.pending())
+        if pending > 0:
+            print "Waiting on %d fetch job(s)..." % pending
+            sys.stdout.flush() # Slow running job should flush to piped log
+            try:
+                self.watcher.wait()
+            except Exception as e:
+                print "  " + e.message
+        self.unfinished_fetches()
+        total_copied = self.totals['copied']
+        total_failed = self.totals['failed']
+        total_launched = self.totals['launched']
 
         if exp_count > 1:
             if self.test:
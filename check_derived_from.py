@@ -4,6 +4,7 @@ import os
 import sys
 import json
 import dxencode
+import encd
 import argparse
 
 class Checker(object):
@@ -20,7 +21,9 @@ class Checker(object):
             key = 'test'
         else:
             key = 'www'
+        self.key = key
         (self.authid, self.authpw, self.server) = dxencode.processkey(key)
+        encd.set_response_cache() # Only reads, so encodeD objects can come from the response cache
         self.experiments = []
 
     def run(self):
@@ -89,12 +92,9 @@ class lRNAChecker(Checker):
         reads = {}
         derived = {}
 
-        for facc in exp.get('original_files',[]): ## could have no files
-            res = dxencode.encoded_get(self.server+facc, AUTHID=self.authid, AUTHPW=self.authpw)
-            try:
-                res.raise_for_status()
-                f = res.json()
-            except:
+        faccs = exp.get('original_files',[]) ## could have no files
+        for (facc, f) in zip(faccs, encd.lookup_many(faccs, frame='embedded', key=self.key)): # all at once
+            if f == None:
                 print("File: %s not found" % (facc))
                 continue
 
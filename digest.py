@@ -0,0 +1,189 @@
+#!/usr/bin/env python2.7
+# digest.py 0.0.1
+#
+# Hashing of (very large) local files: several digests in one pass, large aligned reads or mmap,
+# and a process pool to hash many files at once with progress reporting.
+#
+# Use from dx.calc_md5(), dxencode.calc_md5() or on the command line:
+#     digest.py ENCFF000AAA.fastq.gz ENCFF000AAB.bam --sha256 --processes 4
+
+import os, sys, time
+import hashlib, mmap
+import argparse
+import multiprocessing
+
+DIGESTS_DEFAULT = [ 'md5' ]
+DIGESTS_KNOWN = [ 'md5', 'sha1', 'sha256', 'sha512', 'crc32c' ]
+
+READ_SIZE = 16 * 1024 * 1024 ## Bytes per read, kept a multiple of the mmap allocation granularity
+READ_SIZE -= READ_SIZE % mmap.ALLOCATIONGRANULARITY
+
+PROGRESS_SECS = 10 ## Minimum seconds between progress reports while hashing many files
+
+
+class Crc32c(object):
+    '''Hashlib-like wrapper around the optional crc32c package.'''
+    name = 'crc32c'
+
+    def __init__(self):
+        try:
+            import crc32c
+        except ImportError:
+            raise ValueError("Digest 'crc32c' requires the crc32c package (pip install crc32c).")
+        self._crc32c = crc32c.crc32c
+        self.crc = 0
+
+    def update(self, data):
+        self.crc = self._crc32c(data, self.crc)
+
+    def digest(self):
+        return ''.join([ chr((self.crc >> shift) & 0xff) for shift in (24, 16, 8, 0) ])
+
+    def hexdigest(self):
+        return '%08x' % (self.crc & 0xffffffff)
+
+
+def new_digest(name):
+    '''Returns a new hashlib-like object for the named digest.'''
+    if name == 'crc32c':
+        return Crc32c()
+    if name not in DIGESTS_KNOWN:
+        raise ValueError("Unknown digest '%s'.  Choose from: %s" % (name, ', '.join(DIGESTS_KNOWN)))
+    return hashlib.new(name)
+
+
+def file_digests(path, digests=DIGESTS_DEFAULT, use_mmap=False, read_size=READ_SIZE):
+    '''Returns { digest_name: hash object } for a file, computing every digest in a single pass.'''
+    hashers = [ (name, new_digest(name)) for name in digests ]
+    with open(path, 'rb') as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if use_mmap and size > 0:
+            mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for offset in xrange(0, size, read_size):
+                    chunk = buffer(mapped, offset, read_size)
+                    for (name, hasher) in hashers:
+                        hasher.update(chunk)
+            finally:
+                mapped.close()
+        else:
+            buf = bytearray(read_size)
+            view = memoryview(buf)
+            while True:
+                count = fh.readinto(buf)
+                if not count:
+                    break
+                chunk = view[:count] if count < read_size else view
+                for (name, hasher) in hashers:
+                    hasher.update(chunk)
+    return dict(hashers)
+
+
+def calc_md5(path):
+    ''' Calculate md5 sum from file as specified by valid path name'''
+    return file_digests(path)['md5']
+
+
+def _hash_one(job):
+    '''Pool worker: returns (path, { digest_name: hexdigest }, bytes, seconds, error).'''
+    (path, digests, use_mmap) = job
+    start = time.time()
+    try:
+        hashed = file_digests(path, digests, use_mmap=use_mmap)
+        size = os.path.getsize(path)
+    except (IOError, OSError, ValueError) as e:
+        return (path, None, 0, time.time() - start, str(e))
+    return (path, dict([ (name, hasher.hexdigest()) for (name, hasher) in hashed.items() ]), size, \
+            time.time() - start, None)
+
+
+def _bytes_str(count):
+    '''Returns a byte count in human readable form.'''
+    for unit in [ 'B', 'KB', 'MB', 'GB' ]:
+        if count < 1024.0:
+            return "%.1f %s" % (count, unit)
+        count /= 1024.0
+    return "%.1f TB" % count
+
+
+def hash_files(paths, digests=DIGESTS_DEFAULT, processes=None, use_mmap=False, progress=True):
+    '''
+    Hashes many files concurrently in a process pool.
+    Returns { path: { digest_name: hexdigest } }, with None for any file that could not be read.
+    '''
+    for name in digests:
+        new_digest(name) # Fail early on unknown or unavailable digests rather than in every worker
+    jobs = [ (path, list(digests), use_mmap) for path in paths ]
+    if processes == None:
+        processes = min(len(jobs), multiprocessing.cpu_count())
+    processes = max(processes, 1)
+
+    if processes == 1 or len(jobs) <= 1:
+        results = ( _hash_one(job) for job in jobs )
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(_hash_one, jobs)
+
+    hashed = {}
+    total_bytes = 0
+    start = time.time()
+    reported = start
+    try:
+        for (path, hexdigests, size, secs, error) in results:
+            hashed[path] = hexdigests
+            total_bytes += size
+            if error != None:
+                print >> sys.stderr, "WARNING: Unable to hash '%s': %s" % (path, error)
+            now = time.time()
+            if progress and (now - reported >= PROGRESS_SECS or len(hashed) == len(jobs)):
+                reported = now
+                print >> sys.stderr, "Hashed %d of %d files, %s in %.0f secs (%s/sec)" % \
+                    (len(hashed), len(jobs), _bytes_str(total_bytes), now - start, \
+                     _bytes_str(total_bytes / max(now - start, 0.001)))
+    finally:
+        if pool != None:
+            pool.close()
+            pool.join()
+    return hashed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calculates md5 (and optionally other) digests of local files.")
+    parser.add_argument('files', nargs='+', help="Files to hash.")
+    parser.add_argument('--sha256', action='store_true', required=False, default=False,
+                        help="Also calculate sha256.")
+    parser.add_argument('--crc32c', action='store_true', required=False, default=False,
+                        help="Also calculate crc32c (requires the crc32c package).")
+    parser.add_argument('--processes', type=int, required=False, default=None,
+                        help="Number of files to hash at once (default: one per cpu).")
+    parser.add_argument('--mmap', action='store_true', required=False, default=False,
+                        help="Read files through mmap rather than large reads.")
+    parser.add_argument('--quiet', action='store_true', required=False, default=False,
+                        help="Do not report progress.")
+    args = parser.parse_args()
+
+    digests = list(DIGESTS_DEFAULT)
+    if args.sha256:
+        digests.append('sha256')
+    if args.crc32c:
+        digests.append('crc32c')
+    try:
+        hashed = hash_files(args.files, digests, processes=args.processes, use_mmap=args.mmap, \
+                            progress=not args.quiet)
+    except ValueError as e:
+        print >> sys.stderr, str(e)
+        sys.exit(1)
+    failed = False
+    for path in args.files:
+        if hashed.get(path) == None:
+            failed = True
+            continue
+        print '  '.join([ hashed[path][name] for name in digests ] + [ path ])
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
+
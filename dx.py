@@ -1,11 +1,17 @@
 import os, sys, json
 import subprocess, commands
-import hashlib, re
+import hashlib, re, time, atexit
+import random, socket, types, threading, copy
+from contextlib import contextmanager
+import sqlite3
+from collections import OrderedDict
 import dxpy
 #import shlex
 
 import logging
 
+import digest
+
 DX_VERSION = "1"
 
 GENOME_DEFAULTS = { 'human': 'GRCh38', 'mouse': 'mm10' }
@@ -22,28 +28,230 @@ REF_FOLDER_DEFAULT = '/'
 INTERNAL_STATUS_BLOCKS = ["requires lab review", "unrunnable"]
 '''Experients with these internal_statuses should not be assembled or launched.'''
 
-REFERENCE_FILES = {} ## Dict to cache known Reference Files
-FILES = {} ## Dict to cache files
-APPLETS = {} ## Dict to cache known applets
+FOLDER_SNAPSHOTS = {} ## Dict of folder tree snapshots keyed by (project id, umbrella folder)
+FOLDER_SNAPSHOTS_LOCK = threading.RLock() ## Guards FOLDER_SNAPSHOTS
+FOLDER_SNAPSHOT_TTL = 600 ## Seconds a folder snapshot is trusted before it is rebuilt (others may change folders)
+LISTING_STATS = { 'hits': 0, 'misses': 0 } ## find_file lookups answered from (hits) or requiring (misses) a listing
+LISTING_STATS_LOCK = threading.Lock() ## Guards LISTING_STATS
+
+DESCRIBE_FIELDS = [ 'id', 'project', 'class', 'name', 'folder', 'size', 'state', 'created', 'modified',
+                    'createdBy', 'types', 'tags', 'media', 'properties', 'details' ]
+''' The fields returned by the bulk describe service.  Anything else is not transferred.'''
+DESCRIBE_CHUNK = 1000 ## Most objects the system describeDataObjects api will take in one call
+DESCRIBE_CACHE_SIZE = 20000 ## Most file descriptions to hold in memory
+
+MIRROR_DIR_DEFAULT = os.path.expanduser('~/.dxencode/mirrors')
+''' Where local mirrors of project file metadata are kept.'''
+MIRROR_MAX_AGE = 3600 ## Seconds a mirror may go without syncing before it is refreshed
+MIRROR_RECONCILE_AGE = 24 * 3600 ## Seconds between full syncs, which drop files removed or moved by others
+MIRRORS = {} ## Dict of enabled project mirrors keyed by project id
+MIRRORS_LOCK = threading.Lock() ## Guards MIRRORS
+
+NAMES_FILE = os.path.expanduser('~/.dxencode/names.json')
+''' On-disk cache resolving project names, applet names and reference file names to ids.'''
+NAMES_VERSION = 1 ## Layout version of NAMES_FILE, which is discarded when it does not match
+NAMES_TTL = 24 * 3600 ## Seconds a cached name resolution or catalog is trusted before being looked up again
+NAMES = None ## { 'version', 'projects': { name|level: entry }, 'applets'/'references': { proj_id: catalog } }
+NAMES_CHECKED = set() ## (kind, project id) catalogs already checked for changes by this process
+
+CONTENT_CACHE_DIR = os.path.expanduser('~/.dxencode/content')
+''' Where local copies of small closed DX files are kept, named by file id (closed DX files never change).'''
+CONTENT_CACHE_MAX = 256 * 1024 * 1024 ## Most bytes held in CONTENT_CACHE_DIR before the least recently used go
+CONTENT_FILE_MAX = 16 * 1024 * 1024 ## Largest file to keep a local copy of, anything larger is always streamed
+CONTENT_CHUNK = 1024 * 1024 ## Bytes per read when streaming a file down
+
+FIND_EXPLAIN = False ## When True find_file() reports on stderr how each lookup was planned (see explain_queries())
+FIND_BATCH_NAMES = 100 ## Most names combined into one regexp query by find_files_by_name()
+ITER_FIELDS = [ 'name', 'folder', 'state', 'size', 'createdBy', 'properties' ]
+''' The fields iter_files() asks for by default.  Details are deliberately left out as they can be large.'''
+ITER_PAGE_SIZE = 1000 ## Files asked for per find_data_objects page by iter_files()
+
+BUFFER_PROPERTIES = False ## When True file_set_property() changes wait for flush_properties()
+PENDING_PROPERTIES = OrderedDict() ## Buffered property changes keyed by (fid, project id)
+PROPERTIES_LOCK = threading.RLock() ## Guards PENDING_PROPERTIES
+
+DX_RETRY_MAX = 6 ## Most attempts at any one api call before its error is let through
+DX_RETRY_BASE = 1.0 ## Seconds of backoff before the first retry, doubling with each attempt (with full jitter)
+DX_RETRY_CAP = 60 ## Most seconds of backoff between two attempts
+DX_RETRY_BUDGET = 200 ## Most retries any one endpoint may use in a process, after which its errors are let through
+DX_RETRY_BUDGETS = { 'applet/run': 20, 'workflow/run': 20 } ## Per endpoint overrides of DX_RETRY_BUDGET
+DX_RETRY_CODES = [ 429, 500, 502, 503, 504 ] ## HTTP status codes of transient api errors
+DX_RETRY_REFUSED = [ 429, 503 ] ## Codes of requests refused unprocessed, which even non-idempotent calls may retry
+DX_RETRY_ERRORS = [ 'ServiceUnavailable', 'RateLimitConditional', 'InternalError', 'ContentLengthError',
+                    'BadJSONInReply', 'ConnectionError', 'Timeout', 'ProtocolError' ]
+''' Names of exception classes (or their bases) that are transient whatever their code.'''
+DX_NON_IDEMPOTENT = [ 'run', 'new', 'newFolder', 'clone', 'removeObjects', 'removeFolder', 'addStage' ]
+''' Api methods which may not be repeated when it is unknown whether the first attempt was carried out.'''
+DX_BREAKER_FAILURES = 8 ## Consecutive transient failures, across all endpoints, which trip the circuit breaker
+DX_BREAKER_PAUSE = 60 ## Seconds all api calls are held once the breaker trips, doubling while failures continue
+DX_BREAKER_PAUSE_MAX = 900 ## Longest the breaker will hold api calls at once
+DX_BREAKER = { 'failures': 0, 'open_until': 0, 'pause': DX_BREAKER_PAUSE, 'trips': 0 }
+DX_RETRY_STATS = {} ## { endpoint: { 'calls', 'retries', 'gave_up', 'secs_lost' } } see dx_retry_report()
+DX_RETRY_LOCK = threading.Lock()
 
 RUNS_LAUNCHED_FILE = "launchedRuns.txt"
     
-def clear_cache():
-    '''Empties all cache'''
-    global REFERENCE_FILES
-    global FILES
-    global APPLETS
-    REFERENCE_FILES = {} ## Dict to cache known Reference Files
-    FILES = {} ## Dict to cache files
-    APPLETS = {} ## Dict to cache known applets
+def clear_cache(scope=None):
+    '''
+    Empties the cache of what was found within a cache_scope() (default: the current one), or all cache when
+    not in a scope (folder snapshots and the on-disk name catalogs are kept, see clear_folder_snapshots()).
+    '''
+    if scope == None:
+        scope = current_cache_scope()
+    REFERENCE_FILES.clear(scope)
+    FILES.clear(scope)
+    APPLETS.clear(scope)
+    FOLDER_LISTINGS.clear(scope)
+    DESCRIPTIONS.clear(scope)
+    if scope == None:
+        with DESCRIBE_LOCK:
+            del DESCRIBE_QUEUE[:]
 
 def calc_md5(path):
     ''' Calculate md5 sum from file as specified by valid path name'''
-    md5sum = hashlib.md5()
-    with open(path, 'rb') as f:
-        for chunk in iter(lambda: f.read(1024*1024), ''):
-            md5sum.update(chunk)
-    return md5sum
+    return digest.calc_md5(path)
+
+def dx_endpoint(resource):
+    '''Returns 'class/method' for an api resource ('/file-xxxx/describe') or dxpy.api function name.'''
+    if resource.startswith('/'):
+        parts = resource[1:].split('/')
+        return parts[0].split('-')[0] + '/' + '/'.join(parts[1:])
+    (obj_class, method) = resource.split('_', 1)
+    words = method.split('_')
+    return obj_class + '/' + words[0] + ''.join([ word.capitalize() for word in words[1:] ])
+
+
+def dx_error_retryable(error, idempotent=True):
+    '''Classifies an api error as transient (worth retrying) or fatal.'''
+    code = getattr(error, 'code', None)
+    if not isinstance(code, int):
+        code = getattr(getattr(error, 'response', None), 'status_code', None)
+    names = [ cls.__name__ for cls in type(error).__mro__ ]
+    refused = code in DX_RETRY_REFUSED or 'ServiceUnavailable' in names or 'RateLimitConditional' in names
+    if not idempotent:
+        return refused
+    if refused or code in DX_RETRY_CODES:
+        return True
+    if isinstance(code, int) and code < 500:
+        return False
+    if isinstance(error, socket.error):
+        return True
+    return len([ name for name in names if name in DX_RETRY_ERRORS ]) > 0
+
+
+def dx_breaker_wait(stats):
+    '''Holds the caller while the circuit breaker is open, which pauses every api call in the process.'''
+    while True:
+        with DX_RETRY_LOCK:
+            wait = DX_BREAKER['open_until'] - time.time()
+            if wait > 0:
+                stats['secs_lost'] += wait
+        if wait <= 0:
+            return
+        time.sleep(wait)
+
+
+def dx_breaker_record(transient):
+    '''Records the outcome of an api call: transient failures trip the breaker, anything else resets it.'''
+    with DX_RETRY_LOCK:
+        if not transient:
+            DX_BREAKER['failures'] = 0
+            if DX_BREAKER['open_until'] < time.time():
+                DX_BREAKER['pause'] = DX_BREAKER_PAUSE
+            return
+        DX_BREAKER['failures'] += 1
+        if DX_BREAKER['failures'] < DX_BREAKER_FAILURES:
+            return
+        DX_BREAKER['failures'] = 0
+        DX_BREAKER['trips'] += 1
+        DX_BREAKER['open_until'] = time.time() + DX_BREAKER['pause']
+        print >> sys.stderr, "WARNING: DNAnexus appears to be degraded.  Pausing all api calls for %d secs." % \
+                                                                                        DX_BREAKER['pause']
+        DX_BREAKER['pause'] = min(DX_BREAKER['pause'] * 2, DX_BREAKER_PAUSE_MAX)
+
+
+def dx_call(endpoint, call, idempotent=True):
+    '''
+    Makes one api call, retrying transient errors with jittered exponential backoff within the endpoint's
+    retry budget, and holding it while the circuit breaker is open.  Fatal errors are raised at once.
+    '''
+    with DX_RETRY_LOCK:
+        stats = DX_RETRY_STATS.setdefault(endpoint, { 'calls': 0, 'retries': 0, 'gave_up': 0, 'secs_lost': 0.0 })
+        stats['calls'] += 1
+    attempt = 0
+    while True:
+        dx_breaker_wait(stats)
+        try:
+            result = call()
+        except Exception as e:
+            transient = dx_error_retryable(e, idempotent)
+            dx_breaker_record(transient)
+            if not transient:
+                raise
+            attempt += 1
+            with DX_RETRY_LOCK:
+                if attempt >= DX_RETRY_MAX or stats['retries'] >= DX_RETRY_BUDGETS.get(endpoint, DX_RETRY_BUDGET):
+                    stats['gave_up'] += 1
+                    raise
+                delay = getattr(e, 'seconds_to_wait', None) # As asked for by a 503 Retry-After
+                if not isinstance(delay, (int, float)):
+                    delay = random.uniform(0, min(DX_RETRY_CAP, DX_RETRY_BASE * 2 ** (attempt - 1)))
+                stats['retries'] += 1
+                stats['secs_lost'] += delay
+            print >> sys.stderr, "WARNING: %s failed (%s), retry %d in %.1f secs" % (endpoint, str(e), attempt, delay)
+            time.sleep(delay)
+            continue
+        dx_breaker_record(False)
+        return result
+
+
+def install_resilience(api=None):
+    '''
+    Routes every dxpy api call (so every dx helper and every dxpy handler) through dx_call().  With the real dxpy
+    this wraps its DXHTTPRequest, whose own retries are then left to dx_call().  Safe to call more than once.
+    '''
+    if api == None:
+        api = dxpy.api
+    if getattr(api, 'dx_resilient', False):
+        return
+    request = getattr(api, 'DXHTTPRequest', None)
+    if request != None:
+        def resilient_request(resource, data, *args, **kwargs):
+            endpoint = dx_endpoint(resource)
+            idempotent = kwargs.get('always_retry', endpoint.split('/')[-1] not in DX_NON_IDEMPOTENT)
+            kwargs.setdefault('max_retries', 0)
+            return dx_call(endpoint, lambda: request(resource, data, *args, **kwargs), idempotent)
+        api.DXHTTPRequest = resilient_request
+    else:
+        def resilient_function(name, function):
+            endpoint = dx_endpoint(name)
+            idempotent = endpoint.split('/')[-1] not in DX_NON_IDEMPOTENT
+            def resilient(*args, **kwargs):
+                return dx_call(endpoint, lambda: function(*args, **kwargs), idempotent)
+            return resilient
+        for (name, function) in vars(api).items():
+            if isinstance(function, types.FunctionType) and not name.startswith('_') and '_' in name:
+                setattr(api, name, resilient_function(name, function))
+    api.dx_resilient = True
+
+
+def dx_retry_report(out=sys.stderr, always=False):
+    '''Prints the api retries made and the time lost to them, by endpoint (only if there were any).'''
+    retried = [ endpoint for endpoint in sorted(DX_RETRY_STATS.keys()) if DX_RETRY_STATS[endpoint]['retries'] > 0 ]
+    if not retried and DX_BREAKER['trips'] == 0 and not always:
+        return
+    print >> out, "DNAnexus api retries: %d, gave up: %d, secs lost: %.0f, breaker trips: %d" % \
+        (sum([ stats['retries'] for stats in DX_RETRY_STATS.values() ]),
+         sum([ stats['gave_up'] for stats in DX_RETRY_STATS.values() ]),
+         sum([ stats['secs_lost'] for stats in DX_RETRY_STATS.values() ]), DX_BREAKER['trips'])
+    for endpoint in retried:
+        stats = DX_RETRY_STATS[endpoint]
+        print >> out, "  %-32s calls %6d  retries %4d  gave up %3d  secs lost %6.0f" % \
+            (endpoint, stats['calls'], stats['retries'], stats['gave_up'], stats['secs_lost'])
+
+install_resilience()
+atexit.register(dx_retry_report)
+
 
 def env_get_current_project():
     ''' Returns the current project name for the command-line environment '''
@@ -55,6 +263,9 @@ def env_get_current_project():
 
 def project_has_folder(project, folder):
     ''' Checks for a folder in a given DX project '''
+    snapshot = find_folder_snapshot(project, folder)
+    if snapshot != None:
+        return snapshot.has_folder(folder)
     try:
         found = project.list_folder(folder)
     except:
@@ -109,6 +320,21 @@ def find_folder(target_folder,project,root_folders='/',exclude_folders=["depreca
     # Final normalize with target stripped of framing '/'
     target_folder = folder_normalize(target_folder,starting=False,trailing=False)
 
+    # A local mirror of the project may know the folder already
+    mirror = MIRRORS.get(project_id_of(project))
+    if mirror != None:
+        found = mirror.folder_snapshot().find_folder(target_folder,root_folders,exclude_folders)
+        if found != None:
+            # Only a mirror past its max_age is confirmed with the api (a sync would cost more than the listing)
+            if mirror.is_fresh() or project_has_folder(project, found):
+                return found
+            mirror.forget_folder(found) # Removed by others: a miss
+
+    # A snapshot of the folder tree can answer without any further api calls
+    snapshot = find_folder_snapshot(project, root_folders)
+    if snapshot != None:
+        return snapshot.find_folder(target_folder,root_folders,exclude_folders)
+
     # Because list_folder is only one level at a time, find_folder must recurse
     return rfind_folder(target_folder,project,root_folders,exclude_folders)
 
@@ -145,8 +371,237 @@ def rfind_folder(target_folder,project=None,root_folders='/',exclude_folders=[])
     return None
 
 
+class FolderSnapshot(object):
+    '''
+    In-memory snapshot of all folders beneath an umbrella folder of a DX project.
+    The snapshot is built from a single project describe (rather than one list_folder per level) and
+    holds a trie of folder names plus an index of experiment accession (ENCSR) folders to full paths.
+    Callers that create or remove folders must do so through project_new_folder()/project_remove_folder() (or tell
+    the snapshot via folder_created()/folder_removed()).  Changes made by anyone else are only seen once the
+    snapshot is FOLDER_SNAPSHOT_TTL seconds old and is rebuilt.
+    '''
+
+    def __init__(self, project_id, root='/'):
+        self.project_id = project_id
+        self.root = folder_normalize(root)
+        self.loaded = time.time()
+        self.trie = {}       # { 'long-RNA-seq': { 'runs': { ... } } }
+        self.exp_index = {}  # { 'ENCSR000AAA': [ '/long-RNA-seq/runs/GRCh38/ENCSR000AAA/' ] }
+
+    @classmethod
+    def from_folders(cls, project_id, root, folders):
+        '''Returns a snapshot built from an already known list of folders.'''
+        snapshot = cls(project_id, root)
+        for folder in folders:
+            if snapshot.covers(folder):
+                snapshot.add(folder)
+        return snapshot
+
+    def load(self):
+        '''Fills the snapshot with one api call for every folder in the project.'''
+        self.trie = {}
+        self.exp_index = {}
+        self.loaded = time.time()
+        described = dxpy.api.project_describe(self.project_id, {'folders': True})
+        for folder in described.get('folders',[]):
+            if folder_normalize(folder).startswith(self.root):
+                self.add(folder)
+        return self
+
+    def expired(self):
+        '''Returns True once the snapshot is too old to be trusted.'''
+        return time.time() - self.loaded > FOLDER_SNAPSHOT_TTL
+
+    def covers(self, folder):
+        '''Returns True if the folder lies at or beneath the root of this snapshot.'''
+        return folder_normalize(folder).startswith(self.root)
+
+    def _parts(self, folder):
+        '''Splits a folder into its names.'''
+        folder = folder_normalize(folder,starting=False,trailing=False)
+        if folder == '':
+            return []
+        return folder.split('/')
+
+    def _node(self, folder):
+        '''Returns the trie node for a folder or None if not found.'''
+        node = self.trie
+        for name in self._parts(folder):
+            node = node.get(name)
+            if node == None:
+                return None
+        return node
+
+    def add(self, folder):
+        '''Adds a folder (and any missing parents) to the snapshot.'''
+        node = self.trie
+        path = '/'
+        for name in self._parts(folder):
+            path += name + '/'
+            if name not in node:
+                node[name] = {}
+                if name.startswith('ENCSR'):
+                    self.exp_index.setdefault(name,[]).append(path)
+            node = node[name]
+
+    def remove(self, folder):
+        '''Removes a folder and everything beneath it from the snapshot.'''
+        parts = self._parts(folder)
+        if len(parts) == 0:
+            self.trie = {}
+            self.exp_index = {}
+            return
+        parent = self._node('/' + '/'.join(parts[:-1]))
+        if parent == None or parts[-1] not in parent:
+            return
+        del parent[parts[-1]]
+        removed = folder_normalize(folder)
+        for exp_id in self.exp_index.keys():
+            self.exp_index[exp_id] = [ path for path in self.exp_index[exp_id] if not path.startswith(removed) ]
+            if len(self.exp_index[exp_id]) == 0:
+                del self.exp_index[exp_id]
+
+    def has_folder(self, folder):
+        '''Returns True if the folder is in the snapshot.'''
+        return self._node(folder) != None
+
+    def sub_folders(self, folder):
+        '''Returns the full paths of the immediate sub-folders (as list_folder would), or None if not found.'''
+        node = self._node(folder)
+        if node == None:
+            return None
+        folder = folder_normalize(folder)
+        return [ folder + name for name in sorted(node.keys()) ]
+
+    def find_folder(self, target_folder, root_folders='/', exclude_folders=[]):
+        '''Same search as rfind_folder() but answered from the snapshot.  Returns normalized path or None.'''
+        targets = target_folder.split('/')
+        if targets[0].startswith('ENCSR'):
+            candidates = [ path for path in self.exp_index.get(targets[0],[]) if path.startswith(root_folders) ]
+            if len(candidates) == 0:
+                return None
+            if len(candidates) == 1:
+                parent = candidates[0][:-(len(targets[0]) + 1)]
+                for exclude_folder in exclude_folders:
+                    if parent.find(exclude_folder) != -1:
+                        return None
+                full_path = parent + target_folder + '/'
+                if self.has_folder(full_path):
+                    return full_path
+                return None
+        return self._rfind(target_folder, root_folders, exclude_folders)
+
+    def _rfind(self, target_folder, root_folders, exclude_folders):
+        '''Recursive search for find_folder, visiting sub-folders in the same order as rfind_folder().'''
+        for exclude_folder in exclude_folders:
+            if root_folders.find(exclude_folder) != -1:
+                return None
+        query_folders = self.sub_folders(root_folders)
+        if query_folders == None:
+            return None
+
+        targets = target_folder.split('/')
+        full_query = root_folders + targets[0]
+        if full_query in query_folders:
+            if len(targets) == 1:
+                return full_query + '/'
+            elif self.has_folder(root_folders + target_folder):
+                return root_folders + target_folder + '/'
+
+        for query_folder in query_folders:
+            found = self._rfind(target_folder, folder_normalize(query_folder), exclude_folders)
+            if found != None:
+                return found
+        return None
+
+
+def project_id_of(project):
+    '''Returns the project id from either a DXProject or a project id.'''
+    if isinstance(project, basestring):
+        return project
+    return project.get_id()
+
+
+def folder_snapshot(project, root='/', refresh=False):
+    '''Returns the folder tree snapshot for an umbrella folder in a project, building it if necessary.'''
+    key = (project_id_of(project), folder_normalize(root))
+    with FOLDER_SNAPSHOTS_LOCK: # Held while loading, so threads wanting the same snapshot share one describe
+        if refresh or key not in FOLDER_SNAPSHOTS or FOLDER_SNAPSHOTS[key].expired():
+            FOLDER_SNAPSHOTS[key] = FolderSnapshot(key[0], key[1]).load()
+        return FOLDER_SNAPSHOTS[key]
+
+
+def find_folder_snapshot(project, folder):
+    '''Returns the snapshot with the deepest root that covers a folder, or None if there is none.'''
+    proj_id = project_id_of(project)
+    found = None
+    with FOLDER_SNAPSHOTS_LOCK:
+        if len(FOLDER_SNAPSHOTS) == 0:
+            return None
+        for (snap_proj_id, root) in FOLDER_SNAPSHOTS.keys():
+            if snap_proj_id != proj_id or not folder_normalize(folder).startswith(root):
+                continue
+            if FOLDER_SNAPSHOTS[(snap_proj_id, root)].expired():
+                del FOLDER_SNAPSHOTS[(snap_proj_id, root)] # Rather ask DX than trust an old snapshot
+                continue
+            if found == None or len(root) > len(found.root):
+                found = FOLDER_SNAPSHOTS[(snap_proj_id, root)]
+    return found
+
+
+def folder_created(project, folder):
+    '''Records a newly created folder (and its parents) in any snapshots of the project.'''
+    proj_id = project_id_of(project)
+    with FOLDER_SNAPSHOTS_LOCK:
+        for (snap_proj_id, root) in FOLDER_SNAPSHOTS.keys():
+            snapshot = FOLDER_SNAPSHOTS[(snap_proj_id, root)]
+            if snap_proj_id == proj_id and snapshot.covers(folder):
+                snapshot.add(folder)
+
+
+def folder_removed(project, folder):
+    '''Removes a folder and all beneath it from any snapshots and the mirror of the project.'''
+    proj_id = project_id_of(project)
+    mirror = MIRRORS.get(proj_id)
+    if mirror != None:
+        mirror.forget_folder(folder)
+    invalidate_folder_listing(proj_id)
+    with FOLDER_SNAPSHOTS_LOCK:
+        for (snap_proj_id, root) in FOLDER_SNAPSHOTS.keys():
+            snapshot = FOLDER_SNAPSHOTS[(snap_proj_id, root)]
+            if snap_proj_id != proj_id:
+                continue
+            if snapshot.covers(folder):
+                snapshot.remove(folder)
+            elif root.startswith(folder_normalize(folder)): # umbrella itself is gone
+                del FOLDER_SNAPSHOTS[(snap_proj_id, root)]
+
+
+def project_new_folder(project, folder, parents=False):
+    '''Creates a folder in a project, recording it in any snapshots of the project.'''
+    created = project.new_folder(folder, parents=parents)
+    folder_created(project, folder)
+    return created
+
+
+def project_remove_folder(project, folder, recurse=False):
+    '''Removes a folder from a project, and from any snapshots and the mirror of the project.'''
+    proj_id = project_id_of(project)
+    dxpy.api.project_remove_folder(proj_id, { 'folder': folder, 'recurse': recurse })
+    folder_removed(proj_id, folder)
+
+
+def clear_folder_snapshots(project=None):
+    '''Discards folder snapshots for one project or for all projects.'''
+    with FOLDER_SNAPSHOTS_LOCK:
+        for key in FOLDER_SNAPSHOTS.keys():
+            if project == None or key[0] == project_id_of(project):
+                del FOLDER_SNAPSHOTS[key]
+
+
 def find_exp_folder(project,exp_id,results_folder='/',warn=False):
     '''Returns the full path to the experiment folder if found, else None.'''
+    folder_snapshot(project,results_folder) # one listing of the umbrella answers all experiments within
     target_folder = find_folder(exp_id,project,results_folder)
     if target_folder == None or target_folder == "":
         if warn:
@@ -159,9 +614,16 @@ def find_exp_folder(project,exp_id,results_folder='/',warn=False):
 def find_replicate_folders(project,exp_folder,verbose=False):
     '''Returns a sorted list of replicate folders which are sub-folders of an exp folder.'''
     # normalize
-    try:
-        sub_folders = project.list_folder(exp_folder,only='folders')['folders']
-    except:
+    sub_folders = None
+    snapshot = find_folder_snapshot(project, exp_folder)
+    if snapshot != None:
+        sub_folders = snapshot.sub_folders(exp_folder)
+    else:
+        try:
+            sub_folders = project.list_folder(exp_folder,only='folders')['folders']
+        except:
+            pass
+    if sub_folders == None:
         if verbose:
             print >> sys.stderr, "No subfolders found for %s" % exp_folder
         return []
@@ -178,15 +640,272 @@ def find_replicate_folders(project,exp_folder,verbose=False):
     return rep_folders
 
 
-def description_from_fid(fid,properties=False):
-    '''Returns file description object from fid.'''
+class SingleFlight(object):
+    '''Collapses concurrent calls for the same key into one: the first caller makes it, the rest share its result.'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def run(self, key, call):
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = (flight == None)
+            if leader:
+                flight = { 'done': threading.Event(), 'value': None, 'error': None }
+                self.flights[key] = flight
+        if not leader:
+            flight['done'].wait()
+            if flight['error'] != None:
+                raise flight['error']
+            return flight['value']
+        try:
+            flight['value'] = call()
+        except Exception as e:
+            flight['error'] = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight['done'].set()
+        return flight['value']
+
+
+CACHE_CONTEXT = threading.local() ## The cache_scope() each thread is working in
+
+
+@contextmanager
+def cache_scope(scope):
+    '''Tags everything cached by this thread within the block with scope (e.g. an experiment accession).'''
+    previous = getattr(CACHE_CONTEXT, 'scope', None)
+    CACHE_CONTEXT.scope = scope
     try:
-        dxlink = FILES[fid]
-    except:
-        #print >> sys.stderr, "File %s not cached, trying id" % fid)
-        dxlink = fid
+        yield scope
+    finally:
+        CACHE_CONTEXT.scope = previous
+
+
+def enter_cache_scope(scope):
+    '''Moves the calling thread into a new cache scope, first clearing what was cached in the scope it leaves.'''
+    previous = current_cache_scope()
+    if previous != None and previous != scope:
+        clear_cache(previous)
+    CACHE_CONTEXT.scope = scope
+
+
+def current_cache_scope():
+    '''Returns the cache_scope() the calling thread is in, or None.'''
+    return getattr(CACHE_CONTEXT, 'scope', None)
+
 
-    return dxpy.describe(dxlink,incl_properties=properties)
+class SharedCache(object):
+    '''
+    A thread-safe dict-like cache, holding at most 'size' entries (evicting the least recently used) if given one.
+    Values are loaded single-flight with load(), and entries remember the cache_scope() they were stored in so
+    one scope can be cleared without disturbing the others.
+    '''
+
+    def __init__(self, size=None):
+        self.size = size
+        self.entries = OrderedDict()
+        self.scopes = {}
+        self.lock = threading.RLock()
+        self.flights = SingleFlight()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            value = self.entries.pop(key)
+            self.entries[key] = value
+            return value
+
+    def put(self, key, value):
+        scope = current_cache_scope()
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            if scope != None:
+                self.scopes.setdefault(key, set()).add(scope)
+            while self.size != None and len(self.entries) > self.size:
+                (old_key, old_value) = self.entries.popitem(last=False)
+                self.scopes.pop(old_key, None)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            self.scopes.pop(key, None)
+            return self.entries.pop(key, default)
+
+    def load(self, key, loader, valid=None, flight=None):
+        '''
+        Returns the cached value for key (if valid(value) when given), else stores and returns loader().
+        Concurrent loads for the same key (or flight) call loader() only once.
+        '''
+        value = self.get(key)
+        if value != None and (valid == None or valid(value)):
+            return value
+        def load_and_store():
+            value = self.get(key) # Another thread may have stored it while this one waited
+            if value == None or (valid != None and not valid(value)):
+                value = loader()
+                self.put(key, value)
+            return value
+        return self.flights.run(key if flight == None else flight, load_and_store)
+
+    def clear(self, scope=None):
+        '''Empties the cache, or only what was stored within a scope.'''
+        with self.lock:
+            if scope == None:
+                self.entries.clear()
+                self.scopes.clear()
+                return
+            for (key, scopes) in self.scopes.items():
+                if scope in scopes:
+                    self.entries.pop(key, None)
+                    del self.scopes[key]
+
+    def keys(self):
+        with self.lock:
+            return self.entries.keys()
+
+    def items(self):
+        with self.lock:
+            return self.entries.items()
+
+    def __getitem__(self, key):
+        with self.lock:
+            return self.entries[key]
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def __delitem__(self, key):
+        with self.lock:
+            self.scopes.pop(key, None)
+            del self.entries[key]
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+REFERENCE_FILES = SharedCache() ## Cache of known Reference Files keyed by (name, project name)
+FILES = SharedCache() ## Cache of file links keyed by fid
+APPLETS = SharedCache() ## Cache of known applets keyed by (name, project id)
+FOLDER_LISTINGS = SharedCache() ## Cache of file listings keyed by (project id, folder)
+DESCRIPTIONS = SharedCache(DESCRIBE_CACHE_SIZE) ## File descriptions keyed by fid
+PROJECT_NAMES = SharedCache() ## Project names keyed by project id
+DESCRIBE_QUEUE = [] ## (fid, project id) waiting to be described in bulk
+DESCRIBE_LOCK = threading.Lock() ## Guards DESCRIBE_QUEUE
+
+
+def fid_project(fid):
+    '''Returns the project a fid is known to be in from the FILES cache, else None.'''
+    link = FILES.get(fid)
+    if isinstance(link, dict):
+        link = link.get('$dnanexus_link', link)
+        if isinstance(link, dict):
+            return link.get('project')
+    return None
+
+
+def queue_describe(fids, proj_id=None):
+    '''Queues fids for the next bulk describe, skipping any already described.'''
+    for fid in fids:
+        project = proj_id
+        if project == None:
+            project = fid_project(fid)
+        desc = DESCRIPTIONS.get(fid)
+        if desc != None and (project == None or desc.get('project') == project):
+            continue
+        with DESCRIBE_LOCK:
+            if (fid, project) not in DESCRIBE_QUEUE:
+                DESCRIBE_QUEUE.append( (fid, project) )
+
+
+def flush_describe_queue():
+    '''Describes all queued fids, DESCRIBE_CHUNK at a time, with one api call per chunk.'''
+    fields = {}
+    for field in DESCRIBE_FIELDS:
+        fields[field] = True
+    while True:
+        with DESCRIBE_LOCK:
+            chunk = DESCRIBE_QUEUE[:DESCRIBE_CHUNK]
+            del DESCRIBE_QUEUE[:DESCRIBE_CHUNK]
+        if len(chunk) == 0:
+            break
+        objects = []
+        for (fid, project) in chunk:
+            obj = { 'id': fid, 'describe': { 'fields': fields } }
+            if project != None:
+                obj['project'] = project
+            objects.append(obj)
+        results = dxpy.api.system_describe_data_objects({ 'objects': objects })['results']
+        for ((fid, project), result) in zip(chunk, results):
+            if result != None and 'describe' in result:
+                DESCRIPTIONS.put(fid, result['describe'])
+
+
+def describe_files(fids, proj_id=None):
+    '''Returns descriptions for a list of fids, describing any not yet cached in bulk.'''
+    queue_describe(fids, proj_id)
+    flush_describe_queue()
+    return [ description_from_fid(fid) for fid in fids ]
+
+
+def forget_descriptions(fids):
+    '''Drops cached descriptions, as when files are moved, cloned or removed.'''
+    for fid in fids:
+        DESCRIPTIONS.pop(fid)
+    for mirror in MIRRORS.values():
+        mirror.forget(fids)
+
+
+def cached_description(fid, proj_id=None, partial_ok=False):
+    '''
+    Returns the cached description of a fid (in the proj_id context if given), describing it if needed.
+    With partial_ok, an enabled mirror's description may do, which lacks details, created, types, tags and media.
+    '''
+    if proj_id == None:
+        proj_id = fid_project(fid)
+    desc = DESCRIPTIONS.get(fid)
+    if desc == None and partial_ok:
+        desc = mirror_description(fid, proj_id)
+    if desc != None and (proj_id == None or desc.get('project') == proj_id):
+        return desc
+
+    def describe():
+        queue_describe([fid], proj_id)
+        flush_describe_queue()
+        desc = DESCRIPTIONS.get(fid)
+        if desc == None or (proj_id != None and desc.get('project') != proj_id):
+            # Not described in bulk, so let dxpy describe (or raise) as it always has
+            if proj_id != None:
+                desc = dxpy.describe(fid, project=proj_id, incl_properties=True, incl_details=True)
+            else:
+                desc = dxpy.describe(fid, incl_properties=True, incl_details=True)
+        return desc
+    # Threads wanting the same fid (in the same project context) share one describe
+    return DESCRIPTIONS.load(fid, describe, valid=lambda desc: proj_id == None or desc.get('project') == proj_id,
+                             flight=(fid, proj_id))
+
+
+def description_from_fid(fid,properties=False):
+    '''Returns file description object from fid.'''
+    # Properties and details are always included; a copy is returned so callers may change it.
+    desc = dict(cached_description(fid))
+    for field in [ 'properties', 'details' ]:
+        if field in desc:
+            desc[field] = copy.deepcopy(desc[field])
+    changes = pending_changes(fid, desc.get('project'))
+    if len(changes) > 0: # Properties as they will be once buffered changes are flushed
+        properties = desc.get('properties') or {}
+        properties.update(changes)
+        desc['properties'] = dict([ (k, v) for (k, v) in properties.items() if v != None ])
+    return desc
 
 
 def file_handler_from_fid(fid):
@@ -198,6 +917,91 @@ def file_handler_from_fid(fid):
     return dxpy.get_handler(dxlink)
 
 
+class LocalContent(object):
+    '''
+    File-like reader of a locally cached DX file.  Iteration yields lines without their newline, as iterating
+    a dxpy DXFile does, so the two can be used interchangeably.
+    '''
+
+    def __init__(self, path):
+        self.fh = open(path, 'rb')
+
+    def read(self, size=-1):
+        return self.fh.read(size)
+
+    def __iter__(self):
+        for line in self.fh:
+            yield line.rstrip('\n')
+
+    def close(self):
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def cached_content_path(fid, proj_id=None):
+    '''
+    Returns the path of a local copy of a small closed DX file, streaming it down in chunks if not yet cached.
+    Returns None for files that are open or larger than CONTENT_FILE_MAX.
+    '''
+    path = os.path.join(CONTENT_CACHE_DIR, fid)
+    if os.path.isfile(path):
+        os.utime(path, None) # Recently used
+        return path
+    desc = cached_description(fid, proj_id, partial_ok=True)
+    if desc.get('state') != 'closed' or desc.get('size', CONTENT_FILE_MAX + 1) > CONTENT_FILE_MAX:
+        return None
+    if not os.path.isdir(CONTENT_CACHE_DIR):
+        os.makedirs(CONTENT_CACHE_DIR)
+    tmp_path = path + '.' + str(os.getpid())
+    with dxpy.open_dxfile(fid, project=desc.get('project')) as stream:
+        with open(tmp_path, 'wb') as fh:
+            for chunk in iter(lambda: stream.read(CONTENT_CHUNK), ''):
+                fh.write(chunk)
+    os.rename(tmp_path, path)
+    content_cache_evict()
+    return path
+
+
+def content_cache_evict(max_bytes=None):
+    '''Removes the least recently used local copies until the content cache holds no more than max_bytes.'''
+    if max_bytes == None:
+        max_bytes = CONTENT_CACHE_MAX
+    cached = []
+    for name in os.listdir(CONTENT_CACHE_DIR):
+        path = os.path.join(CONTENT_CACHE_DIR, name)
+        if name.find('.') == -1 and os.path.isfile(path): # Skip any partial downloads
+            stat = os.stat(path)
+            cached.append( (stat.st_mtime, stat.st_size, path) )
+    total = sum([ size for (used, size, path) in cached ])
+    for (used, size, path) in sorted(cached):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def open_cached(fid, proj_id=None):
+    '''
+    Opens a DX file for reading, from its local copy when it is small enough to keep one, otherwise streamed
+    from DX.  Either way the result can be read(), iterated by line and used in a with statement.
+    '''
+    try:
+        path = cached_content_path(fid, proj_id)
+    except (IOError, OSError):
+        path = None # Can't keep a local copy, so just stream it
+    if path != None:
+        return LocalContent(path)
+    return dxpy.open_dxfile(fid, project=proj_id)
+
+
 def job_from_fid(fid):
     '''Returns job decription from fid.'''
     try:
@@ -207,6 +1011,170 @@ def job_from_fid(fid):
     except:
         return None
 
+WATCH_INTERVAL_MIN = 1 ## Seconds between polls while executions are changing state
+WATCH_INTERVAL_MAX = 30 ## Most seconds between polls while nothing is changing
+WATCH_BACKOFF = 1.5 ## Factor the poll interval grows by each time a poll finds nothing new
+WATCH_FIELDS = [ 'id', 'class', 'name', 'state', 'output', 'failureReason', 'failureMessage',
+                 'project', 'folder', 'createdAt', 'modified' ]
+''' The execution fields fetched by each ExecutionWatcher poll.'''
+WATCH_CHUNK = 1000 ## Most execution ids the system findExecutions api is asked about in one call
+EXECUTION_DONE_STATES = [ 'done' ]
+EXECUTION_FAILED_STATES = [ 'failed', 'terminated' ]
+
+
+class WatchedExecution(object):
+    '''A job or analysis being followed by an ExecutionWatcher: a future holding its latest description.'''
+
+    def __init__(self, exe_id):
+        self.id = exe_id
+        self.state = None
+        self.desc = None
+        self.callbacks = []
+        self.error = None  # What a callback raised, if any
+
+    def done(self):
+        '''True once the execution has reached a terminal state (done, failed or terminated).'''
+        return self.state in EXECUTION_DONE_STATES or self.state in EXECUTION_FAILED_STATES
+
+    def succeeded(self):
+        '''True if the execution finished in the done state.'''
+        return self.state in EXECUTION_DONE_STATES
+
+    def result(self):
+        '''Returns the execution's output once done, or None if it failed or has not finished.'''
+        if not self.succeeded():
+            return None
+        return self.desc.get('output')
+
+
+class ExecutionWatcher(object):
+    '''
+    Follows the state of many jobs and analyses with one batched findExecutions call per poll (rather than
+    a wait_on_done() loop per execution), polling quickly while states change and backing off while they
+    don't.  Callbacks registered with watch() are called with the WatchedExecution as each one finishes.  A callback
+    that raises does not stop the others: the exception is reported and kept in the WatchedExecution's error.
+    '''
+
+    def __init__(self, min_interval=WATCH_INTERVAL_MIN, max_interval=WATCH_INTERVAL_MAX, fields=WATCH_FIELDS,
+                 verbose=False):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.fields = fields
+        self.verbose = verbose
+        self.executions = OrderedDict()
+        self.polls = 0
+
+    def watch(self, exe_id, callback=None):
+        '''Starts watching a job or analysis (by id, handler or WatchedExecution).  Returns its WatchedExecution.'''
+        if isinstance(exe_id, WatchedExecution):
+            exe_id = exe_id.id
+        elif not isinstance(exe_id, basestring):
+            exe_id = exe_id.get_id()
+        watched = self.executions.get(exe_id)
+        if watched == None:
+            watched = WatchedExecution(exe_id)
+            self.executions[exe_id] = watched
+        if callback != None:
+            watched.callbacks.append(callback)
+        return watched
+
+    def pending(self):
+        '''Returns the watched executions which have not yet finished.'''
+        return [ watched for watched in self.executions.values() if not watched.done() ]
+
+    def _describe_executions(self, ids):
+        '''Returns { id: description } for the executions, as few api calls as possible.'''
+        described = {}
+        describe = { 'fields': dict([ (field, True) for field in self.fields ]) }
+        for start in range(0, len(ids), WATCH_CHUNK):
+            chunk = ids[start:start + WATCH_CHUNK]
+            query = { 'id': chunk, 'describe': describe, 'limit': len(chunk) }
+            try:
+                while True:
+                    found = dxpy.api.system_find_executions(query)
+                    for result in found.get('results', []):
+                        described[result['id']] = result.get('describe', {})
+                    if found.get('next') == None:
+                        break
+                    query['starting'] = found['next']
+            except dxpy.exceptions.DXAPIError:
+                # Fall back to describing them one by one
+                for exe_id in chunk:
+                    if exe_id in described:
+                        continue
+                    if exe_id.startswith('analysis-'):
+                        described[exe_id] = dxpy.api.analysis_describe(exe_id)
+                    else:
+                        described[exe_id] = dxpy.api.job_describe(exe_id)
+        return described
+
+    def poll(self):
+        '''Refreshes every unfinished execution once.  Returns those which finished with this poll.'''
+        pending = self.pending()
+        if len(pending) == 0:
+            return []
+        self.polls += 1
+        described = self._describe_executions([ watched.id for watched in pending ])
+        finished = []
+        for watched in pending:
+            desc = described.get(watched.id)
+            if desc == None:
+                continue
+            watched.desc = desc
+            watched.state = desc.get('state')
+            if watched.done():
+                finished.append(watched)
+        for watched in finished:
+            if self.verbose:
+                print >> sys.stderr, "%s %s is %s" % (watched.id, watched.desc.get('name',''), watched.state)
+            for callback in watched.callbacks:
+                try:
+                    callback(watched)
+                except Exception as e:
+                    watched.error = e
+                    print >> sys.stderr, "ERROR: Following up on %s: %s" % (watched.id, str(e))
+        return finished
+
+    def as_completed(self, executions=None, timeout=None):
+        '''
+        Yields each watched execution (or those given) as it finishes, polling until all have finished.
+        Raises dxpy.exceptions.DXError if timeout seconds go by first.
+        '''
+        if executions == None:
+            executions = self.executions.values()
+        waiting = set([ self.watch(exe).id for exe in executions ])
+        for exe_id in list(waiting):
+            if self.executions[exe_id].done():
+                waiting.discard(exe_id)
+                yield self.executions[exe_id]
+        interval = self.min_interval
+        start = time.time()
+        while len(waiting) > 0:
+            finished = self.poll()
+            for watched in finished:
+                if watched.id in waiting:
+                    waiting.discard(watched.id)
+                    yield watched
+            if len(waiting) == 0:
+                break
+            if len(finished) > 0:
+                interval = self.min_interval
+            else:
+                interval = min(interval * WATCH_BACKOFF, self.max_interval)
+            if timeout != None and time.time() + interval - start > timeout:
+                raise dxpy.exceptions.DXError("Timed out waiting on %d executions." % len(waiting))
+            time.sleep(interval)
+
+    def wait(self, executions=None, timeout=None):
+        '''Polls until every watched execution (or those given) has finished.  Returns them in watch order.'''
+        if executions == None:
+            executions = self.executions.values()
+        watched = [ self.watch(exe) for exe in executions ]
+        for finished in self.as_completed(watched, timeout=timeout):
+            pass
+        return watched
+
+
 
 def file_path_from_fid(fid,projectToo=False):
     '''Returns full dx path to file from a file id.'''
@@ -216,21 +1184,143 @@ def file_path_from_fid(fid,projectToo=False):
     else:
         path = fileDict['folder'] + '/' + fileDict['name']
     if projectToo:
-        projDict = dxpy.describe(fileDict['project'])
-        path = projDict['name'] + ':' + path
+        path = project_name_from_id(fileDict['project']) + ':' + path
     return path
 
 
+def project_name_from_id(proj_id):
+    '''Returns the name of a project from its id.'''
+    return PROJECT_NAMES.load(proj_id,
+                              lambda: dxpy.api.project_describe(proj_id, {'fields': {'name': True}})['name'])
+
+
+def json_cache_save(path, obj, what):
+    '''Atomically writes a json cache file, warning rather than failing if it cannot be written.'''
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        tmp_file = path + '.' + str(os.getpid())
+        with open(tmp_file, 'w') as fh:
+            json.dump(obj, fh)
+        os.rename(tmp_file, path)
+    except (IOError, OSError):
+        print >> sys.stderr, "WARNING: Unable to save %s to %s" % (what, path)
+
+
+def names_load():
+    '''Returns the name resolution cache, reading it from disk the first time.'''
+    global NAMES
+    if NAMES == None:
+        NAMES = {}
+        try:
+            with open(NAMES_FILE, 'r') as fh:
+                NAMES = json.load(fh)
+        except (IOError, ValueError):
+            pass
+        if NAMES.get('version') != NAMES_VERSION:
+            NAMES = { 'version': NAMES_VERSION, 'projects': {}, 'applets': {}, 'references': {} }
+    return NAMES
+
+
+def names_save():
+    '''Writes the name resolution cache to disk.'''
+    json_cache_save(NAMES_FILE, names_load(), "name resolution cache")
+
+
+def names_forget(kind=None, proj_id=None):
+    '''Discards cached name resolutions: all of them, one kind ('projects', 'applets', 'references') or one catalog.'''
+    names = names_load()
+    for cached_kind in [ 'projects', 'applets', 'references' ]:
+        if kind != None and kind != cached_kind:
+            continue
+        if proj_id != None:
+            names[cached_kind].pop(proj_id, None)
+        else:
+            names[cached_kind] = {}
+    names_save()
+
+
+def resolve_project_id(project_name, level=None):
+    '''Returns the id of the one project with this name, from the name resolution cache when possible.'''
+    names = names_load()
+    key = project_name + '|' + str(level)
+    entry = names['projects'].get(key)
+    if entry == None or time.time() - entry['cached'] > NAMES_TTL:
+        project = dxpy.find_one_project(name=project_name, name_mode='exact', level=level, return_handler=False)
+        entry = { 'id': project['id'], 'cached': time.time() }
+        names['projects'][key] = entry
+        PROJECT_NAMES[project['id']] = project_name
+        names_save()
+    return entry['id']
+
+
+def name_catalog(kind, proj_id):
+    '''
+    Returns { name: [ [ id, folder ], ... ] } for every applet ('applets') or file ('references') in a project.
+    Each catalog is built with one recursive listing and kept on disk.  A catalog older than NAMES_TTL is rebuilt,
+    and the first use in a process rebuilds it if anything in the project has been modified since it was built.
+    '''
+    names = names_load()
+    classname = 'applet' if kind == 'applets' else 'file'
+    catalog = names[kind].get(proj_id)
+    if catalog != None and time.time() - catalog['cached'] > NAMES_TTL:
+        catalog = None
+    if catalog != None and (kind, proj_id) not in NAMES_CHECKED:
+        changed = list(dxpy.find_data_objects(classname=classname, project=proj_id, folder='/', recurse=True,
+                                              modified_after=int(catalog['cached'] * 1000) - ProjectMirror.SYNC_SKEW_MS,
+                                              limit=1, return_handler=False))
+        if len(changed) > 0:
+            catalog = None
+    if catalog == None:
+        catalog = { 'cached': time.time(), 'names': {} }
+        for found in dxpy.find_data_objects(classname=classname, project=proj_id, folder='/', recurse=True,
+                                            describe={ 'fields': { 'name': True, 'folder': True } },
+                                            return_handler=False):
+            catalog['names'].setdefault(found['describe']['name'], []).append([ found['id'],
+                                                                              found['describe']['folder'] ])
+        names[kind][proj_id] = catalog
+        names_save()
+    NAMES_CHECKED.add((kind, proj_id))
+    return catalog['names']
+
+
+def objects_exist(obj_ids, proj_id):
+    '''Returns True if every object is still in the project, asking with one bulk describe.'''
+    objects = [ { 'id': obj_id, 'project': proj_id, 'describe': { 'fields': { 'id': True } } } for obj_id in obj_ids ]
+    try:
+        results = dxpy.api.system_describe_data_objects({ 'objects': objects })['results']
+    except dxpy.exceptions.ResourceNotFound:
+        return False
+    return len([ result for result in results if result != None and 'describe' in result ]) == len(obj_ids)
+
+
+def catalog_entries(kind, proj_id, name):
+    '''
+    Returns the [ [ id, folder ], ... ] a name catalog holds for a name, once confirmed to still exist.
+    Removals leave nothing modified_after can find, so a catalog naming a removed object is rebuilt.
+    '''
+    found = name_catalog(kind, proj_id).get(name, [])
+    if len(found) == 0 or objects_exist([ obj_id for (obj_id, folder) in found ], proj_id):
+        return found
+    names_forget(kind, proj_id)
+    NAMES_CHECKED.discard((kind, proj_id))
+    return name_catalog(kind, proj_id).get(name, [])
+
+
+def preload_reference_files(project_name=REF_PROJECT_DEFAULT):
+    '''Lists every reference file in the reference project at once, so later lookups need no api calls.'''
+    return name_catalog('references', resolve_project_id(project_name))
+
+
 def get_project(projectName, level=None):
     '''Returns the DXProject by name or errors out if not found.'''
     try:
-        project = dxpy.find_one_project(name=projectName, name_mode='exact',
-                                        level=level, return_handler=False)
+        proj_id = resolve_project_id(projectName, level=level)
     except:
         print "Could not find 1 and only 1 project named '"+projectName+"'."
         sys.exit(1)
 
-    return dxpy.DXProject(project['id'])
+    return dxpy.DXProject(proj_id)
 
 def find_or_create_folder(project, sub_folder, root_folder='/'):
     ''' Finds or creates a sub_folder in the specified parent (root) folder'''
@@ -239,25 +1329,108 @@ def find_or_create_folder(project, sub_folder, root_folder='/'):
         return folder
     else:
         print >> sys.stderr, "Creating %s" % (folder)
-        return project.new_folder(folder)
+        return project_new_folder(project, folder)
+
+def materialize_folders(project, folders, test=False):
+    '''
+    Makes sure every folder in a batch exists, returning the (normalized) folders that were (or in test would be)
+    created, parents included.  Where an existing snapshot covers a folder, only what it lacks is created, the
+    deepest missing folders each with parents=True.  No snapshot is built for this: a folder no snapshot covers
+    is simply created with parents=True, and is returned as created whether or not it was already there.
+    '''
+    folders = [ folder_normalize(folder) for folder in folders ]
+    missing = set()
+    uncovered = []
+    for folder in folders:
+        snapshot = find_folder_snapshot(project, folder)
+        if snapshot == None:
+            if folder not in uncovered:
+                uncovered.append(folder)
+            continue
+        while snapshot.covers(folder) and folder != '/' and not snapshot.has_folder(folder) and folder not in missing:
+            missing.add(folder)
+            folder = folder[:folder[:-1].rfind('/') + 1]
+    if test:
+        uncovered = [ folder for folder in uncovered if not project_has_folder(project, folder) ]
+    missing.update(uncovered)
+    leaves = [ folder for folder in missing if not [ other for other in missing \
+                                                       if other != folder and other.startswith(folder) ] ]
+    if not test:
+        for leaf in sorted(leaves):
+            project_new_folder(project, leaf, parents=True)
+    return sorted(missing)
+
 
 def move_files(fids, folder, projectId):
     '''Moves files to supplied folder.  Expected to be in the same project.'''
-    for fid in fids:
-        try:
-            dxlink = FILES[fid]
-        except:
-            #print >> sys.stderr, "File %s not in cache, trying id" % fid
-            dxlink = fid
-        fileDict = dxpy.describe(dxlink) # FILES contain dxLinks
-        if fileDict['project'] != projectId:
-            print >> sys.stderr, "ERROR: Failed to move '" + fileDict['name'] + "' as it is not in '" + \
-                                                                                projectId + "'."
-            sys.exit(1)
+    transfer_files({ folder: fids }, projectId, move=True)
+
+
+def transfer_files(fids_by_folder, projectId, move=False, overwrite=False):
+    '''
+    Bulk copies (or moves) files into folders of a project, given { folder: [ fids ] }.
+    All files are described at once and each target folder is checked for existing files with one listing.
+    Clones are made with one project clone call per (source project, target folder) and moves with one
+    project move call per target folder.  Returns { folder: [ new fids ] } with fids in the order given.
+    '''
+    all_fids = []
+    for fids in fids_by_folder.values():
+        all_fids.extend(fids)
+    descriptions = dict([ (desc['id'], desc) for desc in describe_files(all_fids) ])
     proj = dxpy.DXProject(projectId)
-    if not project_has_folder(proj, folder):
-        proj.new_folder(folder,parents=True)
-    proj.move(folder,fids)
+    if move:
+        for fid in all_fids:
+            if descriptions[fid]['project'] != projectId:
+                print >> sys.stderr, "ERROR: Failed to move '" + descriptions[fid]['name'] + "' as it is not in '" + \
+                                                                                projectId + "'."
+                sys.exit(1)
+
+    new_fids_by_folder = {}
+    if move:
+        materialize_folders(proj, fids_by_folder.keys())
+    for folder in fids_by_folder.keys():
+        fids = fids_by_folder[folder]
+        if move:
+            proj.move(folder,fids)
+            new_fids_by_folder[folder] = list(fids)
+            continue
+
+        # Check to see if files already exist, with one listing of the target folder
+        already_there = {}
+        if project_has_folder(proj, folder):
+            for rec in folder_listing(projectId, folder):
+                already_there.setdefault(rec['name'], rec['id'])
+        new_fids = {}
+        to_clone = {} # { source_project: [ fids ] }
+        for fid in fids:
+            fileDict = descriptions[fid]
+            if fileDict['project'] == projectId:
+                # cannot copy into the same project!!!
+                # so just leave in place and pretend that we did!
+                new_fids[fid] = fid
+            elif fileDict['name'] in already_there and not overwrite:
+                new_fids[fid] = already_there[fileDict['name']]
+            else:
+                to_clone.setdefault(fileDict['project'], []).append(fid)
+        for source_project in to_clone.keys():
+            try:
+                dxpy.api.project_clone(source_project, { 'objects': to_clone[source_project], 'project': projectId,
+                                                         'destination': folder, 'parents': True })
+            except dxpy.exceptions.DXAPIError:
+                print "ERROR: Failed in copy of " + str(len(to_clone[source_project])) + " file(s) from '" + \
+                        source_project + "' to '" + projectId + ":" + folder + "'."
+                sys.exit(1)
+            for fid in to_clone[source_project]:
+                new_fids[fid] = fid # clones keep their id
+        if len(to_clone) > 0:
+            folder_created(proj, folder)
+        for fid in new_fids.values():
+            FILES[fid] = dxpy.dxlink(fid, projectId)
+        new_fids_by_folder[folder] = [ new_fids[fid] for fid in fids ]
+
+    invalidate_folder_listing(projectId) # files have left (or joined) folders
+    forget_descriptions(all_fids)
+    return new_fids_by_folder
 
 
 def find_target_file_set(fileSet,targetFolder,project=None):
@@ -324,59 +1497,128 @@ def find_file_set(fileSet,projectId=None):
 
 def copy_files(fids, projectId, folder, overwrite=False):
     '''Copies array of dx file dicts to project:/folder, returning new array of dx file dicts.'''
-    newFids = []
-    for fid in fids:
-        fileDict = dxpy.describe(FILES[fid]) # FILES contain dxLinks
-        if fileDict['project'] == projectId:
-            # cannot copy into the same project!!!
-            # so just leave in place and pretend that we did!
-            #proj = dxpy.DXProject(projectId)
-            #proj.move(folder,[fid])
-            newFids.append( fid )
-            continue
-
-        # Check to see if file already exists.
-        alreadyThere = find_file(folder+'/'+fileDict['name'],projectId)
-        if alreadyThere is None or overwrite:
-            # remove what is alreadyThere?
-            #if alreadyThere is not None:
-            #    proj = dxpy.DXProject(projectId)
-            #    proj.remove_objects([alreadyThere])
-            dxFile = dxpy.get_handler(FILES[fid])
-            newLink = dxpy.dxlink(dxFile.clone(projectId, folder))
-        else:
-            newLink = FILES(alreadyThere)
-        if newLink == None:
-            print "ERROR: Failed in copy of '" + fileDict['project'] + ":" + fileDict['name'] + \
-                    "' to '" + projectId + ":" + folder + "'."
-            sys.exit(1)
-        newDict = dxpy.describe(newLink)
-        FILES[newDict['id']] = newLink
-        newFids.append( newDict['id'] )
-
-    return newFids
+    return transfer_files({ folder: fids }, projectId, overwrite=overwrite)[folder]
 
 def resolve_project(project_name, level=None):
     ''' Convert project name into DXProject object '''
     try:
-        project = dxpy.find_one_project(name=project_name, name_mode='exact',
-                                        level=level, return_handler=False)
+        proj_id = resolve_project_id(project_name, level=level)
     except:
         print 'Could not find 1 and only 1 project named %s; ' % format(project_name)
         sys.exit(1)
 
-    return dxpy.DXProject(project['id'])
+    return dxpy.DXProject(proj_id)
 
 
 def get_file_link(fid, project=None):
     ''' returns a dxlink from cache or directly'''
-    if not FILES.get(fid):
-        FILES[fid] = dxpy.dxlink(fid,project=None)
+    return FILES.load(fid, lambda: dxpy.dxlink(fid,project=None))
 
-    return FILES[fid]
+def explain_queries(explain=True):
+    '''Turns on (or off) reporting, on stderr, of how each find_file() lookup is answered.'''
+    global FIND_EXPLAIN
+    FIND_EXPLAIN = explain
 
-def find_file(filePath,project=None,verbose=False,multiple=False, recurse=True):
-    '''Using a DX style file path, find the file.'''
+
+def has_wildcards(text):
+    '''Returns True if a DX style name or folder holds glob wildcards.'''
+    return text.find('*') != -1 or text.find('?') != -1
+
+
+class FindPlan(object):
+    '''
+    How one find_file() lookup will be answered.  Names without wildcards are looked up in 'exact' mode, others
+    in 'glob' mode.  A folder with wildcards is searched from its deepest folder without any (with recurse)
+    and the folders found are then matched locally.  The lookup goes to the first source able to answer it:
+    the reference file catalog, a project mirror, a cached folder listing and, failing those, the server.
+    '''
+
+    def __init__(self, projId, folder, fileName, recurse=True, use_refs=False):
+        self.projId = projId
+        self.name = fileName
+        self.mode = 'glob' if has_wildcards(fileName) else 'exact'
+        self.folder = folder_normalize(folder,trailing=False) or '/'
+        self.recurse = recurse
+        self.folder_matcher = None
+        if has_wildcards(self.folder):
+            self.folder_matcher = glob_to_regex(self.folder)
+            scope = []
+            for part in self.folder.split('/')[1:]:
+                if has_wildcards(part):
+                    break
+                scope.append(part)
+            self.folder = '/' + '/'.join(scope)
+            self.recurse = True
+        self.use_refs = use_refs and self.mode == 'exact' and self.folder_matcher == None
+        self.source = 'server'
+        if self.use_refs:
+            self.source = 'references'
+        elif self.folder_matcher == None and projId in MIRRORS:
+            self.source = 'mirror'
+        elif self.folder_matcher == None and not self.recurse:
+            self.source = 'listing'
+
+    def query(self):
+        '''Returns the find_data_objects() arguments used should the lookup go to the server.'''
+        query = { 'classname': 'file', 'project': self.projId, 'folder': self.folder, 'recurse': self.recurse,
+                  'name': self.name, 'name_mode': self.mode, 'return_handler': False }
+        if self.folder_matcher != None:
+            query['describe'] = { 'fields': { 'folder': True } }
+        return query
+
+    def explain(self, answered_by=None):
+        '''Returns a one line description of the plan (and what answered it).'''
+        text = "find_file: %s name '%s' in %s:%s%s" % (self.mode, self.name, self.projId, self.folder,
+                                                         " (recurse)" if self.recurse else "")
+        if self.folder_matcher != None:
+            text += " matching folders " + self.folder_matcher.pattern
+        text += " via " + (answered_by or self.source)
+        if (answered_by or self.source) == 'server':
+            query = self.query()
+            text += " " + json.dumps(dict([ (key, query[key]) for key in query.keys() \
+                                            if key not in [ 'classname', 'return_handler' ] ]), sort_keys=True)
+        return text
+
+    def run(self):
+        '''Answers the lookup, returning a list of { 'project', 'id' } dicts.'''
+        fileDicts = None
+        answered_by = self.source
+        if self.source == 'references':
+            fileDicts = [ { 'id': fid, 'project': self.projId } for (fid, folder) in \
+                          catalog_entries('references', self.projId, self.name) \
+                          if _folder_within(folder, self.folder, self.recurse) ]
+            if len(fileDicts) == 0:
+                fileDicts = None # Perhaps too new for the catalog
+        if fileDicts == None and self.folder_matcher == None and self.projId in MIRRORS:
+            answered_by = 'mirror'
+            fileDicts = MIRRORS[self.projId].find_files(self.folder, self.name, self.mode, self.recurse)
+            if len(fileDicts) == 0:
+                fileDicts = None # Perhaps too new for the mirror
+            else:
+                fileDicts = mirror_verified(self.projId, fileDicts) # None if stale
+        if fileDicts == None and self.folder_matcher == None and not self.recurse:
+            answered_by = 'listing'
+            fileDicts = find_in_folder_listing(self.projId, self.folder, self.name, self.mode)
+        if fileDicts == None:
+            answered_by = 'server'
+            fileDicts = list(dxpy.find_data_objects(**self.query()))
+            if self.folder_matcher != None:
+                fileDicts = [ { 'project': found['project'], 'id': found['id'] } for found in fileDicts \
+                              if self.folder_matcher.match(found['describe']['folder']) ]
+        if FIND_EXPLAIN:
+            print >> sys.stderr, self.explain(answered_by) + " found %d" % len(fileDicts)
+        return fileDicts
+
+
+def _folder_within(folder, scope, recurse):
+    '''Returns True if folder is the scope folder or, with recurse, anywhere beneath it.'''
+    if folder == scope:
+        return True
+    return recurse and (scope == '/' or folder.startswith(scope + '/'))
+
+
+def plan_find_file(filePath, project=None, recurse=True):
+    '''Returns the FindPlan for a DX style file path, or None if the project is unknown.'''
     proj = project
     path = filePath
     fileName = filePath
@@ -388,18 +1630,69 @@ def find_file(filePath,project=None,verbose=False,multiple=False, recurse=True):
         fileName = path
         path = '/'
     if proj == None:
-        if verbose:
-            print "ERROR: Don't know what project to use for '" + path + "'."
         return None
     if proj.find('project-') == 0:
         projId = proj
     else:
         projId = get_project(proj, level='VIEW').get_id()
-    mode = 'exact'
-    if filePath.find('*') or filePath.find('?'):
-        mode = 'glob'
-    fileDicts = list(dxpy.find_data_objects(classname='file', folder=path, name=fileName, recurse=recurse,
-                                            name_mode=mode, project=projId, return_handler=False))
+    use_refs = (proj == REF_PROJECT_DEFAULT or projId in names_load()['references'])
+    return FindPlan(projId, path, fileName, recurse=recurse, use_refs=use_refs)
+
+
+def find_files_by_name(fileNames, folder, project, recurse=True):
+    '''
+    Looks up many exact file names in (or beneath) one folder at once, returning { name: [ fids ] }.
+    Without recurse the folder listing answers them all; with recurse the names are combined into
+    regexp queries of up to FIND_BATCH_NAMES names each.
+    '''
+    if project.find('project-') == 0:
+        projId = project
+    else:
+        projId = get_project(project, level='VIEW').get_id()
+    folder = folder_normalize(folder,trailing=False) or '/'
+    found = dict([ (name, []) for name in fileNames ])
+    names = found.keys()
+    if not recurse:
+        try:
+            for rec in folder_listing(projId, folder):
+                if rec['name'] in found:
+                    found[rec['name']].append(rec['id'])
+            if FIND_EXPLAIN:
+                print >> sys.stderr, "find_files_by_name: %d exact names in %s:%s via listing" % \
+                                                                                    (len(names), projId, folder)
+            return found
+        except dxpy.exceptions.DXAPIError:
+            pass # Let the server explain itself
+    for start in range(0, len(names), FIND_BATCH_NAMES):
+        batch = names[start:start + FIND_BATCH_NAMES]
+        regex = '^(' + '|'.join([ re.escape(name) for name in batch ]) + ')$'
+        if FIND_EXPLAIN:
+            print >> sys.stderr, "find_files_by_name: %d exact names in %s:%s%s via server regexp %s" % \
+                                            (len(batch), projId, folder, " (recurse)" if recurse else "", regex)
+        for match in dxpy.find_data_objects(classname='file', folder=folder, recurse=recurse, name=regex,
+                                            name_mode='regexp', project=projId,
+                                            describe={ 'fields': { 'name': True } }, return_handler=False):
+            name = match['describe']['name']
+            if name in found:
+                found[name].append(match['id'])
+                FILES[match['id']] = dxpy.dxlink({ 'project': match['project'], 'id': match['id'] })
+    return found
+
+
+FIND_FLIGHTS = SingleFlight() ## find_file() lookups in progress, so threads seeking the same path share one
+
+
+def find_file(filePath,project=None,verbose=False,multiple=False, recurse=True):
+    '''Using a DX style file path, find the file.'''
+    proj = project
+    if filePath.find(':') != -1:
+        proj = filePath.split(':', 1)[0]
+    plan = plan_find_file(filePath, project, recurse)
+    if plan == None:
+        if verbose:
+            print "ERROR: Don't know what project to use for '" + filePath + "'."
+        return None
+    fileDicts = FIND_FLIGHTS.run((plan.projId, filePath, recurse), plan.run)
 
     if fileDicts == None or len(fileDicts) == 0:
         #print "- Found 0 files from '" + proj + ":" + filePath + "'."
@@ -426,58 +1719,498 @@ def find_file(filePath,project=None,verbose=False,multiple=False, recurse=True):
         return fileDicts[0]['id']
 
 
+def iter_files(project, folder='/', recurse=True, name=None, name_mode='exact', fields=ITER_FIELDS, remember=False):
+    '''
+    Yields one compact { 'id', 'project', <fields> } record per file in (or beneath) a folder, paging through
+    find_data_objects with only the requested describe fields, so memory stays flat however large the scan.
+    With remember, full descriptions are asked for and kept in the (bounded) description cache as they pass.
+    '''
+    if isinstance(project, basestring) and not project.startswith('project-'):
+        projId = resolve_project_id(project)
+    else:
+        projId = project_id_of(project)
+    described = fields
+    if remember:
+        described = list(set(fields) | set(DESCRIBE_FIELDS))
+    query = { 'classname': 'file', 'project': projId, 'folder': folder_normalize(folder,trailing=False) or '/',
+              'recurse': recurse, 'describe': { 'fields': dict([ (field, True) for field in described ]) },
+              'first_page_size': ITER_PAGE_SIZE, 'return_handler': False }
+    if name != None:
+        query['name'] = name
+        query['name_mode'] = name_mode
+    for found in dxpy.find_data_objects(**query):
+        descr = found['describe']
+        if remember:
+            DESCRIPTIONS.put(found['id'], descr)
+        record = { 'id': found['id'], 'project': found['project'] }
+        for field in fields:
+            if field in descr:
+                record[field] = descr[field]
+        yield record
+
+
+def iter_folders(project, root='/', recurse=True):
+    '''
+    Yields the full path of every folder beneath root (as list_folder would give them), breadth first.
+    A folder snapshot covering root answers without api calls, otherwise each level is listed as it is reached.
+    '''
+    snapshot = find_folder_snapshot(project, root)
+    pending = [ folder_normalize(root,trailing=False) or '/' ]
+    while len(pending) > 0:
+        folder = pending.pop(0)
+        sub_folders = None
+        if snapshot != None:
+            sub_folders = snapshot.sub_folders(folder)
+        if sub_folders == None:
+            try:
+                sub_folders = project.list_folder(folder,only='folders')['folders']
+            except:
+                continue
+        for sub_folder in sub_folders:
+            yield sub_folder
+            if recurse:
+                pending.append(sub_folder)
+
+
+def listing_stat(stat):
+    with LISTING_STATS_LOCK:
+        LISTING_STATS[stat] += 1
+
+
+def folder_listing(projId, folder, refresh=False):
+    '''
+    Returns a list of all files directly in a folder as { 'id', 'project', 'name', 'folder', 'state' } records.
+    The first request for a folder fetches every file in it with a single api call; later requests are cached.
+    '''
+    key = (projId, folder_normalize(folder))
+    if refresh:
+        FOLDER_LISTINGS.pop(key)
+    if key in FOLDER_LISTINGS:
+        listing_stat('hits')
+
+    def list_files():
+        listing_stat('misses')
+        listing = []
+        for found in dxpy.find_data_objects(classname='file', folder=folder, recurse=False, project=projId,
+                                            describe={'fields': {'name': True, 'folder': True, 'state': True}},
+                                            return_handler=False):
+            descr = found['describe']
+            listing.append( { 'id': found['id'], 'project': found['project'],
+                              'name': descr['name'], 'folder': descr['folder'], 'state': descr['state'] } )
+        return listing
+    return FOLDER_LISTINGS.load(key, list_files)
+
+
+def glob_to_regex(pattern):
+    '''Compiles a DX style name glob (only '*' and '?' are special) to a regex.'''
+    regex = ''
+    for char in pattern:
+        if char == '*':
+            regex += '.*'
+        elif char == '?':
+            regex += '.'
+        else:
+            regex += re.escape(char)
+    return re.compile('^' + regex + '$', re.DOTALL)
+
+
+def find_in_folder_listing(projId, folder, fileName, mode='glob'):
+    '''
+    Matches a file name (exact or glob) against the cached listing of a single folder.
+    Returns a list of { 'project', 'id' } dicts just as find_data_objects() would, or None if not answerable.
+    '''
+    try:
+        listing = folder_listing(projId, folder)
+    except dxpy.exceptions.DXAPIError:
+        return None # Let the server explain itself
+    if mode == 'glob':
+        matcher = glob_to_regex(fileName)
+        matches = [ rec for rec in listing if matcher.match(rec['name']) ]
+    else:
+        matches = [ rec for rec in listing if rec['name'] == fileName ]
+    return [ { 'project': rec['project'], 'id': rec['id'] } for rec in matches ]
+
+
+def invalidate_folder_listing(projId, folder=None):
+    '''Discards the cached listing of one folder, or of all folders in a project, after files are added or moved.'''
+    if folder != None:
+        FOLDER_LISTINGS.pop((projId, folder_normalize(folder)), None)
+        return
+    for key in FOLDER_LISTINGS.keys():
+        if key[0] == projId:
+            del FOLDER_LISTINGS[key]
+
+
+def listing_cache_stats():
+    '''Returns a string reporting how many find_file round trips the folder listing cache has saved.'''
+    return "folder listings: %d fetched, %d lookups answered locally" % (LISTING_STATS['misses'], LISTING_STATS['hits'])
+
+
+class ProjectMirror(object):
+    '''
+    Persistent local (SQLite) mirror of the file metadata in one DX project.
+    A sync crawls every file in the project when the mirror is new or its last full sync is over
+    MIRROR_RECONCILE_AGE old; other syncs only ask for files modified since the last.  Files removed or moved by
+    others are only noticed by a full sync, so callers check what the mirror finds (see mirror_verified()) and
+    lookups that find nothing (or anything stale) fall back to the api.  Safe to share between threads.
+    '''
+    SYNC_SKEW_MS = 5 * 60 * 1000 # Overlap incremental syncs to allow for clock differences
+
+    def __init__(self, project_id, path=None, max_age=MIRROR_MAX_AGE):
+        self.project_id = project_id
+        if path == None:
+            path = os.path.join(MIRROR_DIR_DEFAULT, project_id + '.sqlite')
+        if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+            os.makedirs(os.path.dirname(os.path.abspath(path)))
+        self.path = path
+        self.max_age = max_age
+        self.lock = threading.RLock() ## One connection is shared by every thread, one at a time
+        self.snapshot = None ## FolderSnapshot of the folders holding files, built once per sync
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS files (id TEXT PRIMARY KEY, folder TEXT, name TEXT, " + \
+                        "size INTEGER, state TEXT, properties TEXT, created_by_job TEXT, modified INTEGER)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS files_folder_name ON files (folder, name)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS files_name ON files (name)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS sync (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.commit()
+
+    def _sync_value(self, key, default=None):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM sync WHERE key = ?", (key,)).fetchone()
+        if row == None:
+            return default
+        return row[0]
+
+    def _set_sync_value(self, key, value):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO sync (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def last_synced(self, key='last_synced'):
+        '''Returns the time (seconds since epoch) of the last sync (or 'last_full' sync), or None if never.'''
+        last = self._sync_value(key)
+        if last == None:
+            return None
+        return float(last)
+
+    def is_fresh(self):
+        '''Returns True if the mirror was synced within max_age seconds.'''
+        last = self.last_synced()
+        return last != None and (time.time() - last) < self.max_age
+
+    def sync(self, full=False, verbose=False):
+        '''Brings the mirror up to date, crawling the whole project when full, never synced or due to reconcile.'''
+        started = time.time()
+        last = self.last_synced()
+        last_full = self.last_synced('last_full')
+        if last_full == None or started - last_full > MIRROR_RECONCILE_AGE:
+            full = True
+        query = { 'classname': 'file', 'project': self.project_id, 'folder': '/', 'recurse': True,
+                  'describe': { 'fields': { 'name': True, 'folder': True, 'size': True, 'state': True,
+                                            'properties': True, 'createdBy': True, 'modified': True } },
+                  'return_handler': False }
+        if not full:
+            query['modified_after'] = int(last * 1000) - self.SYNC_SKEW_MS
+        found = [ (obj['id'], obj['describe']) for obj in dxpy.find_data_objects(**query) ] # crawl before locking
+        with self.lock:
+            if full:
+                self.db.execute("DELETE FROM files") # Anything not found again is gone
+                self._set_sync_value('last_full', started)
+            for (fid, descr) in found:
+                self._store(fid, descr)
+            self._set_sync_value('last_synced', started)
+            self.db.commit()
+            self.snapshot = None
+        if verbose:
+            print >> sys.stderr, "Mirror of %s synced %d file(s)%s in %.1f seconds" % \
+                            (self.project_id, len(found), " in full" if full else "", time.time() - started)
+        return len(found)
+
+    def ensure_fresh(self):
+        '''Syncs incrementally if the mirror has grown older than max_age.'''
+        if not self.is_fresh():
+            self.sync()
+
+    def _store(self, fid, descr):
+        job = None
+        if descr.get('createdBy') != None:
+            job = descr['createdBy'].get('job')
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO files (id, folder, name, size, state, properties, created_by_job, modified) " + \
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (fid, descr.get('folder'), descr.get('name'), descr.get('size'), descr.get('state'),
+                             json.dumps(descr.get('properties') or {}), job, descr.get('modified')))
+
+    def forget(self, fids):
+        '''Removes files from the mirror (moved or removed by this process, or found to be stale).'''
+        with self.lock:
+            self.db.executemany("DELETE FROM files WHERE id = ?", [ (fid,) for fid in fids ])
+            self.db.commit()
+
+    def forget_folder(self, folder):
+        '''Removes every file in or beneath a folder from the mirror (as when the folder is removed).'''
+        with self.lock:
+            if self.snapshot != None:
+                self.snapshot.remove(folder)
+        folder = folder_normalize(folder,trailing=False)
+        with self.lock:
+            if folder == '':
+                self.db.execute("DELETE FROM files")
+            else:
+                self.db.execute("DELETE FROM files WHERE folder = ? OR folder LIKE ? ESCAPE '\\'",
+                                (folder, folder.replace('\\','\\\\').replace('%','\\%').replace('_','\\_') + '/%'))
+            self.db.commit()
+
+    def update_properties(self, fid, changes):
+        '''Records property changes just written to a file (None values are deletions).'''
+        with self.lock:
+            row = self.db.execute("SELECT properties FROM files WHERE id = ?", (fid,)).fetchone()
+            if row == None:
+                return
+            properties = json.loads(row[0])
+            properties.update(changes)
+            properties = dict([ (k, v) for (k, v) in properties.items() if v != None ])
+            self.db.execute("UPDATE files SET properties = ? WHERE id = ?", (json.dumps(properties), fid))
+            self.db.commit()
+
+    def describe(self, fid):
+        '''Returns a (details-free) description of a closed file from the mirror, or None if missing or stale.'''
+        self.ensure_fresh()
+        with self.lock:
+            row = self.db.execute("SELECT id, folder, name, size, state, properties, created_by_job, modified " + \
+                                  "FROM files WHERE id = ?", (fid,)).fetchone()
+        if row == None or row[4] != 'closed':
+            return None
+        desc = { 'id': row[0], 'project': self.project_id, 'class': 'file', 'folder': row[1], 'name': row[2],
+                 'size': row[3], 'state': row[4], 'properties': json.loads(row[5]), 'modified': row[7] }
+        if row[6] != None:
+            desc['createdBy'] = { 'job': row[6] }
+        return desc
+
+    def find_files(self, folder, fileName, mode='glob', recurse=True):
+        '''Returns { 'project', 'id', 'folder' } dicts for files matching name (exact or glob) in or beneath a folder.'''
+        self.ensure_fresh()
+        folder = folder_normalize(folder,trailing=False)
+        if folder == '':
+            folder = '/'
+        if recurse:
+            if folder == '/':
+                where = "1"
+                args = []
+            else:
+                where = "(folder = ? OR folder LIKE ? ESCAPE '\\')"
+                args = [ folder, folder.replace('\\','\\\\').replace('%','\\%').replace('_','\\_') + '/%' ]
+        else:
+            where = "folder = ?"
+            args = [ folder ]
+        if mode == 'glob':
+            # GLOB narrows the candidates, the DX glob regex decides
+            where += " AND name GLOB ?"
+            args.append(fileName.replace('[','[[]'))
+            matcher = glob_to_regex(fileName)
+        else:
+            where += " AND name = ?"
+            args.append(fileName)
+            matcher = None
+        with self.lock:
+            rows = self.db.execute("SELECT id, name, folder FROM files WHERE " + where + " ORDER BY rowid",
+                                   args).fetchall()
+        found = []
+        for (fid, name, in_folder) in rows:
+            if matcher == None or matcher.match(name):
+                found.append( { 'project': self.project_id, 'id': fid, 'folder': in_folder } )
+        return found
+
+    def folder_snapshot(self):
+        '''
+        Returns a FolderSnapshot of every folder known to hold files (with their parents), built from the mirror
+        once per sync.  Never syncs: a mirror past its max_age answers as it is and callers confirm what it finds.
+        '''
+        with self.lock:
+            if self.snapshot == None:
+                rows = self.db.execute("SELECT DISTINCT folder FROM files").fetchall()
+                self.snapshot = FolderSnapshot.from_folders(self.project_id, '/', [ folder for (folder,) in rows ])
+            return self.snapshot
+
+
+def mirror_verified(projId, found):
+    '''
+    Checks files a project mirror found against the (cached) listings of their folders.  Returns the found files
+    as { 'project', 'id' } dicts, or None if any has gone, in which case the mirror forgets it and the lookup
+    should be treated as a miss.
+    '''
+    listed = {}
+    stale = []
+    for rec in found:
+        if rec['folder'] not in listed:
+            try:
+                listed[rec['folder']] = set([ entry['id'] for entry in folder_listing(projId, rec['folder']) ])
+            except dxpy.exceptions.DXAPIError:
+                listed[rec['folder']] = set() # The folder itself is gone
+        if rec['id'] not in listed[rec['folder']]:
+            stale.append(rec['id'])
+    if len(stale) > 0:
+        MIRRORS[projId].forget(stale)
+        return None
+    return [ { 'project': rec['project'], 'id': rec['id'] } for rec in found ]
+
+
+def project_mirror(project, path=None, max_age=MIRROR_MAX_AGE, full=False, verbose=False):
+    '''Enables (and syncs) the local metadata mirror for a project, so that dx lookups consult it first.'''
+    proj_id = project_id_of(project)
+    with MIRRORS_LOCK:
+        if proj_id not in MIRRORS:
+            MIRRORS[proj_id] = ProjectMirror(proj_id, path, max_age)
+        mirror = MIRRORS[proj_id]
+    mirror.sync(full=full, verbose=verbose)
+    return mirror
+
+
+def mirror_description(fid, proj_id=None):
+    '''
+    Returns a partial file description from an enabled project mirror, or None.  It holds only id, project,
+    class, folder, name, size, state, properties, modified and createdBy: never details, created, types, tags or media.
+    '''
+    if proj_id != None:
+        if proj_id not in MIRRORS:
+            return None
+        return MIRRORS[proj_id].describe(fid)
+    for mirror in MIRRORS.values():
+        desc = mirror.describe(fid)
+        if desc != None:
+            return desc
+    return None
+
+
 def find_reference_file_by_name(reference_name, project_name):
     '''Looks up a reference file by name in the project that holds common tools. From Joe Dale's code.'''
-    project = dxpy.find_one_project(name=project_name, name_mode='exact', return_handler=False)
-    cached = '* '
-    if (reference_name, project['id']) not in REFERENCE_FILES:
-        found = dxpy.find_one_data_object(classname="file", name=reference_name,
-                                          project=project['id'],
-                                          recurse=True,
-                                          zero_ok=False, more_ok=False, return_handler=True)
-        REFERENCE_FILES[(reference_name, project['id'])] = found
-        cached = ''
-
-    #print >> sys.stderr, cached + "Resolved %s to %s" % \
-    #                                                (reference_name, REFERENCE_FILES[(reference_name, project['id'])].get_id())
-    return dxpy.dxlink(REFERENCE_FILES[(reference_name, project['id'])])
+    def find_reference_file():
+        proj_id = resolve_project_id(project_name)
+        found = catalog_entries('references', proj_id, reference_name)
+        if len(found) == 1:
+            return dxpy.DXFile(found[0][0], project=proj_id)
+        # Let the api complain about none or several, or find a file newer than the catalog
+        return dxpy.find_one_data_object(classname="file", name=reference_name,
+                                         project=proj_id,
+                                         recurse=True,
+                                         zero_ok=False, more_ok=False, return_handler=True)
+    found = REFERENCE_FILES.load((reference_name, project_name), find_reference_file)
+
+    #print >> sys.stderr, "Resolved %s to %s" % (reference_name, found.get_id())
+    return dxpy.dxlink(found)
 
 
 def find_applet_by_name(applet_name, applets_project_id):
     '''Looks up an applet by name in the project that holds tools.  From Joe Dale's code.'''
-    cached = '* '
-    if (applet_name, applets_project_id) not in APPLETS:
-        found = dxpy.find_one_data_object(classname="applet", name=applet_name,
-                                          project=applets_project_id,
-                                          zero_ok=False, more_ok=False, return_handler=True)
-        APPLETS[(applet_name, applets_project_id)] = found
-        cached = ''
-
-    #print >> sys.stderr, cached + "Resolved %s to %s" % (applet_name, APPLETS[(applet_name, applets_project_id)].get_id())
-    return APPLETS[(applet_name, applets_project_id)]
-
-SW_CACHE = {}
-def get_sw_from_log(dxfile, regex):
-    ''' given a regex and a dx file, look for the software version in the dnanexus log '''
+    def find_applet():
+        found = catalog_entries('applets', applets_project_id, applet_name)
+        if len(found) == 1:
+            return dxpy.DXApplet(found[0][0], project=applets_project_id)
+        # Let the api complain about none or several, or find an applet newer than the catalog
+        return dxpy.find_one_data_object(classname="applet", name=applet_name,
+                                         project=applets_project_id,
+                                         zero_ok=False, more_ok=False, return_handler=True)
+    found = APPLETS.load((applet_name, applets_project_id), find_applet)
+
+    #print >> sys.stderr, "Resolved %s to %s" % (applet_name, found.get_id())
+    return found
+
+SW_CACHE_FILE = os.path.expanduser('~/.dxencode/sw_log_versions.json')
+''' On-disk cache of software versions found in complete scans of job logs (which never change), keyed by job id.'''
+SW_CACHE = None ## { job_id: { regex: [ [ software, version ], ... ] } } loaded from SW_CACHE_FILE when first needed
+SW_LOCK = threading.RLock() ## Guards SW_CACHE
+SW_FLIGHTS = SingleFlight() ## Log scans in progress keyed by (job id, regex)
+
+
+def sw_cache_load():
+    '''Returns the software version cache, reading it from disk the first time.'''
+    global SW_CACHE
+    with SW_LOCK:
+        if SW_CACHE == None:
+            SW_CACHE = {}
+            try:
+                with open(SW_CACHE_FILE, 'r') as fh:
+                    SW_CACHE = json.load(fh)
+            except (IOError, ValueError):
+                pass
+        return SW_CACHE
+
+
+def sw_cache_save():
+    '''Writes the software version cache to disk.'''
+    with SW_LOCK:
+        json_cache_save(SW_CACHE_FILE, SW_CACHE, "software version cache")
+
+
+def scan_job_log(job_id, regexes):
+    '''
+    Streams a job's whole log looking for several regexes in one pass.  Returns ({ regex: [ matches as
+    re.findall() would return them ] }, complete), where complete is False if the log could not be read to its end.
+    '''
+    compiled = [ (regex, re.compile(regex)) for regex in regexes ]
+    found = dict([ (regex, []) for regex in regexes ])
+
+    def on_message(message):
+        line = message.get('msg','')
+        for (regex, swre) in compiled:
+            found[regex].extend(swre.findall(line))
+
+    try:
+        from dxpy.utils.job_log_client import DXJobLogStreamClient
+    except ImportError:
+        DXJobLogStreamClient = None
+    if DXJobLogStreamClient != None:
+        try:
+            DXJobLogStreamClient(job_id, msg_callback=on_message, print_job_info=False).connect()
+        except SystemExit:
+            return (found, False) # The log client exits on failed jobs, but what was found so far still stands
+        return (found, True)
+    watch = subprocess.Popen(["dx", "watch", job_id], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    for line in iter(watch.stdout.readline, ''):
+        on_message({ 'msg': line.rstrip('\n') })
+    return (found, watch.wait() == 0)
+
+
+def get_sw_from_log(dxfile, regex, also=[]):
+    '''
+    Given a regex and a dx file, look for the software version in the dnanexus log.
+    Any 'also' regexes are sought in the same pass over the log.  What a complete pass finds (or doesn't) is
+    cached for later calls.
+    '''
     try:
         job_id = dxfile.describe()['createdBy']['job']
     except:
         print >> sys.stderr, "Could not get job id"
-
-    if not SW_CACHE.get(job_id+regex, {}):
-        cmd = ["dx", "watch", job_id]
-        log = subprocess.check_output(cmd, stderr=subprocess.STDOUT) # DEVNULL ?
-        swre = re.compile(regex)
-        sw = swre.findall(log)
-
-        if not sw:
-            return {}
-        SW_CACHE[job_id+regex] =  {
-            "software_versions":
-                    [ { "software": i,
-                        "version":  j }  for (i,j) in sw ]
-        }
-    return SW_CACHE[job_id+regex]
+        return {}
+
+    cache = sw_cache_load()
+
+    def scan():
+        with SW_LOCK:
+            job_cache = dict(cache.get(job_id, {}))
+        if regex in job_cache:
+            return job_cache[regex] # Found by a concurrent scan
+        sought = [ regex ] + [ other for other in also if other not in job_cache ]
+        (found, complete) = scan_job_log(job_id, sought)
+        if not complete:
+            return found[regex] # Part of a log is never cached
+        with SW_LOCK:
+            job_cache = cache.setdefault(job_id, {})
+            for sought_regex in sought:
+                job_cache[sought_regex] = [ list(sw) for sw in found[sought_regex] ]
+            sw_cache_save()
+            return job_cache[regex]
+
+    with SW_LOCK:
+        versions = cache.get(job_id, {}).get(regex)
+    if versions == None:
+        versions = SW_FLIGHTS.run((job_id, regex), scan) # Threads after the same job's log share one scan
+    if not versions:
+        return {}
+    return {
+        "software_versions":
+                [ { "software": i,
+                    "version":  j }  for (i,j) in versions ]
+    }
 
 def create_notes(dxfile, addons={}):
     ''' creates temporary notes storage for file metadat from dxfile object '''
@@ -493,21 +2226,17 @@ def create_notes(dxfile, addons={}):
 
 def file_get_details(fid,dxfile=None,proj_id=None):
     '''Returns dx file's details as json.'''
-    if dxfile == None:
-        if proj_id != None:
-            dxfile = dxpy.DXFile(fid,project=proj_id)
-        else:
-            dxfile = file_handler_from_fid(fid)
-    return dxfile.get_details()
+    if dxfile != None:
+        fid = dxfile.get_id()
+        proj_id = dxfile.get_proj_id()
+    return cached_description(fid,proj_id).get('details')
 
 def file_get_properties(fid,dxfile=None,proj_id=None):
     '''Returns dx file's properties.'''
-    if dxfile == None:
-        if proj_id != None:
-            dxfile = dxpy.DXFile(fid,project=proj_id)
-        else:
-            dxfile = file_handler_from_fid(fid)
-    return dxfile.get_properties()
+    if dxfile != None:
+        fid = dxfile.get_id()
+        proj_id = dxfile.get_proj_id()
+    return effective_properties(fid,proj_id)
 
 def file_get_property(key,fid,dxfile=None,proj_id=None,return_json=False,fail_on_parse_error=True):
     '''Returns dx file's property matching 'key'.'''
@@ -540,6 +2269,83 @@ def property_accesion_key(server):
         acc_key = server_key + '_accession'
     return acc_key
     
+def buffer_properties(buffered=True):
+    '''
+    Turns write-behind buffering of file_set_property() on or off.  While on, changes are merged per file
+    and written by flush_properties() with one api call per file (turning off also flushes).
+    '''
+    global BUFFER_PROPERTIES
+    if buffered and not BUFFER_PROPERTIES:
+        atexit.register(flush_properties) # Never lose buffered writes, even on sys.exit()
+    BUFFER_PROPERTIES = buffered
+    if not buffered:
+        flush_properties()
+
+
+def flush_properties(fids=None, verbose=False):
+    '''
+    Writes buffered property changes (for all files or just fids) with one set_properties per file.
+    Changes stay buffered until written, so any that fail are reported, kept for a later flush and the
+    (last) error is raised once every other file has been tried.
+    '''
+    flushed = 0
+    failed = []
+    error = None
+    with PROPERTIES_LOCK:
+        keys = PENDING_PROPERTIES.keys()
+    for (fid, proj_id) in keys:
+        if fids != None and fid not in fids:
+            continue
+        with PROPERTIES_LOCK:
+            if (fid, proj_id) not in PENDING_PROPERTIES: # Flushed by another thread meanwhile
+                continue
+            changes = dict(PENDING_PROPERTIES[(fid, proj_id)])
+        try:
+            dxpy.DXFile(fid,project=proj_id).set_properties(changes)
+        except dxpy.exceptions.DXError as e:
+            failed.append(fid)
+            error = e
+            continue
+        with PROPERTIES_LOCK:
+            pending = PENDING_PROPERTIES.get((fid, proj_id), {})
+            for (key, value) in changes.items():
+                if key in pending and pending[key] == value: # Not changed again while being written
+                    del pending[key]
+            if len(pending) == 0:
+                PENDING_PROPERTIES.pop((fid, proj_id), None)
+        if proj_id in MIRRORS:
+            MIRRORS[proj_id].update_properties(fid, changes)
+        flushed += 1
+        if verbose:
+            print >> sys.stderr, "  - set %d properties on %s" % (len(changes), fid)
+    if error != None:
+        print >> sys.stderr, "ERROR: Failed to set buffered properties on %d file(s), still pending: %s" % \
+                                                                                    (len(failed), ', '.join(failed))
+        with PROPERTIES_LOCK:
+            for ((fid, proj_id), changes) in PENDING_PROPERTIES.items():
+                if fid in failed:
+                    print >> sys.stderr, "  - %s:%s %s" % (proj_id, fid, json.dumps(changes, sort_keys=True))
+        raise error
+    return flushed
+
+
+def pending_changes(fid, proj_id=None):
+    '''Returns the buffered property changes of a file (in proj_id if given) not yet flushed.'''
+    changes = {}
+    with PROPERTIES_LOCK:
+        for ((pending_fid, pending_proj_id), pending) in PENDING_PROPERTIES.items():
+            if pending_fid == fid and (proj_id == None or pending_proj_id == proj_id):
+                changes.update(pending)
+    return changes
+
+
+def effective_properties(fid, proj_id=None):
+    '''Returns a file's properties as they will be once any buffered changes are flushed.'''
+    properties = dict(cached_description(fid, proj_id, partial_ok=True).get('properties',{}))
+    properties.update(pending_changes(fid, proj_id))
+    return dict([ (k, v) for (k, v) in properties.items() if v != None ])
+
+
 def file_set_property(fid,key,value,proj_id=None,add_only=False,test=False,verbose=False):
     '''Adds/replaces key=value in a dx file's properties.
        Returns the value of the property after this operation.'''
@@ -547,12 +2353,15 @@ def file_set_property(fid,key,value,proj_id=None,add_only=False,test=False,verbo
         dxfile = dxpy.DXFile(fid,project=proj_id)
     else:
         dxfile = file_handler_from_fid(fid)
-    properties = dxfile.get_properties()
+    fid = dxfile.get_id()
+    proj_id = dxfile.get_proj_id()
+    properties = effective_properties(fid, proj_id)
     if verbose:
-        path = '/' + dxfile.name
-        if dxfile.folder != '/':
-            path = dxfile.folder + path
-        folder = dxfile.folder
+        desc = cached_description(fid, proj_id, partial_ok=True)
+        path = '/' + desc['name']
+        if desc['folder'] != '/':
+            path = desc['folder'] + path
+        folder = desc['folder']
     if key in properties:
         if properties[key] == value:
             if verbose:
@@ -569,7 +2378,16 @@ def file_set_property(fid,key,value,proj_id=None,add_only=False,test=False,verbo
         if verbose:
             print >> sys.stderr, "  - Test set %s with %s='%s'" % (path,key,value)
     else:
-        dxfile.set_properties(properties)
+        if BUFFER_PROPERTIES:
+            with PROPERTIES_LOCK:
+                PENDING_PROPERTIES.setdefault((fid, proj_id), {})[key] = value
+        else:
+            dxfile.set_properties({ key: value }) # Only the keys given are changed
+            if proj_id in MIRRORS:
+                MIRRORS[proj_id].update_properties(fid, { key: value })
+        desc = DESCRIPTIONS.get(fid)
+        if desc != None and desc.get('project') == proj_id:
+            desc['properties'] = dict([ (k, v) for (k, v) in properties.items() if v != None ])
         if verbose:
             print >> sys.stderr, "  - set %s with %s='%s'" % (path,key,value)
     return properties[key]
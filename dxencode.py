@@ -7,6 +7,8 @@ import json
 import re
 import urlparse
 import hashlib
+import digest
+import dx
 from datetime import datetime
 import time
 import subprocess
@@ -46,11 +48,7 @@ logger = logging.getLogger('dxencode') # Callers should either use dxencode.logg
 
 def calc_md5(path):
     ''' Calculate md5 sum from file as specified by valid path name'''
-    md5sum = hashlib.md5()
-    with open(path, 'rb') as f:
-        for chunk in iter(lambda: f.read(1024*1024), ''):
-            md5sum.update(chunk)
-    return md5sum
+    return digest.calc_md5(path)
 
 SAVED_KEYS = {}
 
@@ -440,7 +438,7 @@ def find_or_create_folder(project, sub_folder, root_folder='/'):
         return folder
     else:
         logger.debug("Creating %s" % (folder))
-        return project.new_folder(folder)
+        return dx.project_new_folder(project, folder)
 
 def get_bucket(SERVER, AUTHID, AUTHPW, f_obj):
     ''' returns aws s3 bucket and file name from encodeD file object (f_obj)'''
@@ -529,7 +527,7 @@ def move_files(fids, folder, projectId):
             sys.exit(1)
     proj = dxpy.DXProject(projectId)
     if not project_has_folder(proj, folder):
-        proj.new_folder(folder,parents=True)
+        dx.project_new_folder(proj, folder, parents=True)
     proj.move(folder,fids)
 
 
@@ -1,7 +1,10 @@
-import os, sys, json
-import subprocess, commands, requests, urlparse
+import os, sys, re, json, hashlib, base64, binascii
+import subprocess, commands, requests, urlparse, urllib
 from datetime import datetime
-import time
+import time, random, atexit, copy
+import threading
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
 #import shlex
 
 import logging
@@ -22,9 +25,54 @@ DEFAULT_DCC_AWARD='/awards/U41HG006992/'
 
 logger = logging.getLogger('encd') # Callers should either use dxencode.logger or set dxencode.logger = local.logger()
 
+HTTP_TIMEOUT = (10, 300) ## (connect, read) seconds allowed an encodeD request
+HTTP_POOL_SIZE = 10 ## Keep-alive connections pooled per server and key
+HTTP_RETRY_MAX = 5 ## Most attempts at one encodeD request before its failure is let through
+HTTP_RETRY_BASE = 1.0 ## Seconds of backoff before the first retry, doubling with each attempt (with full jitter)
+HTTP_RETRY_CAP = 60 ## Most seconds of backoff between two attempts
+HTTP_RETRY_CODES = [ 429, 500, 502, 503, 504 ] ## Response codes worth retrying
+HTTP_RETRY_REFUSED = [ 429, 503 ] ## Codes of requests refused unprocessed, which even a POST may retry
+HTTP_IDEMPOTENT = [ 'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE' ] ## Methods always safe to repeat
+LOOKUP_WORKERS = 16 ## Most threads lookup_many() uses
+LOOKUP_PER_HOST = 8 ## Most lookups in flight to any one server at once (keep within HTTP_POOL_SIZE)
+EXP_FILE_FIELDS = [ '@id', 'accession', 'md5sum', 'status', 'output_type', 'file_format', 'file_format_type',
+                    'file_size', 'submitted_file_name', 'paired_with', 'paired_end', 'run_type', 'aliases', 'notes',
+                    'href', 'lab.name', 'award.rfa', 'dataset', 'assembly', 'genome_annotation', 'derived_from',
+                    'step_run', 'flowcell_details', 'biological_replicates', 'technical_replicates',
+                    'replicate.@id', 'replicate.biological_replicate_number', 'replicate.technical_replicate_number' ]
+''' The file fields the tools read, which are all that search_exp_files() asks encodeD for.
+    Callers needing embedded step_runs or quality_metrics (mission_log) pass fields=None for full files.'''
+UPLOAD_ATTEMPTS = 3 ## Attempts at copying a file to S3 in post_file(), each resuming where the last left off
+UPLOAD_RETRY_BASE = 60 ## Seconds of backoff before the second upload attempt, doubling (with jitter) thereafter
+UPLOAD_PART_SIZE = 64 * 1024 * 1024 ## Bytes per part of a multipart upload (grown for files of over 10000 parts)
+UPLOAD_MAX_PARTS = 10000 ## Most parts S3 allows in one multipart upload
+UPLOAD_WORKERS = 8 ## Parts uploaded at once (each holds a part in memory while it is sent)
+UPLOAD_PART_ATTEMPTS = 5 ## Attempts at one part before the upload gives up (to be resumed by the next attempt)
+UPLOAD_MANIFEST_DIR = os.path.expanduser('~/.dxencode/uploads')
+''' Where the parts done of unfinished multipart uploads are recorded, so they can be resumed.'''
+S3_ENDPOINT = None ## None for AWS, otherwise the url of an S3-compatible stand-in (e.g. 'http://localhost:9000')
+S3_MD5_ETAG = re.compile('^[0-9a-f]{32}$') ## An S3 ETag that is the md5 of what was sent
+
+RESPONSE_CACHE_DEFAULT_DIR = os.path.expanduser('~/.dxencode/encoded')
+RESPONSE_CACHE_DIR = None
+''' Where encodeD object responses are kept for conditional GETs.  None (no caching) unless a read-only tool
+    turns the cache on with set_response_cache().'''
+RESPONSE_CACHE_MAX = 512 * 1024 * 1024 ## Most bytes held in RESPONSE_CACHE_DIR before the least recently used go
+RESPONSE_CACHE_STALE_SECS = 0 ## Seconds a cached response is served while it is revalidated in the background
+RESPONSE_CACHE_STATS = { 'stale': 0, 'revalidated': 0, 'fetched': 0 } ## see http_report()
+RESPONSE_CACHE_LOCK = threading.Lock() ## Guards RESPONSE_CACHE_STATS and REVALIDATING
+REVALIDATING = set() ## Urls being revalidated in the background
+WRITTEN_IDS = set() ## Ids, accessions and aliases of objects posted or patched by this process, never read from cache
+
+SESSIONS = {} ## Pooled requests.Session keyed by (server, authid)
+SESSIONS_LOCK = threading.Lock()
+HOST_SLOTS = {} ## Semaphore per server limiting the lookups in flight to it
+HTTP_STATS = {} ## { method: { 'requests', 'retries', 'failures', 'secs', 'retry_secs' } } see http_report()
+
 SAVED_KEYS = {}
+KEYS_LOCK = threading.RLock() ## Guards SAVED_KEYS and prime_server_key
 
-# TODO: make Encd object and replace prime_server_key with self.server_key
+# Module functions default to this key, while an Encd object (see below) holds its own server_key.
 prime_server_key = "default" # ordinarily is set to the first non-default key seen.
 
 def set_server_key(key):
@@ -62,36 +110,120 @@ def processkey(key):
     }
     '''
     global prime_server_key
-    if key == None:
-        key = prime_server_key
-    if key in SAVED_KEYS:
-        return SAVED_KEYS[key]
-
-    if key:
-        keysf = open(KEYFILE,'r')
-        keys_json_string = keysf.read()
-        keysf.close()
-        keys = json.loads(keys_json_string)
-        key_dict = keys[key]
-    else:
-        key_dict = {}
-    AUTHID = key_dict.get('key')
-    AUTHPW = key_dict.get('secret')
-    if key:
-        SERVER = key_dict.get('server')
-    else:
-        SERVER = 'https://www.encodeproject.org/'
+    with KEYS_LOCK: # Threads may look up keys at once
+        if key == None:
+            key = prime_server_key
+        if key in SAVED_KEYS:
+            return SAVED_KEYS[key]
+
+        if key:
+            keysf = open(KEYFILE,'r')
+            keys_json_string = keysf.read()
+            keysf.close()
+            keys = json.loads(keys_json_string)
+            key_dict = keys[key]
+        else:
+            key_dict = {}
+        AUTHID = key_dict.get('key')
+        AUTHPW = key_dict.get('secret')
+        if key:
+            SERVER = key_dict.get('server')
+        else:
+            SERVER = 'https://www.encodeproject.org/'
 
-    if not SERVER.endswith("/"):
-        SERVER += "/"
+        if not SERVER.endswith("/"):
+            SERVER += "/"
 
-    SAVED_KEYS[key] = (AUTHID,AUTHPW,SERVER)
-    # Gets set to first non-default key
-    if prime_server_key == "default":
-        prime_server_key = key
-    return (AUTHID,AUTHPW,SERVER)
+        SAVED_KEYS[key] = (AUTHID,AUTHPW,SERVER)
+        # Gets set to first non-default key
+        if prime_server_key == "default":
+            prime_server_key = key
+        return (AUTHID,AUTHPW,SERVER)
     ## TODO possibly this should return a dict
 
+def get_session(url, AUTHID=None, AUTHPW=None):
+    '''Returns the keep-alive requests.Session, with its pool of connections, for a url's server and key.'''
+    parts = urlparse.urlparse(url)
+    server = parts.scheme + '://' + parts.netloc
+    with SESSIONS_LOCK:
+        session = SESSIONS.get((server, AUTHID))
+        if session == None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount(server, adapter)
+            if AUTHID and AUTHPW:
+                session.auth = (AUTHID, AUTHPW)
+            SESSIONS[(server, AUTHID)] = session
+    return session
+
+
+def backoff_delay(attempt, base=HTTP_RETRY_BASE, cap=HTTP_RETRY_CAP):
+    '''Returns a full jitter exponential backoff, in seconds, before retry number 'attempt'.'''
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def http_request(method, url, AUTHID=None, AUTHPW=None, **kwargs):
+    '''
+    Makes an encodeD request on the pooled session for its server and key, allowing HTTP_TIMEOUT.
+    Idempotent requests are retried on 5xx/429 responses and connection errors with jittered exponential backoff;
+    others only when refused unprocessed (429/503 or no connection).  Returns the last response.
+    '''
+    session = get_session(url, AUTHID, AUTHPW)
+    kwargs.setdefault('timeout', HTTP_TIMEOUT)
+    idempotent = method in HTTP_IDEMPOTENT
+    with SESSIONS_LOCK:
+        stats = HTTP_STATS.setdefault(method, { 'requests': 0, 'retries': 0, 'failures': 0, 'secs': 0.0,
+                                                'retry_secs': 0.0 })
+        stats['requests'] += 1
+    attempt = 0
+    while True:
+        attempt += 1
+        start = time.time()
+        try:
+            response = session.request(method, url, **kwargs)
+            error = None
+            retry = response.status_code in (HTTP_RETRY_CODES if idempotent else HTTP_RETRY_REFUSED)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            response = None
+            error = e
+            retry = idempotent or isinstance(e, requests.exceptions.ConnectTimeout)
+        with SESSIONS_LOCK:
+            stats['secs'] += time.time() - start
+        if not retry or attempt >= HTTP_RETRY_MAX:
+            if not retry and error == None:
+                return response
+            with SESSIONS_LOCK:
+                stats['failures'] += 1
+            if error != None:
+                raise error
+            return response
+        delay = backoff_delay(attempt)
+        if response != None and response.headers.get('Retry-After','').isdigit():
+            delay = int(response.headers['Retry-After'])
+        reason = str(error) if error != None else "%s %s" % (response.status_code, response.reason)
+        logger.warning("%s %s failed (%s), retry %d in %.1f secs" % (method, url, reason, attempt, delay))
+        with SESSIONS_LOCK:
+            stats['retries'] += 1
+            stats['retry_secs'] += delay
+        time.sleep(delay)
+
+
+def http_report(out=sys.stderr, always=False):
+    '''Prints encodeD request counts, mean latency and retries by method (only if there were retries).'''
+    if not always and sum([ stats['retries'] for stats in HTTP_STATS.values() ]) == 0:
+        return
+    print >> out, "encodeD requests by method:"
+    for method in sorted(HTTP_STATS.keys()):
+        stats = HTTP_STATS[method]
+        print >> out, "  %-6s requests %6d  mean %5.2f secs  retries %4d  failures %3d  secs lost to retries %6.0f" % \
+            (method, stats['requests'], stats['secs'] / max(stats['requests'], 1), stats['retries'],
+             stats['failures'], stats['retry_secs'])
+    print >> out, "  cached objects revalidated %d  served stale %d  fetched in full %d" % \
+        (RESPONSE_CACHE_STATS['revalidated'], RESPONSE_CACHE_STATS['stale'], RESPONSE_CACHE_STATS['fetched'])
+
+atexit.register(http_report)
+
+
 def post_obj(obj_type,obj_meta, SERVER=None, AUTHID=None, AUTHPW=None):
     ''' Posts a json object of a given type to the encoded database. '''
     (AUTHID,AUTHPW,SERVER) = find_keys(SERVER, AUTHID, AUTHPW)
@@ -99,9 +231,9 @@ def post_obj(obj_type,obj_meta, SERVER=None, AUTHID=None, AUTHPW=None):
         'Content-type': 'application/json',
         'Accept': 'application/json',
     }
-    r = requests.post(
+    r = http_request('POST',
         SERVER + obj_type,
-        auth=(AUTHID, AUTHPW),
+        AUTHID, AUTHPW,
         data=json.dumps(obj_meta),
         headers=HEADERS,
     )
@@ -121,6 +253,7 @@ def post_obj(obj_type,obj_meta, SERVER=None, AUTHID=None, AUTHPW=None):
     #    print >> sys.stderr, "Returned:"
     #    print >> sys.stderr, json.dumps(item, indent=4, sort_keys=True)
     ##    print >> sys.stderr, json.dumps(r.json(), indent=4, sort_keys=True)
+    response_cache_written(item)
     return item
 
 def patch_obj(obj_id, obj_meta, SERVER=None, AUTHID=None, AUTHPW=None):
@@ -131,9 +264,9 @@ def patch_obj(obj_id, obj_meta, SERVER=None, AUTHID=None, AUTHPW=None):
         'Content-type': 'application/json',
         'Accept': 'application/json',
     }
-    r = requests.patch(
+    r = http_request('PATCH',
         SERVER + obj_id,
-        auth=(AUTHID, AUTHPW),
+        AUTHID, AUTHPW,
         data=json.dumps(obj_meta),
         headers=HEADERS,
     )
@@ -145,13 +278,187 @@ def patch_obj(obj_id, obj_meta, SERVER=None, AUTHID=None, AUTHPW=None):
         logger.error('Patch of %s failed: %s %s' % (obj_id, r.status_code, r.reason))
         logger.error(r.text)
         raise
+    response_cache_written(None, obj_id)
 
     item = r.json()['@graph'][0]
+    response_cache_written(item)
     #print >> sys.stderr, "* request to patch %s to %s..." % (obj_id,SERVER)
     #print >> sys.stderr, json.dumps(item, indent=4, sort_keys=True)
     return item
 
 
+class MultipartUpload(object):
+    '''
+    Uploads a local file to S3 with the temporary credentials encodeD gave for it, in parts sent UPLOAD_WORKERS at
+    a time.  Each part goes with its Content-MD5, which S3 checks, and unless the bucket encrypts with KMS or a
+    customer key (when ETags are not md5s) the ETag returned is checked against it too; a failed part alone is
+    retried.  The parts done are recorded in a manifest under UPLOAD_MANIFEST_DIR, so an upload that was
+    interrupted (even by a crash) resumes where it left off.  Requires boto3.  Give an endpoint (or set
+    S3_ENDPOINT) to upload to a local S3-compatible stand-in, or a client to use one already made.
+    '''
+
+    def __init__(self, filename, creds, part_size=UPLOAD_PART_SIZE, workers=UPLOAD_WORKERS, endpoint=None,
+                 manifest_dir=None, client=None):
+        if client == None:
+            import boto3
+            if endpoint == None:
+                endpoint = S3_ENDPOINT
+            client = boto3.client('s3', aws_access_key_id=creds['access_key'],
+                                  aws_secret_access_key=creds['secret_key'],
+                                  aws_session_token=creds['session_token'], endpoint_url=endpoint)
+        self.client = client
+        self.filename = filename
+        self.upload_url = creds['upload_url']
+        url = urlparse.urlparse(self.upload_url) # s3://bucket/key
+        self.bucket = url.netloc
+        self.key = url.path.lstrip('/')
+        stat = os.stat(filename)
+        self.size = stat.st_size
+        self.mtime = int(stat.st_mtime)
+        self.part_size = max(part_size, -(-self.size // UPLOAD_MAX_PARTS))
+        self.part_count = max(1, -(-self.size // self.part_size))
+        self.workers = workers
+        if manifest_dir == None:
+            manifest_dir = UPLOAD_MANIFEST_DIR
+        self.manifest_path = os.path.join(manifest_dir, hashlib.sha1("%s %s" % \
+                                            (self.upload_url, os.path.abspath(filename))).hexdigest() + '.json')
+        self.manifest = None
+        self.lock = threading.Lock() ## Guards the manifest
+        self.sent = 0
+
+    def load_manifest(self):
+        '''Returns the manifest of an unfinished upload of this file, keeping only the parts S3 still holds.'''
+        try:
+            with open(self.manifest_path, 'r') as fh:
+                manifest = json.load(fh)
+        except (IOError, OSError, ValueError):
+            return None
+        for (field, value) in [ ('upload_url', self.upload_url), ('size', self.size), ('mtime', self.mtime),
+                                ('part_size', self.part_size) ]:
+            if manifest.get(field) != value:
+                return None # Not this file as it is now
+        held = {}
+        marker = 0
+        try:
+            while True:
+                listed = self.client.list_parts(Bucket=self.bucket, Key=self.key, UploadId=manifest['upload_id'],
+                                                PartNumberMarker=marker)
+                for part in listed.get('Parts', []):
+                    held[str(part['PartNumber'])] = part['ETag'].strip('"')
+                if not listed.get('IsTruncated'):
+                    break
+                marker = listed['NextPartNumberMarker']
+        except Exception as e:
+            logger.debug("Unable to resume upload %s: %s" % (manifest['upload_id'], e))
+            return None # The upload was completed, aborted or has expired
+        manifest['parts'] = dict([ (number, etag) for (number, etag) in manifest['parts'].items() \
+                                                  if held.get(number) == etag ])
+        return manifest
+
+    def save_manifest(self):
+        '''Writes the manifest (under the lock) so that a crash leaves the parts done on record.'''
+        if not os.path.isdir(os.path.dirname(self.manifest_path)):
+            os.makedirs(os.path.dirname(self.manifest_path))
+        tmp_path = "%s.%d" % (self.manifest_path, os.getpid())
+        with open(tmp_path, 'w') as fh:
+            json.dump(self.manifest, fh)
+        os.rename(tmp_path, self.manifest_path)
+
+    def upload_part(self, number):
+        '''Uploads one part, retrying just it until S3 accepts it with the right md5.  Returns the bytes sent.'''
+        with open(self.filename, 'rb') as fh:
+            fh.seek((number - 1) * self.part_size)
+            data = fh.read(self.part_size)
+        md5 = hashlib.md5(data)
+        for attempt in range(1, UPLOAD_PART_ATTEMPTS + 1):
+            try:
+                response = self.client.upload_part(Bucket=self.bucket, Key=self.key, PartNumber=number,
+                                                   UploadId=self.manifest['upload_id'], Body=data,
+                                                   ContentMD5=base64.b64encode(md5.digest()))
+                etag = response['ETag'].strip('"')
+                if s3_etag_is_md5(response) and etag != md5.hexdigest():
+                    raise IOError("ETag %s of part %d does not match its md5 %s" % (etag, number, md5.hexdigest()))
+                break
+            except Exception as e:
+                if attempt >= UPLOAD_PART_ATTEMPTS:
+                    raise
+                delay = backoff_delay(attempt)
+                logger.warning("Part %d of %s failed (%s), retry %d in %.1f secs" % \
+                                                                (number, self.filename, e, attempt, delay))
+                time.sleep(delay)
+        with self.lock:
+            self.manifest['parts'][str(number)] = etag
+            self.save_manifest()
+            self.sent += len(data)
+        return len(data)
+
+    def run(self):
+        '''Uploads (or resumes uploading) the file, returning the ETag of the completed object.'''
+        if self.size == 0:
+            md5 = hashlib.md5('')
+            response = self.client.put_object(Bucket=self.bucket, Key=self.key, Body='',
+                                              ContentMD5=base64.b64encode(md5.digest()))
+            return response['ETag'].strip('"')
+        self.manifest = self.load_manifest()
+        if self.manifest == None:
+            upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key)['UploadId']
+            self.manifest = { 'upload_url': self.upload_url, 'filename': os.path.abspath(self.filename),
+                              'size': self.size, 'mtime': self.mtime, 'part_size': self.part_size,
+                              'upload_id': upload_id, 'parts': {} }
+            self.save_manifest()
+        else:
+            logger.debug("Resuming upload of %s with %d of %d parts done" % \
+                                                    (self.filename, len(self.manifest['parts']), self.part_count))
+        todo = [ number for number in range(1, self.part_count + 1) if str(number) not in self.manifest['parts'] ]
+        start = time.time()
+        if len(todo) > 0:
+            pool = ThreadPool(min(self.workers, len(todo)))
+            try:
+                for sent in pool.imap_unordered(self.upload_part, todo):
+                    pass
+            finally:
+                pool.close()
+                pool.join()
+        logger.debug("Sent %d bytes of %s in %.1f secs" % (self.sent, self.filename, time.time() - start))
+
+        etags = [ self.manifest['parts'][str(number)] for number in range(1, self.part_count + 1) ]
+        response = self.client.complete_multipart_upload(Bucket=self.bucket, Key=self.key,
+                        UploadId=self.manifest['upload_id'],
+                        MultipartUpload={ 'Parts': [ { 'PartNumber': number, 'ETag': '"%s"' % etag } \
+                                                     for (number, etag) in zip(range(1, self.part_count + 1), etags) ] })
+        os.remove(self.manifest_path)
+        etag = response.get('ETag','').strip('"')
+        if not etag or not s3_etag_is_md5(response) or [ e for e in etags if not S3_MD5_ETAG.match(e) ]:
+            return etag
+        expected = "%s-%d" % (hashlib.md5(''.join([ binascii.unhexlify(e) for e in etags ])).hexdigest(), len(etags))
+        if etag != expected:
+            raise IOError("ETag %s of %s does not match its parts %s" % (etag, self.upload_url, expected))
+        return etag
+
+
+def s3_etag_is_md5(response):
+    '''S3 ETags are md5s except for objects encrypted with KMS or a customer provided key.'''
+    if response.get('SSECustomerAlgorithm') or response.get('SSEKMSKeyId'):
+        return False
+    return not response.get('ServerSideEncryption','').startswith('aws:kms')
+
+
+def s3_upload(filename, creds):
+    '''Copies a local file to the encodeD upload_url, as a parallel MultipartUpload, or with the aws cli if no boto3.'''
+    try:
+        upload = MultipartUpload(filename, creds)
+    except ImportError:
+        env = os.environ.copy()
+        env.update({
+            'AWS_ACCESS_KEY_ID': creds['access_key'],
+            'AWS_SECRET_ACCESS_KEY': creds['secret_key'],
+            'AWS_SECURITY_TOKEN': creds['session_token'],
+        })
+        subprocess.check_call(['aws', 's3', 'cp', filename, creds['upload_url']], env=env)
+        return
+    upload.run()
+
+
 def post_file(filename, file_meta, SERVER=None, AUTHID=None, AUTHPW=None):
     ''' take a file object on local file system, post meta data and cp to AWS '''
     (AUTHID,AUTHPW,SERVER) = find_keys(SERVER, AUTHID, AUTHPW)
@@ -183,35 +490,26 @@ def post_file(filename, file_meta, SERVER=None, AUTHID=None, AUTHPW=None):
 
     # if cred missing, just let it fail on the next statement
     creds = item['upload_credentials']
-    env = os.environ.copy()
-    env.update({
-        'AWS_ACCESS_KEY_ID': creds['access_key'],
-        'AWS_SECRET_ACCESS_KEY': creds['secret_key'],
-        'AWS_SECURITY_TOKEN': creds['session_token'],
-    })
 
     # POST file to S3
     logger.debug("Uploading file.")
     start = datetime.now()
-    try:
-        subprocess.check_call(['aws', 's3', 'cp', filename, creds['upload_url']], env=env)
-    except:
-        logger.debug("Retry 2/3 uploading in 1 minute...")
-        time.sleep(60)
+    for attempt in range(1, UPLOAD_ATTEMPTS + 1):
         try:
-            subprocess.check_call(['aws', 's3', 'cp', filename, creds['upload_url']], env=env)
+            s3_upload(filename, creds)
+            break
         except:
-            logger.debug("Retry 3/3 uploading in 3 minutes...")
-            time.sleep(180)
-            try:
-                subprocess.check_call(['aws', 's3', 'cp', filename, creds['upload_url']], env=env)
-            except:
-                logger.debug("Upload failed")
-                # Try to set status to "upload failed"
-                file_meta['status'] = "upload failed"
-                item = patch_obj('files/'+item.get('accession'),file_meta, SERVER, AUTHID, AUTHPW)
-                assert item['status'] == "upload failed"
-                #raise Don't raise exception on half error... the accession needs to be added to the dx file.
+            if attempt < UPLOAD_ATTEMPTS:
+                delay = backoff_delay(attempt, base=UPLOAD_RETRY_BASE, cap=UPLOAD_RETRY_BASE * 4)
+                logger.debug("Retry %d/%d uploading in %d seconds..." % (attempt + 1, UPLOAD_ATTEMPTS, delay))
+                time.sleep(delay)
+                continue
+            logger.debug("Upload failed")
+            # Try to set status to "upload failed"
+            file_meta['status'] = "upload failed"
+            item = patch_obj('files/'+item.get('accession'),file_meta, SERVER, AUTHID, AUTHPW)
+            assert item['status'] == "upload failed"
+            #raise Don't raise exception on half error... the accession needs to be added to the dx file.
 
     if item.get('status','uploading') != "upload failed":
         #assert item['status'] == "uploading"
@@ -225,14 +523,193 @@ def post_file(filename, file_meta, SERVER=None, AUTHID=None, AUTHPW=None):
 def get_object(url, AUTHID=None, AUTHPW=None):
     ''' executes GET on Encoded server without without authz '''
     ##TODO possibly add try/except looking for non 4xx?
+    if response_cacheable(url):
+        return cached_get(url, AUTHID, AUTHPW)
     HEADERS = {'content-type': 'application/json'}
-    if AUTHID and AUTHPW:
-        response = requests.get(url, auth=(AUTHID,AUTHPW), headers=HEADERS)
-    else:
-        response = requests.get(url, headers=HEADERS)
+    return http_request('GET', url, AUTHID, AUTHPW, headers=HEADERS)
+
+
+def set_response_cache(enabled=True, cache_dir=RESPONSE_CACHE_DEFAULT_DIR, stale_secs=None):
+    '''
+    Turns the encodeD response cache on (kept in cache_dir) or off, and sets how many seconds a cached response may
+    be served as is while it is revalidated in the background.  The cache is off unless turned on, which is only
+    meant for read-only tools (mission_log, check_derived_from).
+    '''
+    global RESPONSE_CACHE_DIR
+    global RESPONSE_CACHE_STALE_SECS
+    RESPONSE_CACHE_DIR = cache_dir if enabled else None
+    if stale_secs != None:
+        RESPONSE_CACHE_STALE_SECS = stale_secs
+
+
+def response_cache_id(path):
+    '''Returns the id, accession or alias a url path (or object path) ends with.'''
+    return urllib.unquote(path.rstrip('/').split('/')[-1])
+
+
+def response_cache_written(item, obj_id=None):
+    '''Records an object posted or patched by this process, so that it is no longer read from the cache.'''
+    ids = []
+    if obj_id != None:
+        ids.append(response_cache_id(obj_id))
+    if item != None:
+        ids.extend([ response_cache_id(item[field]) for field in [ '@id', 'uuid', 'accession' ] if item.get(field) ])
+        ids.extend(item.get('aliases', []))
+    with RESPONSE_CACHE_LOCK:
+        WRITTEN_IDS.update(ids)
+
+
+def response_cacheable(url):
+    '''
+    Only single objects requested with an explicit frame are cached, never searches or reports.  Objects this
+    process has written are not, nor (once it has written anything) embedded frames, which may include them.
+    '''
+    if RESPONSE_CACHE_DIR == None or url.find('frame=') == -1:
+        return False
+    path = urlparse.urlparse(url).path
+    if path.startswith('/search') or path.startswith('/report') or path.startswith('/batch_'):
+        return False
+    with RESPONSE_CACHE_LOCK:
+        if len(WRITTEN_IDS) > 0 and (url.find('frame=object') == -1 or response_cache_id(path) in WRITTEN_IDS):
+            return False
+    return True
+
+
+def response_cache_path(url, AUTHID=None):
+    '''Returns the file caching a url's response, which depends on the key as much as the url.'''
+    return os.path.join(RESPONSE_CACHE_DIR, hashlib.sha1("%s %s" % (AUTHID, url)).hexdigest())
+
+
+def response_cache_read(url, AUTHID=None):
+    '''Returns the cached { 'url', 'etag', 'fetched', 'checked', 'body' } or None.'''
+    path = response_cache_path(url, AUTHID)
+    try:
+        with open(path, 'r') as fh:
+            entry = json.load(fh)
+    except (IOError, OSError, ValueError):
+        return None
+    if entry.get('url') != url:
+        return None
+    return entry
+
+
+def response_cache_write(url, AUTHID, response, entry=None):
+    '''Caches a 200 response (or just marks an entry as checked now).  A cache that can't be written is skipped.'''
+    if entry == None:
+        try:
+            obj = response.json()
+        except ValueError:
+            return
+        if not isinstance(obj,dict) or obj.get('status') == 'error':
+            return
+        entry = { 'url': url, 'etag': response.headers.get('ETag'), 'body': response.text, 'fetched': time.time() }
+    entry['checked'] = time.time()
+    path = response_cache_path(url, AUTHID)
+    tmp_path = "%s.%d.%d" % (path, os.getpid(), threading.current_thread().ident)
+    try:
+        if not os.path.isdir(RESPONSE_CACHE_DIR):
+            os.makedirs(RESPONSE_CACHE_DIR)
+        with open(tmp_path, 'w') as fh:
+            json.dump(entry, fh)
+        os.rename(tmp_path, path)
+    except (IOError, OSError) as e:
+        logger.debug("Unable to cache %s: %s" % (url, e))
+
+
+def response_cache_evict(max_bytes=None):
+    '''Removes the least recently used responses until the cache holds no more than max_bytes.'''
+    if max_bytes == None:
+        max_bytes = RESPONSE_CACHE_MAX
+    if RESPONSE_CACHE_DIR == None or not os.path.isdir(RESPONSE_CACHE_DIR):
+        return
+    cached = []
+    for name in os.listdir(RESPONSE_CACHE_DIR):
+        path = os.path.join(RESPONSE_CACHE_DIR, name)
+        if name.find('.') == -1 and os.path.isfile(path): # Skip any partial writes
+            stat = os.stat(path)
+            cached.append( (stat.st_mtime, stat.st_size, path) )
+    total = sum([ size for (used, size, path) in cached ])
+    for (used, size, path) in sorted(cached):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+atexit.register(response_cache_evict)
+
+
+def cached_response(url, entry, response=None):
+    '''Returns a 200 response (the 304 response itself if there is one) carrying the cached body.'''
+    if response == None:
+        response = requests.models.Response()
+        response.url = url
+    response.status_code = 200
+    response.reason = 'OK'
+    response.encoding = 'utf-8'
+    response._content = entry['body'].encode('utf-8')
     return response
 
 
+def response_cache_stat(stat):
+    with RESPONSE_CACHE_LOCK:
+        RESPONSE_CACHE_STATS[stat] += 1
+
+
+def revalidate(url, AUTHID=None, AUTHPW=None, entry=None):
+    '''
+    Brings a url's cached response up to date, returning the response (200 even when it was unchanged).
+    Only an ETag can show a response unchanged: without one the object is fetched in full.
+    '''
+    HEADERS = {'content-type': 'application/json'}
+    if entry != None and entry.get('etag') != None:
+        HEADERS['If-None-Match'] = entry['etag']
+    response = http_request('GET', url, AUTHID, AUTHPW, headers=HEADERS)
+    if response.status_code == 304 and entry != None:
+        response_cache_stat('revalidated')
+        response_cache_write(url, AUTHID, None, entry)
+        return cached_response(url, entry, response)
+    response_cache_stat('fetched')
+    if response.status_code == 200:
+        response_cache_write(url, AUTHID, response)
+    return response
+
+
+def revalidate_in_background(url, AUTHID=None, AUTHPW=None, entry=None):
+    '''Revalidates a cached response on a daemon thread, unless it is already being revalidated.'''
+    with RESPONSE_CACHE_LOCK:
+        if url in REVALIDATING:
+            return
+        REVALIDATING.add(url)
+    def background():
+        try:
+            revalidate(url, AUTHID, AUTHPW, entry)
+        except Exception as e:
+            logger.debug("Background revalidation of %s failed: %s" % (url, e))
+        finally:
+            with RESPONSE_CACHE_LOCK:
+                REVALIDATING.discard(url)
+    thread = threading.Thread(target=background)
+    thread.daemon = True
+    thread.start()
+
+
+def cached_get(url, AUTHID=None, AUTHPW=None):
+    '''
+    GETs an encodeD object through the persistent response cache.  Cached responses are revalidated with
+    If-None-Match when the server gave an ETag, otherwise fetched again in full.  When RESPONSE_CACHE_STALE_SECS
+    is set, a response checked that recently is returned at once and revalidated behind.
+    '''
+    entry = response_cache_read(url, AUTHID)
+    if entry != None and time.time() - entry.get('checked', 0) < RESPONSE_CACHE_STALE_SECS:
+        response_cache_stat('stale')
+        revalidate_in_background(url, AUTHID, AUTHPW, entry)
+        return cached_response(url, entry)
+    return revalidate(url, AUTHID, AUTHPW, entry)
+
+
 def lookup_json(path, key=None, frame='object', must_find=False):
     '''Commonly used method to get a json object from encodeD.'''
     (AUTHID,AUTHPW,SERVER) = find_keys(key)
@@ -251,6 +728,53 @@ def lookup_json(path, key=None, frame='object', must_find=False):
     return json_obj
 
 
+def host_slots(server):
+    '''Returns the semaphore limiting concurrent lookups to a server to LOOKUP_PER_HOST.'''
+    with SESSIONS_LOCK:
+        if server not in HOST_SLOTS:
+            HOST_SLOTS[server] = threading.BoundedSemaphore(LOOKUP_PER_HOST)
+        return HOST_SLOTS[server]
+
+
+def lookup_many(keys, frame='object', fields=None, key=None, workers=LOOKUP_WORKERS):
+    '''
+    Looks up many json objects from encodeD at once (paths like 'files/ENCFF000AAA' or '/files/dnanexus:file-xxx/').
+    Lookups are spread over a bounded pool of threads sharing the pooled session, at most LOOKUP_PER_HOST at a time
+    per server.  Returns the objects in the order of keys, with None for any not found.  When fields are given,
+    only those (and '@id') are kept of each object.
+    '''
+    if len(keys) == 0:
+        return []
+    (AUTHID,AUTHPW,SERVER) = find_keys(key)
+    slots = host_slots(SERVER)
+    paths = list(OrderedDict.fromkeys(keys)) # each only once
+
+    def lookup(path):
+        url = SERVER + path.strip('/') + '/?format=json&frame=' + frame
+        with slots:
+            response = get_object(url, AUTHID, AUTHPW)
+        try:
+            response.raise_for_status()
+            json_obj = response.json()
+        except:
+            return None
+        if fields != None:
+            json_obj = dict([ (field, json_obj[field]) for field in [ '@id' ] + list(fields) if field in json_obj ])
+        return json_obj
+
+    if len(paths) == 1 or workers <= 1:
+        found = map(lookup, paths)
+    else:
+        pool = ThreadPool(min(workers, len(paths)))
+        try:
+            found = pool.map(lookup, paths)
+        finally:
+            pool.close()
+            pool.join()
+    found = dict(zip(paths, found))
+    return [ found[path] for path in keys ]
+
+
 def get_bucket(f_obj, SERVER=None, AUTHID=None, AUTHPW=None):
     ''' returns aws s3 bucket and file name from encodeD file object (f_obj)'''
     #make the URL that will get redirected - get it from the file object's href property
@@ -259,7 +783,7 @@ def get_bucket(f_obj, SERVER=None, AUTHID=None, AUTHPW=None):
     logger.debug(encode_url)
 
     #stream=True avoids actually downloading the file, but it evaluates the redirection
-    r = requests.get(encode_url, auth=(AUTHID,AUTHPW), headers={'content-type': 'application/json'}, allow_redirects=True, stream=True)
+    r = http_request('GET', encode_url, AUTHID, AUTHPW, headers={'content-type': 'application/json'}, allow_redirects=True, stream=True)
     try:
         r.raise_for_status
     except:
@@ -284,31 +808,87 @@ def get_bucket(f_obj, SERVER=None, AUTHID=None, AUTHPW=None):
     #hack together the s3 cp url (with the s3 method instead of https)
     return filename, S3_SERVER.rstrip('/') + opath
 
+class FileIndex(object):
+    '''
+    An experiment's encodeD file objects indexed by accession, md5sum, alias, dnanexus fid and submitted file name,
+    so that membership and lookups are dict hits rather than scans of the file list.  Build once, reuse often.
+    '''
+
+    def __init__(self, files=[]):
+        self.files = []
+        self.by_accession = {}
+        self.by_md5 = {}
+        self.by_alias = {}
+        self.by_fid = {}
+        self.by_name = {} ## { submitted file name without its path: [ file objs ] }
+        for file_obj in files:
+            self.add(file_obj)
+
+    def add(self, file_obj):
+        '''Adds a file object to the index (and its list of files).'''
+        self.files.append(file_obj)
+        if file_obj.get('accession') != None:
+            self.by_accession.setdefault(file_obj['accession'], file_obj)
+        self.by_md5.setdefault(file_obj.get('md5sum'), file_obj)
+        for alias in file_obj.get('aliases',[]):
+            self.by_alias.setdefault(alias, file_obj)
+            if alias.startswith('dnanexus:'):
+                self.by_fid.setdefault(alias[9:], file_obj)
+        submitted = file_obj.get('submitted_file_name')
+        if submitted:
+            name = submitted.split('/')[-1].split(':')[-1]
+            self.by_name.setdefault(name, []).append(file_obj)
+
+    def has_md5(self, md5):
+        '''True if a file with this md5sum (or like a file without one, if None) is indexed.'''
+        return md5 in self.by_md5
+
+    def find(self, accession=None, md5sum=None, alias=None, fid=None):
+        '''Returns the first file indexed with the given accession, md5sum, alias or dnanexus fid, or None.'''
+        if accession != None:
+            return self.by_accession.get(accession)
+        if md5sum != None:
+            return self.by_md5.get(md5sum)
+        if alias != None:
+            return self.by_alias.get(alias)
+        if fid != None:
+            return self.by_fid.get(fid)
+        return None
+
+    def named(self, file_name):
+        '''Returns the files submitted under a file name (ignoring the path they were submitted from).'''
+        return self.by_name.get(file_name.split('/')[-1],[])
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
 def file_in_list(looking_for_file,file_list):
-    md5 = looking_for_file.get('md5sum')
-    for a_file in file_list:
-        if md5 == a_file.get('md5sum'):
-            return True
-    return False
+    '''Returns True if a file with the same md5sum is in the file_list (a list or FileIndex).'''
+    if not isinstance(file_list,FileIndex):
+        file_list = FileIndex(file_list)
+    return file_list.has_md5(looking_for_file.get('md5sum'))
 
 def files_to_map(exp_obj):
     if not exp_obj or not exp_obj.get('files'):
         return []
     else:
-        files = []
+        files = FileIndex()
         for file_obj in exp_obj.get('files'):
             if (file_obj.get('output_type') == 'reads' or file_obj.get('output_type') == 'raw data') and \
                file_obj.get('file_format') == 'fastq' and \
                file_obj.get('replicate') and file_obj.get('replicate').get('biological_replicate_number') and \
                                              file_obj.get('replicate').get('technical_replicate_number') and \
                not file_in_list(file_obj,files):
-               files.extend([file_obj])
+               files.add(file_obj)
             elif file_in_list(file_obj,files):
                 logger.warning('%s:%s Duplicate file md5sum, ignoring.' %(exp_obj.get('accession'),file_obj.get('accession')))
                 print >> sys.stderr, 'WARNING: %s:%s Duplicate filename, ignoring.' % \
                                                                         (exp_obj.get('accession'),file_obj.get('accession'))
                 #return []
-        return files
+        return files.files
 
 def replicates_to_map(experiment, files):
     if not files:
@@ -317,10 +897,19 @@ def replicates_to_map(experiment, files):
         reps_with_files = set([ f['replicate']['uuid'] for f in files if f.get('replicate') ])
         return [ r for r in experiment['replicates'] if r['uuid'] in reps_with_files ]
 
-def is_paired_ended(experiment):
+def mapped_replicates(experiment):
+    '''Returns the experiment's replicates which have fastqs to map.'''
+    exp_files = files_to_map(experiment)
+    files = [f for f in exp_files if f.get('replicate') and
+                                     f.get('replicate').get('biological_replicate_number') and
+                                     f.get('replicate').get('technical_replicate_number')]
+    return replicates_to_map(experiment, files)
+
+def is_paired_ended(experiment,mapping=None):
     ''' this is likely not the most efficient way to do this'''
 
-    mapping = choose_mapping_for_experiment(experiment, warn=True)
+    if mapping == None:
+        mapping = choose_mapping_for_experiment(experiment, warn=True)
     reps_paired = {}
     for rep in mapping.keys():
         p = mapping[rep].get('paired', [])
@@ -350,15 +939,11 @@ def is_paired_ended(experiment):
     print >> sys.stderr, "Never get here"
     sys.exit(1)
 
-def is_script_seq(experiment):
+def is_script_seq(experiment,replicates=None):
     '''Small subset of LRNA experiments are ScriptSeq instead of TruSeq and require alternate RSEM parameter.'''
 
-    #exp_id = experiment['accession']
-    exp_files = files_to_map(experiment)
-    files = [f for f in exp_files if f.get('replicate') and
-                                     f.get('replicate').get('biological_replicate_number') and
-                                     f.get('replicate').get('technical_replicate_number')]
-    replicates = replicates_to_map(experiment, files)
+    if replicates == None:
+        replicates = mapped_replicates(experiment)
 
     for rep in replicates:
         biorep_n = rep.get('biological_replicate_number')
@@ -383,15 +968,11 @@ def is_script_seq(experiment):
     return False
 
 
-def is_stranded(experiment,br=0,tr=0):
+def is_stranded(experiment,br=0,tr=0,replicates=None):
     '''Determines whether one or all replicates are from a stranded library.'''
 
-    #exp_id = experiment['accession']
-    exp_files = files_to_map(experiment)
-    files = [f for f in exp_files if f.get('replicate') and
-                                     f.get('replicate').get('biological_replicate_number') and
-                                     f.get('replicate').get('technical_replicate_number')]
-    replicates = replicates_to_map(experiment, files)
+    if replicates == None:
+        replicates = mapped_replicates(experiment)
 
     reps_stranded = None
     reps_direction = None
@@ -434,15 +1015,11 @@ def is_stranded(experiment,br=0,tr=0):
         return (True, reps_direction)
 
 
-def has_a_tailing(experiment,rep_tech=None):
+def has_a_tailing(experiment,rep_tech=None,replicates=None):
     '''Some ENCODE2 SRNA experiments have a alternate read clipping required.'''
 
-    #exp_id = experiment['accession']
-    exp_files = files_to_map(experiment)
-    files = [f for f in exp_files if f.get('replicate') and
-                                     f.get('replicate').get('biological_replicate_number') and
-                                     f.get('replicate').get('technical_replicate_number')]
-    replicates = replicates_to_map(experiment, files)
+    if replicates == None:
+        replicates = mapped_replicates(experiment)
 
     for rep in replicates:
         if rep_tech is not None:
@@ -482,6 +1059,83 @@ def has_a_tailing(experiment,rep_tech=None):
     return None
 
 
+class FastqPairer(object):
+    '''
+    Pairs a replicate's fastqs by 'paired_with' after indexing them once by '@id' and 'paired_with'.
+    Files are taken from the end of the list and each is matched to the earliest remaining mate,
+    so the pairs are deterministic and the same as repeatedly scanning the list for mates.
+    '''
+
+    def __init__(self, files, exp_id=None, warn=True):
+        self.files = list(files)
+        self.exp_id = exp_id
+        self.warn = warn
+        self.taken = [ False ] * len(self.files)
+        self.by_id = {}          ## { '@id': [ positions ] }
+        self.by_paired_with = {} ## { 'paired_with': [ positions ] }
+        self.next_at = {}        ## { (index_name, key): first position in that index not yet taken }
+        for (pos, file_obj) in enumerate(self.files):
+            self.by_id.setdefault(file_obj.get('@id'), []).append(pos)
+            if file_obj.get('paired_with'):
+                self.by_paired_with.setdefault(file_obj.get('paired_with'), []).append(pos)
+
+    def _first_remaining(self, index_name, index, key):
+        '''Returns the earliest position under key in the index that has not been taken, or None.'''
+        positions = index.get(key)
+        if not positions:
+            return None
+        at = self.next_at.get((index_name, key), 0)
+        while at < len(positions) and self.taken[positions[at]]:
+            at += 1
+        self.next_at[(index_name, key)] = at
+        if at < len(positions):
+            return positions[at]
+        return None
+
+    def _check_mates(self, file_obj, mate):
+        '''Flags pairs whose mates disagree about each other.'''
+        if not self.warn:
+            return
+        if mate.get('paired_end') == file_obj.get('paired_end'):
+            logger.warning('%s:%s and %s are both paired_end %s' % \
+                (self.exp_id, file_obj.get('accession'), mate.get('accession'), mate.get('paired_end')))
+        for (one, other) in [ (file_obj, mate), (mate, file_obj) ]:
+            if one.get('paired_with') and one.get('paired_with') != other.get('@id'):
+                logger.warning('%s:%s is paired with %s but claims %s' % \
+                    (self.exp_id, one.get('accession'), other.get('accession'), one.get('paired_with')))
+
+    def pair(self):
+        '''Returns (paired, unpaired) where paired is a list of (file, mate) tuples.'''
+        paired_files = []
+        unpaired_files = []
+        for pos in xrange(len(self.files) - 1, -1, -1):
+            if self.taken[pos]:
+                continue
+            self.taken[pos] = True
+            file_object = self.files[pos]
+            if file_object.get('paired_end') == None: # group all the unpaired reads for this biorep together
+                unpaired_files.extend([ file_object ])
+            elif file_object.get('paired_end') in ['1','2']:
+                if file_object.get('paired_with'):
+                    mate_at = self._first_remaining('@id', self.by_id, file_object.get('paired_with'))
+                else: #have to find the file that is paired with this one
+                    mate_at = self._first_remaining('paired_with', self.by_paired_with, file_object.get('@id'))
+                mate = None
+                if mate_at != None:
+                    mate = self.files[mate_at]
+                if mate:
+                    self.taken[mate_at] = True
+                    self._check_mates(file_object, mate)
+                elif self.warn:
+                    logger.warning('%s:%s could not find mate' %(self.exp_id, file_object.get('accession')))
+                    mate = {}
+                paired_files.extend([ (file_object, mate) ])
+            elif self.warn:
+                logger.warning('%s:%s has unexpected paired_end %s' % \
+                    (self.exp_id, file_object.get('accession'), file_object.get('paired_end')))
+        return (paired_files, unpaired_files)
+
+
 def choose_mapping_for_experiment(experiment,warn=True):
     ''' for a given experiment object, fully embedded, return experimental info needed for mapping
         returns an dict keyed by [biological_rep][technical_rep]
@@ -495,6 +1149,10 @@ def choose_mapping_for_experiment(experiment,warn=True):
                                      f.get('replicate').get('technical_replicate_number')]
     replicates = replicates_to_map(experiment, files)
     mapping = {}
+    files_by_rep = {}
+    for f in files:
+        rep_key = (f['replicate']['biological_replicate_number'], f['replicate']['technical_replicate_number'])
+        files_by_rep.setdefault(rep_key, []).append(f)
 
     if files:
         for rep in replicates:
@@ -514,25 +1172,8 @@ def choose_mapping_for_experiment(experiment,warn=True):
                 print >> sys.stderr, "Error, experiment %s replicate %s_%s missing info\n%s" % (exp_id,biorep_n,techrep_n,rep)
                 sys.exit(0)
 
-            rep_files = [f for f in files if f.get('replicate').get('biological_replicate_number') == biorep_n and
-                                                f.get('replicate').get('technical_replicate_number') == techrep_n ]
-            paired_files = []
-            unpaired_files = []
-            while rep_files:
-                file_object = rep_files.pop()
-                if file_object.get('paired_end') == None: # group all the unpaired reads for this biorep together
-                    unpaired_files.extend([ file_object ])
-                elif file_object.get('paired_end') in ['1','2']:
-                    if file_object.get('paired_with'):
-                        mate = next((f for f in rep_files if f.get('@id') == file_object.get('paired_with')), None)
-                    else: #have to find the file that is paired with this one
-                        mate = next((f for f in rep_files if f.get('paired_with') == file_object.get('@id')), None)
-                    if mate:
-                        rep_files.remove(mate)
-                    elif warn:
-                        logger.warning('%s:%s could not find mate' %(experiment.get('accession'), file_object.get('accession')))
-                        mate = {}
-                    paired_files.extend([ (file_object, mate) ])
+            rep_files = files_by_rep.get((biorep_n, techrep_n), [])
+            (paired_files, unpaired_files) = FastqPairer(rep_files,experiment.get('accession'),warn).pair()
 
             mapping[(biorep_n, techrep_n)] = {
                 "library": library,
@@ -542,8 +1183,6 @@ def choose_mapping_for_experiment(experiment,warn=True):
                 "unpaired": unpaired_files,
                 "replicate_id": rep['@id']
             }
-            if rep_files and warn:
-                logger.warning('%s: leftover file(s) %s' % (exp_id, rep_files))
     elif warn:
         logger.warning('%s: No files to map' % exp_id)
     return mapping
@@ -811,25 +1450,52 @@ def get_file(file_acc,must_find=False,key=None):
 
     return file_obj
 
-def get_exp_files(exp_obj,output_types=[],lab=None,key=None):
+def search_exp_files(exp_obj,fields=EXP_FILE_FIELDS,key=None):
+    '''Returns { accession: file obj } for the files of an experiment, from one encodeD search returning only fields.'''
+    (AUTHID,AUTHPW,SERVER) = find_keys(key)
+    url = SERVER + 'search/?type=File&dataset=%s&limit=all&format=json&frame=object' % exp_obj['@id']
+    url += ''.join([ '&field=' + field for field in fields ])
+    response = get_object(url, AUTHID, AUTHPW)
+    try:
+        response.raise_for_status()
+        graph = response.json().get('@graph',[])
+    except:
+        return {} # encodeD answers a search without results with 404
+    return dict([ (f_obj['accession'], f_obj) for f_obj in graph if 'accession' in f_obj ])
+
+def get_exp_files(exp_obj,output_types=[],lab=None,key=None,fields=EXP_FILE_FIELDS):
     '''Returns list of file objs associated with an experiment, filtered by zero or more output_types.'''
+    return get_exp_file_index(exp_obj,output_types,lab,key,fields).files
+
+def get_exp_file_index(exp_obj,output_types=[],lab=None,key=None,fields=EXP_FILE_FIELDS):
+    '''
+    Returns a FileIndex of the file objs associated with an experiment, filtered by zero or more output_types.
+    Files missing from the experiment's embedding are searched for with only 'fields', or if fields is None
+    are looked up in full (embedded frame).
+    '''
+    files = FileIndex()
     if not exp_obj or not exp_obj.get('files'):
-        return []
-    files = []
-    accessions = []
+        return files
+    accessions = set()
     #print >> sys.stderr, "DEBUG: Found %d original_files" % len(exp_obj['original_files'])
+    found = FileIndex(exp_obj['files']).by_accession
+    missing = [ file_acc for file_acc in exp_obj['original_files'] if file_acc[7:18] not in found ]
+    if len(missing) > 0 and exp_obj.get('@id') and fields != None:
+        # Files not embedded in the experiment: one search for all of them, just the fields needed
+        for (acc, f_obj) in search_exp_files(exp_obj,fields=fields,key=key).items():
+            found.setdefault(acc, f_obj)
+        missing = [ file_acc for file_acc in missing if file_acc[7:18] not in found ]
+    if len(missing) > 0:
+        # Anything the search left out is looked up file by file (concurrently)
+        for (file_acc, f_obj) in zip(missing, lookup_many(missing,frame='embedded',key=key)):
+            if f_obj != None:
+                found.setdefault(file_acc[7:18], f_obj)
     for file_acc in exp_obj['original_files']:
-        file_obj = None
         acc = file_acc[7:18]
         if acc in accessions:
             continue
-        accessions.append(acc)
-        for f_obj in exp_obj['files']:
-            if acc == f_obj['accession']:
-                file_obj = f_obj
-                break
-        if file_obj == None:
-            file_obj = get_file(file_acc,key=key)
+        accessions.add(acc)
+        file_obj = found.get(acc)
         if file_obj == None:
             continue
         #print >> sys.stderr, " * Found: %s [%s] status:%s %s" % \
@@ -849,14 +1515,15 @@ def get_exp_files(exp_obj,output_types=[],lab=None,key=None):
         if file_obj.get('status') not in ["released","uploaded","uploading","in progress"]: # further restricted by caller.
             continue
         if not file_in_list(file_obj,files):
-           files.extend([file_obj])
+           files.add(file_obj)
     return files
 
-def exp_is_pe(exp,exp_files=None,rep_tech=None,server_key=None):
+def exp_is_pe(exp,exp_files=None,rep_tech=None,server_key=None,reps=None):
     '''Determine if this experiment is expected to be 'paired-end' as opposed to 'single-end'.'''
 
     if rep_tech != None:
-        reps = get_reps(exp_id=exp.get('accession'), load_reads=False, exp=exp, full_mapping=None, key=server_key)
+        if reps == None:
+            reps = get_reps(exp_id=exp.get('accession'), load_reads=False, exp=exp, full_mapping=None, key=server_key)
         for rep in reps:
             if rep.get('rep_tech') == rep_tech:
                 if rep.get('paired_end') == False:
@@ -891,11 +1558,12 @@ def select_alias(aliases, prefix='dnanexus:',must_find=True):
     return None
 
 
-def rep_is_umi(exp,rep=None,exp_files=None,rep_tech=None,server_key=None):
+def rep_is_umi(exp,rep=None,exp_files=None,rep_tech=None,server_key=None,reps=None):
     '''Determine if this technical replicate is has fastqs all marked as UMI or all non-UMI.'''
 
     if rep == None:
-        reps = get_reps(exp_id=exp.get('accession'), load_reads=False, exp=exp, full_mapping=None, key=server_key)
+        if reps == None:
+            reps = get_reps(exp_id=exp.get('accession'), load_reads=False, exp=exp, full_mapping=None, key=server_key)
         for one_rep in reps:
             if one_rep.get('rep_tech') == rep_tech:
                 rep = one_rep
@@ -938,6 +1606,131 @@ def rep_is_umi(exp,rep=None,exp_files=None,rep_tech=None,server_key=None):
     return (umi_found_true, barcodes)
 
 
+class ExperimentView(object):
+    '''
+    What the tools derive from one encodeD experiment, each worked out at most once: its files, mapped replicates,
+    mapping, reps, pairedness, strandedness, ScriptSeq, small-rna A-tailing and UMI by replicate.
+    Get these from Encd.experiment() so that they are shared.
+    '''
+
+    def __init__(self, exp, key=None):
+        self.exp = exp
+        self.exp_id = exp.get('accession')
+        self.key = key
+        self.memo = {}
+        self.lock = threading.RLock() ## Later facts are derived from earlier ones
+
+    def _memo(self, name, compute):
+        '''Returns the named fact, computing it only the first time it is wanted.'''
+        with self.lock:
+            if name not in self.memo:
+                self.memo[name] = compute()
+            return self.memo[name]
+
+    def files(self):
+        '''FileIndex of the experiment's files.'''
+        return self._memo('files', lambda: get_exp_file_index(self.exp,key=self.key))
+
+    def replicates(self):
+        '''The replicates which have fastqs to map.'''
+        return self._memo('replicates', lambda: mapped_replicates(self.exp))
+
+    def mapping(self):
+        '''The full mapping, keyed by (biological_rep, technical_rep).'''
+        return self._memo('mapping', lambda: get_full_mapping(self.exp_id,self.exp,key=self.key))
+
+    def _reps(self, load_reads=False, control_locs=False):
+        return self._memo(('reps', load_reads, control_locs), lambda: get_reps(self.exp_id, load_reads, self.exp, \
+                                                                    self.mapping(), control_locs, self.key))
+
+    def reps(self, load_reads=False, control_locs=False):
+        '''A fresh copy of the "rep" list (see get_reps()), which callers are free to change.'''
+        return copy.deepcopy(self._reps(load_reads, control_locs))
+
+    def paired_ended(self):
+        '''True if all mapped replicates are paired-end (see is_paired_ended()).'''
+        return self._memo('paired_ended', lambda: is_paired_ended(self.exp,self.mapping()))
+
+    def is_pe(self, rep_tech=None):
+        '''True if the experiment, or just the rep_tech, is expected to be paired-end (see exp_is_pe()).'''
+        return self._memo(('is_pe', rep_tech), lambda: exp_is_pe(self.exp, self.files(), rep_tech, self.key, \
+                                                                  self._reps()))
+
+    def stranded(self, br=0, tr=0):
+        '''(stranded, direction) of one or all replicates (see is_stranded()).'''
+        return self._memo(('stranded', br, tr), lambda: is_stranded(self.exp,br,tr,self.replicates()))
+
+    def script_seq(self):
+        '''True for ScriptSeq rather than TruSeq libraries.'''
+        return self._memo('script_seq', lambda: is_script_seq(self.exp,self.replicates()))
+
+    def a_tailing(self, rep_tech=None):
+        '''The small-rna A-tailing barcode of one or any replicate, or None (see has_a_tailing()).'''
+        return self._memo(('a_tailing', rep_tech), lambda: has_a_tailing(self.exp,rep_tech,self.replicates()))
+
+    def umi(self, rep=None, rep_tech=None):
+        '''(umi_found, barcodes) for a replicate, given as a rep or rep_tech (see rep_is_umi()).'''
+        if rep == None:
+            rep = next((r for r in self._reps() if r.get('rep_tech') == rep_tech), None)
+            if rep == None: # As rep_is_umi() finds for a replicate without fastqs
+                print >> sys.stderr, "WARNING: could not detect UMI for unknown replicate %s." % rep_tech
+                return (False, [])
+        return self._memo(('umi', rep.get('replicate_id')), lambda: rep_is_umi(self.exp, rep, self.files(), \
+                                                                                 server_key=self.key))
+
+
+class Encd(object):
+    '''
+    An encodeD client holding the server, key and pooled session it was made for, and the ExperimentViews of
+    the experiments it has looked at.
+    '''
+
+    def __init__(self, server_key=None):
+        if server_key == None:
+            server_key = get_server_key()
+        self.server_key = server_key
+        (self.authid, self.authpw, self.server) = find_keys(server_key)
+        self.session = get_session(self.server, self.authid, self.authpw)
+        self.views = {} ## { exp_id: ExperimentView }
+        self.lock = threading.Lock()
+
+    def lookup_json(self, path, frame='object', must_find=False):
+        '''Returns a json object from this server (see lookup_json()).'''
+        return lookup_json(path, key=self.server_key, frame=frame, must_find=must_find)
+
+    def lookup_many(self, keys, frame='object', fields=None):
+        '''Returns many json objects from this server at once (see lookup_many()).'''
+        return lookup_many(keys, frame=frame, fields=fields, key=self.server_key)
+
+    def get_exp(self, exp_id, must_find=True, warn=False):
+        '''Returns the embedded experiment object (see get_exp()).'''
+        return get_exp(exp_id, must_find=must_find, warn=warn, key=self.server_key)
+
+    def experiment(self, exp_id, exp=None):
+        '''
+        Returns the ExperimentView of an experiment, made once and reused.  When given an exp object other than the
+        one the view was made from (e.g. refetched after a patch) the view starts over from that.
+        '''
+        with self.lock:
+            view = self.views.get(exp_id)
+        if view != None and (exp == None or exp is view.exp):
+            return view
+        if exp == None:
+            exp = self.get_exp(exp_id)
+        view = ExperimentView(exp, self.server_key)
+        with self.lock:
+            self.views[exp_id] = view
+        return view
+
+    def forget(self, exp_id=None):
+        '''Drops the view of one (or every) experiment.'''
+        with self.lock:
+            if exp_id == None:
+                self.views = {}
+            else:
+                self.views.pop(exp_id, None)
+
+
 def exp_patch_internal_status(exp_id, internal_status, key=None, test=False):
     '''Updates encodeD Experiment with an internal status.'''
 
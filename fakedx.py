@@ -0,0 +1,1312 @@
+#!/usr/bin/env python2.7
+# fakedx.py 0.0.1
+#
+# An in-memory stand-in for the DNAnexus platform, seeded from json fixtures, that counts every api call.
+# It implements the subset of dxpy used by dx.py and the tools (launch, splashdown, scrub, mission_log ...)
+# so that they can run offline and so a scenario's api calls can be counted and compared.
+#
+# From the command line, run any tool against fixtures and report the api calls it made:
+#     fakedx.py --fixtures tests/lrna.json --calls scrub.py -e ENCSR000AAA --project "ENCODE - Production runs"
+#
+# Or hold a scenario to a budget, as with tests/lrna_calls.py, a splashdown-like pass over tests/lrna.json:
+#     fakedx.py --fixtures tests/lrna.json --calls --max-calls 40 tests/lrna_calls.py
+#
+# Or run the checks of dx.py and encd.py (log scans read whole logs, fastqs pair as before, uploads resume ...):
+#     fakedx.py --check
+#
+# Or from python, before the tools are imported:
+#     backend = fakedx.FakeDx(['tests/lrna.json'])
+#     fakedx.install(backend)
+#     ...
+#     assert backend.calls.get('system_describe_data_objects',0) <= 1
+#
+# Fixtures are json: { "projects": [ { "id", "name", "level", "folders": [] } ],
+#                      "objects": [ { "id", "class", "project", "folder", "name", "properties", "details",
+#                                     "content", ... } ],
+#                      "executions": [ { "id": "job-..." or "analysis-...", "state", "output", "log": [], ... } ] }
+# Any field a real describe would return may be given.  Missing ids are generated.  Applets may carry a
+# "runOutput" (and "runState") that every job they run finishes with.  An execution may carry "describesLeft",
+# the number of describes it stays in its state before becoming "finalState" (default 'done').
+# Fixtures may also hold "faults": { "api method": [ [ "error type", http code ], ... ] }, errors raised in turn by
+# that method's next calls (e.g. [ "ServiceUnavailable", 503 ]) to exercise dx.py's retries.  Only the methods
+# reached through dxpy.api (project_*, system_*, <class>_describe ...) are retried, as with the real dxpy.
+# NOTE: Only DNAnexus is faked.  Tools still reach encodeD via encd, so point --server at a stand-in for that.
+
+import os, sys, json, time
+import re, fnmatch, copy
+import types, runpy
+import argparse
+
+FIND_PAGE_SIZE = 1000 ## Results per system_find_data_objects call, as with the real api
+EXECUTION_CLASSES = [ 'job', 'analysis' ]
+
+
+def _exception_classes():
+    '''Returns a module holding the dxpy.exceptions classes the tools rely on.'''
+    module = types.ModuleType('dxpy.exceptions')
+
+    class DXError(Exception):
+        pass
+
+    class DXAPIError(DXError):
+        def __init__(self, content, code=400, timestamp="", req_id=""):
+            self.name = content['error']['type']
+            self.msg = content['error']['message']
+            self.code = code
+            DXError.__init__(self, self.name + ": " + self.msg)
+
+    class ResourceNotFound(DXAPIError):
+        pass
+
+    class InvalidInput(DXAPIError):
+        pass
+
+    class DXSearchError(DXError):
+        pass
+
+    class DXJobFailureError(DXError):
+        pass
+
+    for cls in [ DXError, DXAPIError, ResourceNotFound, InvalidInput, DXSearchError, DXJobFailureError ]:
+        setattr(module, cls.__name__, cls)
+    return module
+
+
+def _folder_norm(folder):
+    '''Returns a folder as dnanexus stores it: leading '/' and no trailing '/'.'''
+    if folder == None or folder == '':
+        return '/'
+    if not folder.startswith('/'):
+        folder = '/' + folder
+    if len(folder) > 1:
+        folder = folder.rstrip('/')
+    return folder
+
+
+def _in_folder(folder, parent, recurse):
+    '''Returns True if folder is parent, or with recurse is anywhere below it.'''
+    if folder == parent:
+        return True
+    if not recurse:
+        return False
+    return parent == '/' or folder.startswith(parent + '/')
+
+
+def _project_fields(desc, fields):
+    '''Returns only the requested fields of a description.'''
+    if fields == None:
+        return desc
+    return dict([ (key, val) for (key, val) in desc.items() if fields.get(key) ])
+
+
+class FakeDx(object):
+    '''
+    In-memory DNAnexus: projects with folders, data objects (files, applets, workflows ...) placed in projects,
+    and executions (jobs and analyses).  Every api call is counted by method name in self.calls.
+    '''
+
+    def __init__(self, fixtures=[]):
+        self.calls = {}        ## { api method: count }
+        self.projects = {}     ## { project id: { 'id', 'name', 'level', 'folders': set() } }
+        self.objects = {}      ## { (project id, object id): description }
+        self.contents = {}     ## { object id: file content }
+        self.executions = {}   ## { job or analysis id: description }
+        self.faults = {}       ## { api method: [ [ error type, http code ], ... ] } raised in turn by its next calls
+        self.log_lines = {}    ## { job id: log lines streamed }
+        self.serial = 0
+        self.exceptions = _exception_classes()
+        for fixture in fixtures:
+            self.load(fixture)
+
+    ############## Seeding and accounting ##############
+    def load(self, fixture):
+        '''Adds the projects, objects and executions of a fixture (a json file name or an equivalent dict).'''
+        if isinstance(fixture, basestring):
+            with open(fixture, 'r') as fh:
+                fixture = json.load(fh)
+        for proj in fixture.get('projects', []):
+            proj_id = proj.get('id') or self.new_id('project')
+            self.projects[proj_id] = { 'id': proj_id, 'class': 'project', 'name': proj.get('name', proj_id),
+                                       'level': proj.get('level', 'ADMINISTER'), 'folders': set([ '/' ]) }
+            for folder in proj.get('folders', []):
+                self.add_folder(proj_id, folder)
+        for obj in fixture.get('objects', []):
+            obj = copy.deepcopy(obj)
+            content = obj.pop('content', None)
+            obj_class = obj.get('class') or obj.get('id', 'file-').split('-')[0]
+            desc = self.new_object(obj_class, obj['project'], obj.get('folder', '/'), obj.get('name'), obj)
+            if content != None:
+                self.contents[desc['id']] = content
+                desc.setdefault('size', len(content))
+        for execution in fixture.get('executions', []):
+            execution = copy.deepcopy(execution)
+            exe_class = execution.get('class') or execution.get('id', 'job-').split('-')[0]
+            execution.setdefault('id', self.new_id(exe_class))
+            execution.setdefault('class', exe_class)
+            execution.setdefault('state', 'done')
+            self.executions[execution['id']] = execution
+        for (method, faults) in fixture.get('faults', {}).items():
+            self.faults.setdefault(method, []).extend([ list(fault) for fault in faults ])
+
+    def count(self, method):
+        '''Records one api call, raising the next fault injected for the method if there is one.'''
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.faults.get(method):
+            (err_type, code) = self.faults[method].pop(0)
+            raise self.error(err_type, "Injected fault in " + method, code)
+
+    def total_calls(self):
+        '''Returns the number of api calls made.'''
+        return sum(self.calls.values())
+
+    def reset_calls(self):
+        '''Forgets the api calls made so far.'''
+        self.calls = {}
+
+    def report(self, out=sys.stderr):
+        '''Prints the api calls made, by method.'''
+        print >> out, "DNAnexus api calls: %d" % self.total_calls()
+        for method in sorted(self.calls.keys()):
+            print >> out, "  %6d %s" % (self.calls[method], method)
+
+    def dump(self, path):
+        '''Writes the current state as a fixture, so a scenario's results can seed the next.'''
+        fixture = { 'projects': [], 'objects': [], 'executions': self.executions.values() }
+        for proj in self.projects.values():
+            proj = dict(proj)
+            proj['folders'] = sorted(proj['folders'])
+            fixture['projects'].append(proj)
+        for ((proj_id, obj_id), desc) in self.objects.items():
+            obj = dict(desc)
+            if obj_id in self.contents:
+                obj['content'] = self.contents[obj_id]
+            fixture['objects'].append(obj)
+        with open(path, 'w') as fh:
+            json.dump(fixture, fh, indent=4, sort_keys=True)
+
+    ############## Internals ##############
+    def new_id(self, obj_class):
+        self.serial += 1
+        return "%s-FAKE%020d" % (obj_class, self.serial)
+
+    def now(self):
+        return int(time.time() * 1000)
+
+    def error(self, err_type, message, code=400):
+        content = { 'error': { 'type': err_type, 'message': message } }
+        if err_type == 'ResourceNotFound':
+            return self.exceptions.ResourceNotFound(content, 404)
+        if err_type == 'InvalidInput':
+            return self.exceptions.InvalidInput(content, code)
+        return self.exceptions.DXAPIError(content, code)
+
+    def project(self, proj_id):
+        if proj_id not in self.projects:
+            raise self.error('ResourceNotFound', "The specified project could not be found: " + str(proj_id))
+        return self.projects[proj_id]
+
+    def add_folder(self, proj_id, folder, parents=True):
+        folder = _folder_norm(folder)
+        proj = self.project(proj_id)
+        parent = folder.rsplit('/', 1)[0] or '/'
+        if parent not in proj['folders']:
+            if not parents:
+                raise self.error('ResourceNotFound', "The folder could not be found: " + parent)
+            self.add_folder(proj_id, parent)
+        proj['folders'].add(folder)
+
+    def new_object(self, obj_class, proj_id, folder, name, fields={}):
+        desc = { 'class': obj_class, 'state': 'closed', 'properties': {}, 'details': {}, 'types': [], 'tags': [],
+                 'hidden': False, 'created': self.now(), 'modified': self.now() }
+        desc.update(fields)
+        desc.setdefault('id', self.new_id(obj_class))
+        desc['project'] = proj_id
+        desc['folder'] = _folder_norm(folder)
+        desc['name'] = name or desc['id']
+        self.add_folder(proj_id, desc['folder'])
+        self.objects[(proj_id, desc['id'])] = desc
+        return desc
+
+    def locate(self, obj_id, proj_id=None):
+        '''Returns the description of an object, in a given project or in whichever project holds it.'''
+        if proj_id != None:
+            desc = self.objects.get((proj_id, obj_id))
+        else:
+            desc = None
+            for ((holder, held), found) in self.objects.items():
+                if held == obj_id:
+                    desc = found
+                    break
+        if desc == None:
+            raise self.error('ResourceNotFound', "The specified object could not be found: " + str(obj_id))
+        return desc
+
+    def execution(self, exe_id, counted=True):
+        if exe_id not in self.executions:
+            raise self.error('ResourceNotFound', "The specified execution could not be found: " + str(exe_id))
+        desc = self.executions[exe_id]
+        if counted and desc.get('describesLeft') != None:
+            desc['describesLeft'] -= 1
+            if desc['describesLeft'] <= 0:
+                del desc['describesLeft']
+                desc['state'] = desc.pop('finalState', 'done')
+                desc['stoppedRunning'] = self.now()
+        return desc
+
+    def describe(self, obj_id, proj_id=None, fields=None, incl_properties=True, incl_details=True):
+        '''Returns a copy of a description as the api would.'''
+        obj_class = obj_id.split('-')[0]
+        if obj_class in EXECUTION_CLASSES:
+            self.count(obj_class + '_describe')
+            return _project_fields(copy.deepcopy(self.execution(obj_id)), fields)
+        if obj_class == 'project':
+            self.count('project_describe')
+            return self.describe_project(obj_id, fields)
+        self.count(obj_class + '_describe')
+        desc = copy.deepcopy(self.locate(obj_id, proj_id))
+        if fields == None:
+            if not incl_properties:
+                desc.pop('properties', None)
+            if not incl_details:
+                desc.pop('details', None)
+        return _project_fields(desc, fields)
+
+    def describe_project(self, proj_id, fields=None, folders=False):
+        proj = self.project(proj_id)
+        desc = { 'id': proj['id'], 'class': 'project', 'name': proj['name'], 'level': proj['level'] }
+        if folders or (fields != None and fields.get('folders')):
+            desc['folders'] = sorted(proj['folders'])
+        return _project_fields(desc, fields)
+
+    def find(self, classname=None, state=None, name=None, name_mode='exact', properties=None, typename=None,
+             tag=None, project=None, folder=None, recurse=True, modified_after=None, modified_before=None,
+             created_after=None, created_before=None, visibility='visible'):
+        '''Returns matching descriptions, sorted as the api would (most recently modified first).'''
+        if name != None:
+            if name_mode == 'regexp':
+                matcher = re.compile(name)
+            elif name_mode == 'glob':
+                matcher = re.compile(fnmatch.translate(name))
+            else:
+                matcher = None
+        if folder != None:
+            folder = _folder_norm(folder)
+        found = []
+        for ((proj_id, obj_id), desc) in self.objects.items():
+            if classname != None and desc['class'] != classname:
+                continue
+            if project != None and proj_id != project:
+                continue
+            if project == None and proj_id not in self.projects:
+                continue
+            if folder != None and not _in_folder(desc['folder'], folder, recurse):
+                continue
+            if state != None and desc.get('state') != state:
+                continue
+            if visibility == 'visible' and desc.get('hidden'):
+                continue
+            if name != None:
+                if matcher == None and desc['name'] != name:
+                    continue
+                if matcher != None and not matcher.match(desc['name']):
+                    continue
+            if typename != None and typename not in desc.get('types', []):
+                continue
+            if tag != None and tag not in desc.get('tags', []):
+                continue
+            if properties != None:
+                if [ key for key in properties.keys() if properties[key] != desc['properties'].get(key) and \
+                     not (properties[key] == True and key in desc['properties']) ]:
+                    continue
+            if modified_after != None and desc['modified'] < modified_after:
+                continue
+            if modified_before != None and desc['modified'] > modified_before:
+                continue
+            if created_after != None and desc['created'] < created_after:
+                continue
+            if created_before != None and desc['created'] > created_before:
+                continue
+            found.append(desc)
+        return sorted(found, key=lambda desc: desc['modified'], reverse=True)
+
+    ############## The dxpy module ##############
+    def module(self):
+        '''Returns a module that can stand in for dxpy (with api, exceptions, and utils.job_log_client).'''
+        backend = self
+        dxpy = types.ModuleType('dxpy')
+        dxpy.__file__ = __file__
+        dxpy.exceptions = self.exceptions
+        dxpy.DXError = self.exceptions.DXError
+        dxpy.DXAPIError = self.exceptions.DXAPIError
+        dxpy.DXSearchError = self.exceptions.DXSearchError
+        dxpy.DXJobFailureError = self.exceptions.DXJobFailureError
+
+        ##### dxpy.api #####
+        api = types.ModuleType('dxpy.api')
+        dxpy.api = api
+
+        def project_describe(proj_id, input_params={}, **kwargs):
+            backend.count('project_describe')
+            return backend.describe_project(proj_id, input_params.get('fields'), input_params.get('folders', False))
+
+        def project_new_folder(proj_id, input_params={}, **kwargs):
+            backend.count('project_new_folder')
+            folder = _folder_norm(input_params['folder'])
+            if folder in backend.project(proj_id)['folders']:
+                raise backend.error('InvalidInput', "The folder already exists: " + folder)
+            backend.add_folder(proj_id, folder, parents=input_params.get('parents', False))
+            return { 'id': proj_id }
+
+        def project_list_folder(proj_id, input_params={}, **kwargs):
+            backend.count('project_list_folder')
+            folder = _folder_norm(input_params.get('folder', '/'))
+            proj = backend.project(proj_id)
+            if folder not in proj['folders']:
+                raise backend.error('ResourceNotFound', "The specified folder could not be found in " + proj_id)
+            listing = {}
+            only = input_params.get('only', 'all')
+            if only in [ 'all', 'folders' ]:
+                listing['folders'] = sorted([ sub for sub in proj['folders'] \
+                                              if sub != folder and (sub.rsplit('/', 1)[0] or '/') == folder ])
+            if only in [ 'all', 'objects' ]:
+                listing['objects'] = []
+                for ((holder, obj_id), desc) in backend.objects.items():
+                    if holder == proj_id and desc['folder'] == folder:
+                        obj = { 'id': obj_id }
+                        if input_params.get('describe'):
+                            obj['describe'] = copy.deepcopy(desc)
+                        listing['objects'].append(obj)
+            return listing
+
+        def project_move(proj_id, input_params={}, **kwargs):
+            backend.count('project_move')
+            destination = _folder_norm(input_params['destination'])
+            proj = backend.project(proj_id)
+            if destination not in proj['folders']:
+                raise backend.error('ResourceNotFound', "The destination folder could not be found: " + destination)
+            for obj_id in input_params.get('objects', []):
+                desc = backend.locate(obj_id, proj_id)
+                desc['folder'] = destination
+                desc['modified'] = backend.now()
+            for folder in input_params.get('folders', []):
+                folder = _folder_norm(folder)
+                target = _folder_norm(destination + '/' + folder.rsplit('/', 1)[1])
+                for sub in list(proj['folders']):
+                    if _in_folder(sub, folder, True):
+                        proj['folders'].remove(sub)
+                        proj['folders'].add(target + sub[len(folder):])
+                for ((holder, obj_id), desc) in backend.objects.items():
+                    if holder == proj_id and _in_folder(desc['folder'], folder, True):
+                        desc['folder'] = target + desc['folder'][len(folder):]
+            return { 'id': proj_id }
+
+        def project_clone(proj_id, input_params={}, **kwargs):
+            backend.count('project_clone')
+            dest_proj = input_params['project']
+            destination = _folder_norm(input_params.get('destination', '/'))
+            if destination not in backend.project(dest_proj)['folders']:
+                if not input_params.get('parents', False):
+                    raise backend.error('ResourceNotFound', "The destination folder could not be found: " + destination)
+                backend.add_folder(dest_proj, destination)
+            exists = []
+            for obj_id in input_params.get('objects', []):
+                if (dest_proj, obj_id) in backend.objects:
+                    exists.append(obj_id)
+                    continue
+                desc = copy.deepcopy(backend.locate(obj_id, proj_id))
+                desc['project'] = dest_proj
+                desc['folder'] = destination
+                backend.objects[(dest_proj, obj_id)] = desc
+            return { 'id': proj_id, 'project': dest_proj, 'exists': exists }
+
+        def project_remove_objects(proj_id, input_params={}, **kwargs):
+            backend.count('project_remove_objects')
+            for obj_id in input_params.get('objects', []):
+                backend.locate(obj_id, proj_id)
+                del backend.objects[(proj_id, obj_id)]
+            return { 'id': proj_id }
+
+        def project_remove_folder(proj_id, input_params={}, **kwargs):
+            backend.count('project_remove_folder')
+            folder = _folder_norm(input_params['folder'])
+            proj = backend.project(proj_id)
+            if folder not in proj['folders']:
+                raise backend.error('ResourceNotFound', "The specified folder could not be found: " + folder)
+            held = [ key for (key, desc) in backend.objects.items() \
+                     if key[0] == proj_id and _in_folder(desc['folder'], folder, True) ]
+            subs = [ sub for sub in proj['folders'] if sub != folder and _in_folder(sub, folder, True) ]
+            if (held or subs) and not input_params.get('recurse', False):
+                raise backend.error('InvalidInput', "The folder is not empty: " + folder)
+            for key in held:
+                del backend.objects[key]
+            for sub in subs + [ folder ]:
+                proj['folders'].discard(sub)
+            return { 'id': proj_id }
+
+        def system_describe_data_objects(input_params={}, **kwargs):
+            backend.count('system_describe_data_objects')
+            results = []
+            for obj in input_params.get('objects', []):
+                try:
+                    desc = copy.deepcopy(backend.locate(obj['id'], obj.get('project')))
+                except backend.exceptions.ResourceNotFound:
+                    results.append(None)
+                    continue
+                describe = obj.get('describe', {})
+                results.append({ 'describe': _project_fields(desc, describe.get('fields')) })
+            return { 'results': results }
+
+        def system_find_executions(input_params={}, **kwargs):
+            backend.count('system_find_executions')
+            ids = input_params.get('id')
+            if isinstance(ids, basestring):
+                ids = [ ids ]
+            if ids == None:
+                ids = sorted(backend.executions.keys())
+            describe = input_params.get('describe', False)
+            results = []
+            for exe_id in ids:
+                if exe_id not in backend.executions:
+                    continue
+                result = { 'id': exe_id }
+                if describe:
+                    fields = describe.get('fields') if isinstance(describe, dict) else None
+                    result['describe'] = _project_fields(copy.deepcopy(backend.execution(exe_id)), fields)
+                results.append(result)
+            return { 'results': results, 'next': None }
+
+        def execution_describe(method):
+            def describe(exe_id, input_params={}, **kwargs):
+                backend.count(method)
+                return _project_fields(copy.deepcopy(backend.execution(exe_id)), input_params.get('fields'))
+            return describe
+
+        def data_describe(method):
+            def describe(obj_id, input_params={}, **kwargs):
+                backend.count(method)
+                desc = copy.deepcopy(backend.locate(obj_id, input_params.get('project')))
+                return _project_fields(desc, input_params.get('fields'))
+            return describe
+
+        api.project_describe = project_describe
+        api.project_new_folder = project_new_folder
+        api.project_list_folder = project_list_folder
+        api.project_move = project_move
+        api.project_clone = project_clone
+        api.project_remove_objects = project_remove_objects
+        api.project_remove_folder = project_remove_folder
+        api.system_describe_data_objects = system_describe_data_objects
+        api.system_find_executions = system_find_executions
+        api.job_describe = execution_describe('job_describe')
+        api.analysis_describe = execution_describe('analysis_describe')
+        for obj_class in [ 'file', 'applet', 'workflow', 'record' ]:
+            setattr(api, obj_class + '_describe', data_describe(obj_class + '_describe'))
+
+        ##### Handlers #####
+        class DXObject(object):
+            _class = None
+
+            def __init__(self, dxid=None, project=None):
+                self._dxid = dxid
+                self._proj = project
+                self.id = dxid
+
+            def get_id(self):
+                return self._dxid
+
+            def __repr__(self):
+                return "<fake %s %s>" % (self.__class__.__name__, self._dxid)
+
+        class DXProject(DXObject):
+            def describe(self, input_params={}, **kwargs):
+                return api.project_describe(self._dxid, input_params)
+
+            def new_folder(self, folder, parents=False, **kwargs):
+                api.project_new_folder(self._dxid, { 'folder': folder, 'parents': parents })
+
+            def list_folder(self, folder='/', describe=False, only='all', includeHidden=False, **kwargs):
+                return api.project_list_folder(self._dxid, { 'folder': folder, 'describe': describe, 'only': only })
+
+            def move(self, destination, objects=[], folders=[], **kwargs):
+                api.project_move(self._dxid, { 'destination': destination, 'objects': objects, 'folders': folders })
+
+            def clone(self, container, destination='/', objects=[], folders=[], parents=False, **kwargs):
+                return api.project_clone(self._dxid, { 'project': container, 'destination': destination,
+                                                       'objects': objects, 'folders': folders, 'parents': parents })
+
+            def remove_objects(self, objects, **kwargs):
+                api.project_remove_objects(self._dxid, { 'objects': objects })
+
+            def remove_folder(self, folder, recurse=False, **kwargs):
+                api.project_remove_folder(self._dxid, { 'folder': folder, 'recurse': recurse })
+
+        class DXDataObject(DXObject):
+            def get_proj_id(self):
+                if self._proj == None:
+                    self._proj = backend.locate(self._dxid)['project']
+                return self._proj
+
+            def describe(self, incl_properties=False, incl_details=False, fields=None, **kwargs):
+                return backend.describe(self._dxid, self._proj, fields, incl_properties, incl_details)
+
+            @property
+            def name(self):
+                return backend.locate(self._dxid, self._proj)['name']
+
+            def _update(self, method, changes):
+                backend.count(method)
+                desc = backend.locate(self._dxid, self._proj)
+                changes(desc)
+                desc['modified'] = backend.now()
+
+            def get_properties(self, **kwargs):
+                return self.describe(incl_properties=True)['properties']
+
+            def set_properties(self, properties, **kwargs):
+                def changes(desc):
+                    for (key, val) in properties.items():
+                        if val == None:
+                            desc['properties'].pop(key, None)
+                        else:
+                            desc['properties'][key] = val
+                self._update(self._class + '_set_properties', changes)
+
+            def get_details(self, **kwargs):
+                backend.count(self._class + '_get_details')
+                return copy.deepcopy(backend.locate(self._dxid, self._proj).get('details', {}))
+
+            def set_details(self, details, **kwargs):
+                self._update(self._class + '_set_details', lambda desc: desc.__setitem__('details', details))
+
+            def add_tags(self, tags, **kwargs):
+                self._update(self._class + '_add_tags', \
+                             lambda desc: desc['tags'].extend([ tag for tag in tags if tag not in desc['tags'] ]))
+
+            def remove_tags(self, tags, **kwargs):
+                self._update(self._class + '_remove_tags', \
+                             lambda desc: desc.__setitem__('tags', [ tag for tag in desc['tags'] if tag not in tags ]))
+
+            def rename(self, name, **kwargs):
+                self._update(self._class + '_rename', lambda desc: desc.__setitem__('name', name))
+
+            def close(self, **kwargs):
+                self._update(self._class + '_close', lambda desc: desc.__setitem__('state', 'closed'))
+
+            def clone(self, project, folder='/', **kwargs):
+                api.project_clone(self.get_proj_id(), { 'objects': [ self._dxid ], 'project': project,
+                                                        'destination': folder, 'parents': True })
+                return self.__class__(self._dxid, project=project)
+
+        class DXFile(DXDataObject):
+            _class = 'file'
+
+            def __init__(self, dxid=None, project=None, mode=None, **kwargs):
+                DXDataObject.__init__(self, dxid, project)
+                self._lines = None
+                self._written = []
+
+            def _content(self):
+                if self._lines == None:
+                    backend.count('file_download')
+                    self._lines = backend.contents.get(self._dxid, '').splitlines(True)
+                return self._lines
+
+            def read(self, length=None, **kwargs):
+                content = ''.join(self._content())
+                self._lines = []
+                return content
+
+            def __iter__(self):
+                for line in list(self._content()):
+                    yield line.rstrip('\n')
+
+            def write(self, data, **kwargs):
+                self._written.append(data)
+
+            def flush(self, **kwargs):
+                pass
+
+            def close(self, **kwargs):
+                if self._written:
+                    backend.count('file_upload')
+                    backend.contents[self._dxid] = ''.join(self._written)
+                    desc = backend.locate(self._dxid, self._proj)
+                    desc['size'] = len(backend.contents[self._dxid])
+                    self._written = []
+                DXDataObject.close(self)
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, exc_type, exc_value, traceback):
+                if self._written:
+                    self.close()
+
+        class DXExecution(DXObject):
+            _class = 'job'
+
+            def describe(self, fields=None, io=True, **kwargs):
+                backend.count(self._class + '_describe')
+                return _project_fields(copy.deepcopy(backend.execution(self._dxid)), fields)
+
+            def wait_on_done(self, interval=2, timeout=None, **kwargs):
+                while True:
+                    desc = self.describe()
+                    if desc['state'] == 'done':
+                        return
+                    if desc['state'] in [ 'failed', 'terminated' ]:
+                        raise backend.exceptions.DXJobFailureError(self._dxid + " " + desc['state'] + ": " + \
+                                                                   str(desc.get('failureMessage','')))
+
+            def terminate(self, **kwargs):
+                backend.count(self._class + '_terminate')
+                backend.execution(self._dxid, counted=False)['state'] = 'terminated'
+
+        class DXJob(DXExecution):
+            _class = 'job'
+
+        class DXAnalysis(DXExecution):
+            _class = 'analysis'
+
+        def new_execution(exe_class, executable, exe_input, project, folder, name, output, state):
+            desc = { 'id': backend.new_id(exe_class), 'class': exe_class, 'project': project, 'folder': folder,
+                     'name': name, 'executable': executable['id'], 'executableName': executable['name'],
+                     'input': exe_input, 'originalInput': exe_input, 'output': copy.deepcopy(output),
+                     'state': state, 'created': backend.now(), 'startedRunning': backend.now(),
+                     'stoppedRunning': backend.now(), 'totalPrice': 0 }
+            if exe_class == 'job':
+                desc['applet'] = executable['id']
+                desc['originJob'] = desc['id']
+            backend.executions[desc['id']] = desc
+            return desc
+
+        class DXApplet(DXDataObject):
+            _class = 'applet'
+
+            def run(self, applet_input, project=None, folder=None, name=None, **kwargs):
+                backend.count('applet_run')
+                applet = backend.locate(self._dxid, self._proj)
+                desc = new_execution('job', applet, applet_input, project or applet['project'], folder or '/',
+                                     name or applet['name'], applet.get('runOutput', {}),
+                                     applet.get('runState', 'done'))
+                return DXJob(desc['id'])
+
+        class DXWorkflow(DXDataObject):
+            _class = 'workflow'
+
+            def add_stage(self, executable, stage_input={}, folder=None, name=None, **kwargs):
+                backend.count('workflow_add_stage')
+                desc = backend.locate(self._dxid, self._proj)
+                stage_id = 'stage-FAKE%020d' % len(desc['stages'])
+                desc['stages'].append({ 'id': stage_id, 'executable': executable.get_id(), 'name': name,
+                                        'folder': folder, 'input': copy.deepcopy(stage_input) })
+                return stage_id
+
+            def get_stage(self, stage, **kwargs):
+                backend.count('workflow_describe')
+                for found in backend.locate(self._dxid, self._proj)['stages']:
+                    if found['id'] == stage:
+                        return copy.deepcopy(found)
+                raise backend.error('ResourceNotFound', "The specified stage could not be found: " + str(stage))
+
+            def update_stage(self, stage, stage_input=None, folder=None, name=None, **kwargs):
+                backend.count('workflow_update')
+                for found in backend.locate(self._dxid, self._proj)['stages']:
+                    if found['id'] == stage:
+                        if stage_input != None:
+                            found['input'].update(stage_input)
+                        if folder != None:
+                            found['folder'] = folder
+                        return
+                raise backend.error('ResourceNotFound', "The specified stage could not be found: " + str(stage))
+
+            def run(self, workflow_input, project=None, folder=None, name=None, **kwargs):
+                backend.count('workflow_run')
+                workflow = backend.locate(self._dxid, self._proj)
+                desc = new_execution('analysis', workflow, workflow_input, project or workflow['project'],
+                                     folder or workflow['folder'], name or workflow['name'], {}, 'in_progress')
+                desc['stages'] = []
+                for stage in workflow['stages']:
+                    applet = backend.locate(stage['executable'])
+                    job = new_execution('job', applet, stage['input'], desc['project'], stage['folder'] or '/',
+                                        applet['name'], applet.get('runOutput', {}), applet.get('runState', 'done'))
+                    job['analysis'] = desc['id']
+                    desc['stages'].append({ 'id': stage['id'], 'execution': { 'id': job['id'] } })
+                desc['state'] = 'done'
+                return DXAnalysis(desc['id'])
+
+        HANDLERS = { 'project': DXProject, 'container': DXProject, 'file': DXFile, 'applet': DXApplet,
+                     'workflow': DXWorkflow, 'job': DXJob, 'analysis': DXAnalysis }
+
+        def get_handler(id_or_link, project=None):
+            if isinstance(id_or_link, dict):
+                link = id_or_link.get('$dnanexus_link', id_or_link)
+                if isinstance(link, dict):
+                    project = link.get('project', project)
+                    id_or_link = link['id']
+                else:
+                    id_or_link = link
+            return HANDLERS[id_or_link.split('-')[0]](id_or_link, project=project)
+
+        ##### Top level functions #####
+        def dxlink(object_id, project_id=None, field=None):
+            if isinstance(object_id, dict) and '$dnanexus_link' in object_id:
+                return object_id
+            if isinstance(object_id, DXDataObject):
+                project_id = object_id._proj
+                object_id = object_id.get_id()
+            if project_id == None and field == None:
+                return { '$dnanexus_link': object_id }
+            link = { 'id': object_id }
+            if project_id != None:
+                link['project'] = project_id
+            if field != None:
+                link['field'] = field
+            return { '$dnanexus_link': link }
+
+        def describe(id_or_link, project=None, incl_properties=False, incl_details=False, fields=None, **kwargs):
+            handler = get_handler(id_or_link, project)
+            if isinstance(handler, DXProject):
+                return handler.describe()
+            if isinstance(handler, DXExecution):
+                return handler.describe(fields=fields)
+            return handler.describe(incl_properties=incl_properties, incl_details=incl_details, fields=fields)
+
+        def find_data_objects(classname=None, state=None, visibility='visible', name=None, name_mode='exact',
+                              properties=None, typename=None, tag=None, tags=None, link=None, project=None,
+                              folder=None, recurse=None, modified_after=None, modified_before=None,
+                              created_after=None, created_before=None, describe=False, limit=None,
+                              level=None, region=None, return_handler=False, first_page_size=100, **kwargs):
+            if recurse == None:
+                recurse = True
+            backend.count('system_find_data_objects')
+            found = backend.find(classname, state, name, name_mode, properties, typename, tag, project, folder,
+                                 recurse, modified_after, modified_before, created_after, created_before,
+                                 visibility)
+            if limit != None:
+                found = found[:limit]
+            for (served, desc) in enumerate(found):
+                if served > 0 and served % FIND_PAGE_SIZE == 0:
+                    backend.count('system_find_data_objects')
+                if return_handler:
+                    yield get_handler(desc['id'], desc['project'])
+                    continue
+                result = { 'id': desc['id'], 'project': desc['project'] }
+                if describe:
+                    fields = None
+                    if isinstance(describe, dict):
+                        fields = describe.get('fields')
+                    result['describe'] = _project_fields(copy.deepcopy(desc), fields)
+                yield result
+
+        def find_one_data_object(zero_ok=False, more_ok=True, return_handler=False, **kwargs):
+            kwargs['limit'] = 2
+            found = list(find_data_objects(return_handler=return_handler, **kwargs))
+            if len(found) == 0:
+                if zero_ok:
+                    return None
+                raise backend.exceptions.DXSearchError("Expected one result, but found none: " + str(kwargs))
+            if len(found) > 1 and not more_ok:
+                raise backend.exceptions.DXSearchError("Expected one result, but found more: " + str(kwargs))
+            return found[0]
+
+        def find_projects(name=None, name_mode='exact', level=None, describe=False, return_handler=False, **kwargs):
+            backend.count('system_find_projects')
+            levels = [ 'VIEW', 'UPLOAD', 'CONTRIBUTE', 'ADMINISTER' ]
+            for proj in sorted(backend.projects.values(), key=lambda proj: proj['name']):
+                if name != None:
+                    if name_mode == 'glob' and not fnmatch.fnmatchcase(proj['name'], name):
+                        continue
+                    if name_mode == 'regexp' and not re.match(name, proj['name']):
+                        continue
+                    if name_mode == 'exact' and proj['name'] != name:
+                        continue
+                if level != None and levels.index(proj['level']) < levels.index(level):
+                    continue
+                if return_handler:
+                    yield DXProject(proj['id'])
+                    continue
+                result = { 'id': proj['id'], 'level': proj['level'] }
+                if describe:
+                    result['describe'] = backend.describe_project(proj['id'])
+                yield result
+
+        def find_one_project(zero_ok=False, more_ok=True, return_handler=False, **kwargs):
+            found = list(find_projects(return_handler=return_handler, **kwargs))
+            if len(found) == 0:
+                if zero_ok:
+                    return None
+                raise backend.exceptions.DXSearchError("Expected one project, but found none: " + str(kwargs))
+            if len(found) > 1 and not more_ok:
+                raise backend.exceptions.DXSearchError("Expected one project, but found more: " + str(kwargs))
+            return found[0]
+
+        def open_dxfile(dxid, project=None, mode=None, **kwargs):
+            return DXFile(dxid, project=project)
+
+        def new_dxfile(mode=None, project=None, folder='/', name=None, properties=None, details=None, **kwargs):
+            backend.count('file_new')
+            desc = backend.new_object('file', project, folder, name, { 'state': 'open' })
+            if properties:
+                desc['properties'].update(properties)
+            if details:
+                desc['details'] = details
+            return DXFile(desc['id'], project=project)
+
+        def download_dxfile(dxid, filename, project=None, **kwargs):
+            backend.locate(dxid, project)
+            backend.count('file_download')
+            with open(filename, 'w') as fh:
+                fh.write(backend.contents.get(dxid, ''))
+
+        def new_dxworkflow(title=None, name=None, folder='/', project=None, description=None, **kwargs):
+            backend.count('workflow_new')
+            desc = backend.new_object('workflow', project, folder, name,
+                                      { 'title': title, 'description': description, 'stages': [],
+                                        'state': 'open' })
+            return DXWorkflow(desc['id'], project=project)
+
+        for func in [ dxlink, describe, get_handler, find_data_objects, find_one_data_object, find_projects,
+                      find_one_project, open_dxfile, new_dxfile, download_dxfile, new_dxworkflow ]:
+            setattr(dxpy, func.__name__, func)
+        for cls in [ DXProject, DXDataObject, DXFile, DXApplet, DXWorkflow, DXJob, DXAnalysis ]:
+            setattr(dxpy, cls.__name__, cls)
+        dxpy.DXExecution = DXExecution
+
+        ##### dxpy.utils.job_log_client #####
+        utils = types.ModuleType('dxpy.utils')
+        job_log_client = types.ModuleType('dxpy.utils.job_log_client')
+
+        class LogStreamApp(object):
+            '''Stands in for the websocket.WebSocketApp the real client streams through.'''
+            def __init__(self):
+                self.keep_running = True
+
+            def close(self, **kwargs):
+                self.keep_running = False
+
+        class DXJobLogStreamClient(object):
+            def __init__(self, job_id, input_params=None, msg_output_format=None, msg_callback=None,
+                         print_job_info=True, **kwargs):
+                self.job_id = job_id
+                self.msg_callback = msg_callback
+                self._app = None
+
+            def connect(self):
+                backend.count('job_get_log')
+                self._app = LogStreamApp()
+                for line in backend.execution(self.job_id, counted=False).get('log', []):
+                    if not self._app.keep_running:
+                        break
+                    backend.log_lines[self.job_id] = backend.log_lines.get(self.job_id, 0) + 1
+                    message = { 'job': self.job_id, 'level': 'STDOUT', 'source': 'APP', 'msg': line }
+                    if self.msg_callback != None:
+                        try:
+                            self.msg_callback(message)
+                        except Exception as e:
+                            # As with websocket-client, an exception in a callback is reported, not raised
+                            print >> sys.stderr, "error from callback: " + str(e)
+                if backend.execution(self.job_id, counted=False).get('state') in [ 'failed', 'terminated' ]:
+                    sys.exit(3) # As the real client does once a failed job's log has been streamed
+
+        job_log_client.DXJobLogStreamClient = DXJobLogStreamClient
+        utils.job_log_client = job_log_client
+        dxpy.utils = utils
+        return dxpy
+
+
+def install(backend):
+    '''
+    Makes the backend's module the dxpy that every later 'import dxpy' gets, and swaps it into any modules
+    (dx, launch, ...) that have already imported dxpy.  Returns the module.
+    '''
+    dxpy = backend.module()
+    previous = sys.modules.get('dxpy')
+    sys.modules['dxpy'] = dxpy
+    sys.modules['dxpy.api'] = dxpy.api
+    sys.modules['dxpy.exceptions'] = dxpy.exceptions
+    sys.modules['dxpy.utils'] = dxpy.utils
+    sys.modules['dxpy.utils.job_log_client'] = dxpy.utils.job_log_client
+    if previous != None:
+        for module in sys.modules.values():
+            if module != None and getattr(module, 'dxpy', None) is previous:
+                module.dxpy = dxpy
+    if sys.modules.get('dx') != None:
+        sys.modules['dx'].install_resilience(dxpy.api) # Reach the fake through the same retries as the real thing
+    return dxpy
+
+
+def check_log_scan():
+    '''Checks that software versions are sought through a job's whole log, and only a whole log's are cached.'''
+    log = [ 'Starting', '* STAR version: 2.5.1b' ] + [ 'line %d' % n for n in range(1000) ] + \
+          [ '* samtools version: 1.3' ]
+    backend = FakeDx([ { 'executions': [ { 'id': 'job-logdone', 'log': log },
+                                         { 'id': 'job-logfail', 'log': log, 'state': 'failed' } ] } ])
+    install(backend)
+    import dx, tempfile
+
+    class Created(object):
+        def __init__(self, job_id):
+            self.job_id = job_id
+        def describe(self):
+            return { 'createdBy': { 'job': self.job_id } }
+
+    regex = r'\* (\S+)\s+version:\s+(\S+)'
+    (found, complete) = dx.scan_job_log('job-logdone', [ regex ])
+    assert complete and found[regex] == [ ('STAR', '2.5.1b'), ('samtools', '1.3') ], found
+    assert backend.log_lines['job-logdone'] == len(log), "only %d lines scanned" % backend.log_lines['job-logdone']
+    dx.SW_CACHE_FILE = os.path.join(tempfile.mkdtemp(), 'sw.json')
+    dx.SW_CACHE = None
+    for job_id in [ 'job-logdone', 'job-logfail' ]:
+        versions = dx.get_sw_from_log(Created(job_id), regex)['software_versions']
+        assert [ sw['software'] for sw in versions ] == [ 'STAR', 'samtools' ], versions
+    with open(dx.SW_CACHE_FILE, 'r') as fh:
+        cached = json.load(fh)
+    assert cached.keys() == [ 'job-logdone' ], "cached %s, expected only the complete scan" % cached.keys()
+
+
+def check_name_catalog():
+    '''Checks that catalog hits are confirmed to exist, so a removed reference file is never resolved.'''
+    backend = FakeDx([ { 'projects': [ { 'id': 'project-refs', 'name': 'refs' } ],
+                         'objects': [ { 'id': 'file-oldref', 'project': 'project-refs', 'folder': '/ref',
+                                        'name': 'genome.tgz' } ] } ])
+    install(backend)
+    import dx, tempfile
+    dx.NAMES_FILE = os.path.join(tempfile.mkdtemp(), 'names.json')
+    dx.NAMES = None
+    dx.NAMES_CHECKED.clear()
+    dx.clear_cache()
+    assert dx.find_reference_file_by_name('genome.tgz', 'refs')['$dnanexus_link']['id'] == 'file-oldref'
+    del backend.objects[('project-refs', 'file-oldref')] # Removed and replaced: nothing newer than the catalog
+    backend.new_object('file', 'project-refs', '/ref', 'genome.tgz', { 'id': 'file-newref',
+                                                                      'modified': 0, 'created': 0 })
+    dx.clear_cache()
+    assert len(dx.REFERENCE_FILES) == 0, "clear_cache() kept resolved reference files"
+    dx.NAMES = None # As a later process, reading the catalog back from disk
+    dx.NAMES_CHECKED.clear()
+    found = dx.find_reference_file_by_name('genome.tgz', 'refs')['$dnanexus_link']['id']
+    assert found == 'file-newref', "resolved to %s" % found
+    with open(dx.NAMES_FILE, 'r') as fh:
+        catalog = json.load(fh)['references']['project-refs']['names']
+    assert catalog['genome.tgz'] == [ [ 'file-newref', '/ref' ] ], catalog
+
+
+def check_fastq_pairer():
+    '''Checks that FastqPairer pairs exactly as the loop it replaced, which popped files and scanned for mates.'''
+    import encd, random, logging
+
+    def pair_by_scanning(rep_files, warn):
+        paired_files = []
+        unpaired_files = []
+        rep_files = list(rep_files)
+        while rep_files:
+            file_object = rep_files.pop()
+            if file_object.get('paired_end') == None:
+                unpaired_files.extend([ file_object ])
+            elif file_object.get('paired_end') in ['1','2']:
+                if file_object.get('paired_with'):
+                    mate = next((f for f in rep_files if f.get('@id') == file_object.get('paired_with')), None)
+                else:
+                    mate = next((f for f in rep_files if f.get('paired_with') == file_object.get('@id')), None)
+                if mate:
+                    rep_files.remove(mate)
+                elif warn:
+                    mate = {}
+                paired_files.extend([ (file_object, mate) ])
+        return (paired_files, unpaired_files)
+
+    def accessions(pairing):
+        (paired_files, unpaired_files) = pairing
+        return ([ (f['accession'], (m or {}).get('accession', m)) for (f, m) in paired_files ],
+                [ f['accession'] for f in unpaired_files ])
+
+    rand = random.Random(1)
+    logging.disable(logging.WARNING)
+    try:
+        for trial in range(2000):
+            count = rand.randint(0, 12)
+            ids = [ '/files/ENCFF%03d/' % rand.randint(0, count) for n in range(count) ] # some shared, as in error
+            rep_files = []
+            for (n, file_id) in enumerate(ids):
+                file_obj = { '@id': file_id, 'accession': 'ENCFF%03dX%d' % (n, trial),
+                             'paired_end': rand.choice([ None, '1', '1', '2', '2', '3' ]) }
+                if rand.random() < 0.7:
+                    file_obj['paired_with'] = rand.choice(ids + [ '/files/ENCFF999/' ])
+                rep_files.append(file_obj)
+            for warn in [ False, True ]:
+                expected = accessions(pair_by_scanning(rep_files, warn))
+                found = accessions(encd.FastqPairer(rep_files, 'ENCSR000AAA', warn).pair())
+                assert found == expected, "trial %d: %s != %s" % (trial, found, expected)
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def check_find_plan():
+    '''Checks how find_file() lookups are planned, and that each plan finds what the server alone would.'''
+    backend = FakeDx([ { 'projects': [ { 'id': 'project-plans', 'name': 'plans' },
+                                       { 'id': 'project-planrefs', 'name': 'plan refs' } ],
+                         'objects': [ { 'project': 'project-plans', 'folder': folder, 'name': name }
+                                      for folder in [ '/exp/rep1_1', '/exp/rep2_1', '/exp/rep2_1/sub', '/other' ]
+                                      for name in [ 'a.bam', 'b.bam', 'a.bai', 'genes.tsv' ] ] +
+                                    [ { 'project': 'project-planrefs', 'folder': '/GRCh38',
+                                        'name': 'index.tgz' } ] } ])
+    install(backend)
+    import dx, dxpy, tempfile
+    dx.NAMES_FILE = os.path.join(tempfile.mkdtemp(), 'names.json')
+    dx.NAMES = None
+    dx.NAMES_CHECKED.clear()
+    dx.clear_cache()
+    dx.preload_reference_files('plan refs')
+    plans = [ # path, recurse, mode, folder, recurse planned, source
+        ('project-plans:/exp/rep1_1/a.bam', False, 'exact', '/exp/rep1_1', False, 'listing'),
+        ('project-plans:/exp/rep1_1/*.bam', False, 'glob', '/exp/rep1_1', False, 'listing'),
+        ('project-plans:/exp/a.bam', True, 'exact', '/exp', True, 'server'),
+        ('project-plans:/exp/?.ba?', True, 'glob', '/exp', True, 'server'),
+        ('project-plans:/exp/rep*/a.bam', False, 'exact', '/exp', True, 'server'),
+        ('project-plans:/*/rep2_1/*.bam', True, 'glob', '/', True, 'server'),
+        ('project-planrefs:/GRCh38/index.tgz', True, 'exact', '/GRCh38', True, 'references'),
+        ('project-planrefs:/GRCh38/*.tgz', True, 'glob', '/GRCh38', True, 'server') ]
+    for (path, recurse, mode, folder, planned_recurse, source) in plans:
+        plan = dx.plan_find_file(path, recurse=recurse)
+        assert (plan.mode, plan.folder, plan.recurse, plan.source) == (mode, folder, planned_recurse, source), \
+                                        "%s: %s" % (path, (plan.mode, plan.folder, plan.recurse, plan.source))
+        (proj_id, file_path) = path.split(':')
+        (folder_pattern, name) = file_path.rsplit('/', 1)
+        if dx.has_wildcards(folder_pattern):
+            expected = [ obj_id for ((holder, obj_id), desc) in backend.objects.items() if holder == proj_id and \
+                         fnmatch.fnmatchcase(desc['folder'], folder_pattern) and \
+                         fnmatch.fnmatchcase(desc['name'], name) ]
+        else:
+            expected = [ found['id'] for found in dxpy.find_data_objects(classname='file', folder=folder_pattern,
+                                name=name, recurse=recurse, name_mode='glob', project=proj_id, return_handler=False) ]
+        found = dx.find_file(path, recurse=recurse, multiple=True) or []
+        assert sorted(found) == sorted(expected), "%s found %s, expected %s" % (path, found, expected)
+
+
+def check_flush_properties():
+    '''Checks that buffered property changes which fail to be written stay buffered for the next flush.'''
+    backend = FakeDx([ { 'projects': [ { 'id': 'project-props', 'name': 'props' } ],
+                         'objects': [ { 'id': 'file-propsone', 'project': 'project-props', 'name': 'one.bam' },
+                                      { 'id': 'file-propstwo', 'project': 'project-props', 'name': 'two.bam' } ] } ])
+    install(backend)
+    import dx
+    dx.buffer_properties(True)
+    try:
+        for fid in [ 'file-propsone', 'file-propstwo' ]:
+            dx.file_set_property(fid, 'accession', fid.upper(), proj_id='project-props')
+        assert backend.calls.get('file_set_properties', 0) == 0, "buffered changes were written at once"
+        backend.faults['file_set_properties'] = [ [ 'ServiceUnavailable', 503 ] ] # the first file's write fails
+        stderr = sys.stderr
+        sys.stderr = open(os.devnull, 'w')
+        try:
+            dx.flush_properties()
+            assert False, "a failed write was not raised"
+        except backend.exceptions.DXAPIError:
+            pass
+        finally:
+            sys.stderr = stderr
+        assert dx.pending_changes('file-propsone') == { 'accession': 'FILE-PROPSONE' }, dx.PENDING_PROPERTIES
+        assert dx.pending_changes('file-propstwo') == {}, "a written change stayed buffered"
+        assert dx.description_from_fid('file-propsone')['properties'] == { 'accession': 'FILE-PROPSONE' }
+        assert dx.flush_properties() == 1
+        assert len(dx.PENDING_PROPERTIES) == 0, dx.PENDING_PROPERTIES
+        for fid in [ 'file-propsone', 'file-propstwo' ]:
+            assert backend.locate(fid)['properties'] == { 'accession': fid.upper() }, backend.locate(fid)
+    finally:
+        dx.buffer_properties(False)
+
+
+def check_multipart_resume():
+    '''Checks that an interrupted MultipartUpload resumes, sending only the parts S3 does not hold.'''
+    import encd, tempfile, hashlib, base64
+
+    class FakeS3(object):
+        def __init__(self, uploads, fail=[]):
+            self.uploads = uploads ## { upload id: { part number: data } } shared as S3 would be
+            self.fail = fail
+            self.sent = []
+            self.completed = None
+
+        def create_multipart_upload(self, Bucket, Key):
+            upload_id = 'upload-%d' % len(self.uploads)
+            self.uploads[upload_id] = {}
+            return { 'UploadId': upload_id }
+
+        def upload_part(self, Bucket, Key, PartNumber, UploadId, Body, ContentMD5):
+            if PartNumber in self.fail:
+                raise IOError("Connection reset sending part %d" % PartNumber)
+            assert base64.b64decode(ContentMD5) == hashlib.md5(Body).digest()
+            self.sent.append(PartNumber)
+            self.uploads[UploadId][PartNumber] = Body
+            return { 'ETag': '"%s"' % hashlib.md5(Body).hexdigest() }
+
+        def list_parts(self, Bucket, Key, UploadId, PartNumberMarker=0):
+            parts = self.uploads[UploadId]
+            return { 'Parts': [ { 'PartNumber': number, 'ETag': '"%s"' % hashlib.md5(parts[number]).hexdigest() }
+                                for number in sorted(parts.keys()) if number > PartNumberMarker ],
+                     'IsTruncated': False }
+
+        def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+            parts = self.uploads.pop(UploadId)
+            numbers = [ part['PartNumber'] for part in MultipartUpload['Parts'] ]
+            self.completed = ''.join([ parts[number] for number in numbers ])
+            etag = hashlib.md5(''.join([ hashlib.md5(parts[number]).digest() for number in numbers ])).hexdigest()
+            return { 'ETag': '"%s-%d"' % (etag, len(numbers)) }
+
+    work = tempfile.mkdtemp()
+    filename = os.path.join(work, 'reads.fastq.gz')
+    with open(filename, 'wb') as fh:
+        fh.write(''.join([ chr(65 + n % 26) for n in range(45) ])) # 5 parts of 10 bytes
+    creds = { 'upload_url': 's3://encode-files/2016/01/01/reads.fastq.gz' }
+    uploads = {}
+    attempts = encd.UPLOAD_PART_ATTEMPTS
+    encd.UPLOAD_PART_ATTEMPTS = 1
+    try:
+        first = FakeS3(uploads, fail=[ 4 ])
+        try:
+            encd.MultipartUpload(filename, creds, part_size=10, workers=1, manifest_dir=work, client=first).run()
+            assert False, "the failed part was not raised"
+        except IOError:
+            pass
+    finally:
+        encd.UPLOAD_PART_ATTEMPTS = attempts
+    assert 4 not in first.sent and len(first.sent) > 0, first.sent
+    (upload_id, parts) = uploads.items()[0]
+    del parts[first.sent[0]] # S3 has lost a part the manifest records as done
+    second = FakeS3(uploads)
+    upload = encd.MultipartUpload(filename, creds, part_size=10, workers=2, manifest_dir=work, client=second)
+    etag = upload.run()
+    resent = sorted([ first.sent[0] ] + [ number for number in range(1, 6) if number not in first.sent ])
+    assert sorted(second.sent) == resent, "sent %s on resuming, expected %s" % (sorted(second.sent), resent)
+    with open(filename, 'rb') as fh:
+        assert second.completed == fh.read(), "the completed object is not the file"
+    assert etag.endswith('-5') and not os.path.exists(upload.manifest_path), etag
+
+
+def check_dx_retry():
+    '''Checks which api errors are retried: transient ones, and for non-idempotent calls only refusals.'''
+    import socket
+    backend = FakeDx([ { 'projects': [ { 'id': 'project-retry', 'name': 'retry' } ] } ])
+    install(backend)
+    import dx, dxpy
+    base = dx.DX_RETRY_BASE
+    dx.DX_RETRY_BASE = 0
+    stderr = sys.stderr
+    sys.stderr = open(os.devnull, 'w')
+    try:
+        backend.faults['project_describe'] = [ [ 'ServiceUnavailable', 503 ], [ 'InternalError', 500 ] ]
+        assert dx.project_name_from_id('project-retry') == 'retry'
+        assert backend.calls['project_describe'] == 3, backend.calls
+        for (method, fault, idempotent, call) in [
+                ('project_describe', [ 'ResourceNotFound', 404 ], True,
+                 lambda: dxpy.api.project_describe('project-retry')),
+                ('project_describe', [ 'InvalidInput', 422 ], True,
+                 lambda: dxpy.api.project_describe('project-retry')),
+                ('project_new_folder', [ 'InternalError', 500 ], False,
+                 lambda: dxpy.api.project_new_folder('project-retry', { 'folder': '/new' })) ]:
+            backend.reset_calls()
+            backend.faults[method] = [ fault ]
+            try:
+                call()
+                assert False, "%s %s was not raised" % (method, fault)
+            except backend.exceptions.DXAPIError:
+                pass
+            assert backend.calls[method] == 1, "%s %s was retried" % (method, fault)
+        backend.reset_calls()
+        backend.faults['project_new_folder'] = [ [ 'ServiceUnavailable', 503 ] ] # refused, so never carried out
+        dxpy.api.project_new_folder('project-retry', { 'folder': '/new' })
+        assert backend.calls['project_new_folder'] == 2, backend.calls
+    finally:
+        dx.DX_RETRY_BASE = base
+        sys.stderr = stderr
+        with dx.DX_RETRY_LOCK: # Not worth reporting at exit
+            dx.DX_RETRY_STATS.clear()
+    assert dx.dx_error_retryable(socket.error("Connection reset by peer"))
+    assert not dx.dx_error_retryable(socket.error("Connection reset by peer"), idempotent=False)
+
+
+LRNA_BUDGET = { 'project_describe': 1,              ## one folder snapshot of the umbrella (user-001)
+                'system_find_data_objects': 13,     ## a listing per replicate folder, a reference catalog (002, 011)
+                'system_describe_data_objects': 9,  ## a bulk describe per experiment, reference hits confirmed (003)
+                'project_clone': 6,                 ## one clone per target folder (006)
+                'project_list_folder': 6,           ## one listing per target folder, checking for files already there
+                'system_find_projects': 3,          ## each project name resolved once
+                'file_describe': 0, 'file_get_details': 0 }
+''' Most api calls, by method, that tests/lrna_calls.py may make against tests/lrna.json.'''
+
+
+def check_lrna_calls():
+    '''Checks the api calls of a splashdown-like pass over tests/lrna.json against LRNA_BUDGET.'''
+    tests = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests')
+    backend = FakeDx([ os.path.join(tests, 'lrna.json') ])
+    install(backend)
+    import dx
+    dx.clear_cache()
+    dx.clear_folder_snapshots()
+    dx.NAMES = None
+    dx.NAMES_CHECKED.clear()
+    (stdout, stderr) = (sys.stdout, sys.stderr)
+    sys.stdout = sys.stderr = open(os.devnull, 'w')
+    try:
+        runpy.run_path(os.path.join(tests, 'lrna_calls.py'), run_name='__main__')
+    finally:
+        (sys.stdout, sys.stderr) = (stdout, stderr)
+    over = [ "%s: %d > %d" % (method, backend.calls.get(method, 0), most) for (method, most) in LRNA_BUDGET.items() \
+                                                                        if backend.calls.get(method, 0) > most ]
+    assert len(over) == 0, "over budget " + ', '.join(over)
+    assert backend.total_calls() <= sum(LRNA_BUDGET.values()), backend.calls
+
+
+CHECKS = [ check_log_scan, check_name_catalog, check_fastq_pairer, check_find_plan, check_flush_properties,
+           check_multipart_resume, check_dx_retry, check_lrna_calls ] ## Run by --check
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs a tool against an in-memory DNAnexus seeded from fixtures.",
+                                     epilog="Example: %(prog)s --fixtures lrna.json --calls scrub.py -e ENCSR000AAA")
+    parser.add_argument('--fixtures', nargs='+', required=False, default=[],
+                        help="Json fixtures holding the projects, objects and executions to start with.")
+    parser.add_argument('--calls', action='store_true', required=False, default=False,
+                        help="Report the api calls made, by method.")
+    parser.add_argument('--max-calls', type=int, required=False, default=None,
+                        help="Exit with an error if the tool made more api calls than this.")
+    parser.add_argument('--save', required=False, default=None,
+                        help="Write the state left by the tool to this json fixture.")
+    parser.add_argument('--check', action='store_true', required=False, default=False,
+                        help="Run fakedx's own checks of dx.py and encd.py, then exit.")
+    parser.add_argument('tool', nargs='?', help="The tool to run (e.g. splashdown.py).")
+    parser.add_argument('tool_args', nargs=argparse.REMAINDER, help="Arguments for the tool.")
+    args = parser.parse_args()
+
+    if args.check:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        for check in CHECKS:
+            check()
+            print >> sys.stderr, "ok   " + check.__name__
+        sys.exit(0)
+    if not args.fixtures or args.tool == None:
+        parser.error("--fixtures and a tool are required")
+
+    backend = FakeDx(args.fixtures)
+    install(backend)
+    sys.argv = [ args.tool ] + args.tool_args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.tool)))
+    status = 0
+    try:
+        runpy.run_path(args.tool, run_name='__main__')
+    except SystemExit as e:
+        status = e.code
+    if args.calls:
+        backend.report()
+    if args.save != None:
+        backend.dump(args.save)
+    if args.max_calls != None and backend.total_calls() > args.max_calls:
+        print >> sys.stderr, "ERROR: %d api calls made, expected no more than %d." % \
+                                                                    (backend.total_calls(), args.max_calls)
+        sys.exit(1)
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
+
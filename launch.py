@@ -165,7 +165,8 @@ class Launch(object):
         self.template = False
         self.build_apps = False
         self.no_refs = False
-        self.server_key = self.SERVER_DEFAULT # TODO: replace with self.encd.server_key when Encd class is created
+        self.server_key = self.SERVER_DEFAULT
+        self.encd = None  # encd.Encd client for self.server_key, set up with the common variables
         self.proj_name = None
         self.project = None
         self.proj_id = None
@@ -524,7 +525,8 @@ class Launch(object):
         # NOT EXPECTED TO OVERRIDE
 
         self.server_key = args.server
-        encd.set_server_key(self.server_key) # TODO: change to self.encd = Encd(self.server_key)
+        encd.set_server_key(self.server_key)
+        self.encd = encd.Encd(self.server_key)
         self.test = args.test
         if args.experiment == None and not args.template:
             print >> sys.stderr, "ERROR: either --experiment or --template is required."
@@ -561,7 +563,7 @@ class Launch(object):
 
         if not self.template:
             print "Retrieving experiment specifics..."
-            self.exp = encd.get_exp(cv['experiment'])
+            self.exp = self.encd.get_exp(cv['experiment'])
             cv['exp_type'] = encd.get_assay_type(cv['experiment'],self.exp)
             if cv['exp_type'] != self.PIPELINE_NAME:
                 print >> sys.stderr, "ERROR: Experiment %s is not for '%s' but for '%s'" \
@@ -637,10 +639,10 @@ class Launch(object):
 
         # Special case for RNA pipelines:
         if cv['exp_type'] in ["long-rna-seq", "small-rna-seq", "rampage", "cage"]:
-            (cv['stranded'], cv['strand_direction']) = encd.is_stranded(self.exp)
+            (cv['stranded'], cv['strand_direction']) = self.encd.experiment(cv['experiment'],self.exp).stranded()
         # Special case for lrna paired_end:
         if cv['paired_end'] and cv['exp_type'] == "long-rna-seq":
-            cv['ScriptSeq'] = encd.is_script_seq(self.exp)
+            cv['ScriptSeq'] = self.encd.experiment(cv['experiment'],self.exp).script_seq()
 
         # Default locations
         cv['refLoc'] = args.refLoc
@@ -717,10 +719,9 @@ class Launch(object):
         #   - Simple reps are processed by the "REP" pipeline branch.
         #   - The one combined rep (aka "SEA") is processed by the "COMBINED_REPS" pipeline branch
         cv_reps = {}
-        full_mapping = encd.get_full_mapping(exp_id,exp=exp)
+        exp_view = self.encd.experiment(exp_id, exp)
         controls_expected = (self.CONTROL_FILE_GLOB != None)
-        reps = encd.get_reps(exp_id, load_reads=True, exp=exp, full_mapping=full_mapping, \
-                             control_locs=controls_expected)
+        reps = exp_view.reps(load_reads=True, control_locs=controls_expected)
         rep_techs = []
         if 'reps' in args and args.reps != None:
             for rep_tech in args.reps:
@@ -763,7 +764,7 @@ class Launch(object):
         # Special case for srna ENCODE2:
         if cv['exp_type'] == "small-rna-seq":
             for ltr in cv_reps.keys():
-                a_tailing = encd.has_a_tailing(self.exp,cv_reps[ltr]['rep_tech'])
+                a_tailing = exp_view.a_tailing(cv_reps[ltr]['rep_tech'])
                 if a_tailing is not None:
                     cv_reps[ltr]['a_tailing'] = a_tailing
 
@@ -785,7 +786,7 @@ class Launch(object):
             if 'paired_end' in rep and rep['paired_end']:
                 rep['concat_id2'] = 'reads2'
             if self.detect_umi:
-                (umi_found_true, barcodes) = encd.rep_is_umi(exp,rep)
+                (umi_found_true, barcodes) = exp_view.umi(rep)
                 if umi_found_true:
                     rep['umi'] = 'yes'
                 else:
@@ -1066,12 +1067,10 @@ class Launch(object):
             print "Checking for prior results..."
             # NOTE: priors is a dictionary of fileIds that will be used to determine stepsToDo
             #       and fill in inputs to workflow steps
-            for rep in self.psv['reps'].values():
-                if rep['branch_id'] != branch_id:
-                    continue
-                if not self.test:
-                    if not dx.project_has_folder(self.project, rep['resultsFolder']):
-                        self.project.new_folder(rep['resultsFolder'],parents=True)
+            reps = [ rep for rep in self.psv['reps'].values() if rep['branch_id'] == branch_id ]
+            if not self.test:
+                dx.materialize_folders(self.project, [ rep['resultsFolder'] for rep in reps ])
+            for rep in reps:
                 rep['priors'] = self.find_prior_results(rep['path'],rep['steps'],rep['resultsFolder'],globs)
 
         if not self.template:
@@ -1526,8 +1525,7 @@ class Launch(object):
 
         # Make sure results folder exists first.
         if not self.test:
-            if not dx.project_has_folder(self.project, rep['resultsFolder']):
-                self.project.new_folder(rep['resultsFolder'],parents=True)
+            dx.materialize_folders(self.project, [ rep['resultsFolder'] ])
         self.build_applets_if_necessary()
 
         if len(rep['stepsToDo']) < 1:
@@ -1776,6 +1774,7 @@ class Launch(object):
             self.check_run_log(run['resultsFolder'], proj_id, verbose=True)
 
             # Move old files out of the way...
+            to_deprecate = {}
             if self.multi_rep or self.combine_one_or_more:
                 for rep_id in sorted( self.psv['reps'].keys() ):
                     rep = self.psv['reps'][rep_id]
@@ -1783,13 +1782,15 @@ class Launch(object):
                         deprecated = rep['resultsFolder']+"deprecated/"
                         print "Moving "+str(len(rep['deprecate']))+" "+rep['rep_tech']+" prior result file(s) to '"+ \
                                                                                             deprecated+"'..."
-                        dx.move_files(rep['deprecate'],deprecated,proj_id)
+                        to_deprecate.setdefault(deprecated,[]).extend(rep['deprecate'])
             if not self.multi_rep and not self.combine_one_or_more:
                 if len(run['deprecate']) > 0 and not self.test:
                     deprecated = run['resultsFolder']+"deprecated/"
                     print "Moving "+str(len(run['deprecate']))+" "+run['rep_tech']+" prior result file(s) to '"+ \
                                                                                         deprecated+"'..."
-                    dx.move_files(run['deprecate'],deprecated,proj_id)
+                    to_deprecate.setdefault(deprecated,[]).extend(run['deprecate'])
+            if len(to_deprecate) > 0:
+                dx.transfer_files(to_deprecate,proj_id,move=True)
 
         # Build the workflow...
         wf = None
@@ -1831,7 +1832,7 @@ class Launch(object):
         else:
             # NOTE: Appending to the one file, but just in case handle multiple files.
             for fid in log_fids:
-                with dxpy.open_dxfile(fid) as fd:
+                with dx.open_cached(fid) as fd:
                     for line in fd:
                         run_id = line.split(None,1)
                         if not run_id[0].startswith('analysis-'):
@@ -1867,13 +1868,14 @@ class Launch(object):
         new_fh.write(run_id+' started:'+str(datetime.now())+'\n')
         if old_fids is not None:
             for old_fid in old_fids:
-                with dxpy.open_dxfile(old_fid) as old_fh:
+                with dx.open_cached(old_fid) as old_fh:
                     for old_run_id in old_fh:
                         new_fh.write(old_run_id+'\n')
             proj = dxpy.DXProject(self.proj_id)
             proj.remove_objects(old_fids)
 
         new_fh.close()
+        dx.invalidate_folder_listing(self.proj_id, results_folder)
 
     def launch_pad(self,wf,run,ignition=False):
         '''Launches or just advertises preassembled workflow.'''
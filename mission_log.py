@@ -45,6 +45,9 @@ class Mission_log(object):
     SERVER_DEFAULT = 'www'
     '''This the default server to report from.'''
 
+    STALE_CACHE_DEFAULT = 600
+    '''Being read-only, cached encodeD objects this many seconds old are reported on while being refreshed.'''
+
     EXPERIMENT_TYPES_SUPPORTED = [ 'long-rna-seq', 'small-rna-seq', 'rampage', 'dna-me'] #, 'rampage','dnase','dna-me','chip-seq' ]
     '''This module supports only these experiment (pipeline) types.'''
 
@@ -289,7 +292,8 @@ class Mission_log(object):
         self.project         = None # Only needed when qc_source is 'DX'
         self.umbrella_folder = None # Only needed when qc_source is 'DX'
         self.folder          = None # Where the user says to start looking for files
-        self.obj_cache = {} # certain things take time to find or create and are needed multiple times
+        self.obj_cache = dx.SharedCache() # certain things take time to find or create and are needed multiple times
+        self.obj_cache["exp"] = dx.SharedCache() # exp specific objects, renewed with each experiment
         print >> sys.stderr, " "
 
 
@@ -338,6 +342,18 @@ class Mission_log(object):
                         default=self.SERVER_DEFAULT,
                         required=False)
 
+        ap.add_argument('--mirror',
+                        help='Keep and consult a local mirror of the project file metadata (faster on repeat runs).',
+                        action='store_true',
+                        required=False)
+
+        ap.add_argument('--stale_cache',
+                        help="Seconds a cached encodeD object may be reported on as is while it is refreshed " + \
+                                                                "(default: %d, 0 to always check)" % self.STALE_CACHE_DEFAULT,
+                        type=int,
+                        default=self.STALE_CACHE_DEFAULT,
+                        required=False)
+
         ap.add_argument('--verbose',
                         help='More debugging output.',
                         action='store_true',
@@ -437,7 +453,7 @@ class Mission_log(object):
         '''Returns list of DX files for selected files available.'''
         #verbose=True
         dx_files = []
-        self.obj_cache["exp"]["files"] = {}
+        self.obj_cache["exp"]["files"] = dx.SharedCache()
         
         # Need a project specific place to start looking for files
         if self.umbrella_folder == None:
@@ -561,9 +577,10 @@ class Mission_log(object):
         #verbose=True
 
         enc_files = []
-        self.obj_cache["exp"]["files"] = {}
+        self.obj_cache["exp"]["files"] = dx.SharedCache()
         
-        files = encd.get_exp_files(exp,report_specs["output_types"],lab=encd.DCC_PIPELINE_LAB_NAME)
+        # Full files: metrics are read from their embedded step_run and quality_metrics
+        files = encd.get_exp_files(exp,report_specs["output_types"],lab=encd.DCC_PIPELINE_LAB_NAME,fields=None)
         if verbose:
             print >> sys.stderr, "Found %d prospecive encoded files" % len(files) 
         # special case to get around m2,m3 files
@@ -626,7 +643,10 @@ class Mission_log(object):
             return cache[obj_id]
             
         try:
-            obj = dxpy.describe(obj_id)
+            if obj_id.startswith('file-'):
+                obj = dx.description_from_fid(obj_id)
+            else:
+                obj = dxpy.describe(obj_id)
             if cache != None and obj_id in cache:
                 return cache[obj_id]
         except:
@@ -640,35 +660,26 @@ class Mission_log(object):
         job_ids = []
         exp_folder = self.obj_cache["exp"]["files"]["exp_folder"]
         rep_folders = self.obj_cache["exp"]["files"]["rep_folders"]
+        folders = []
         if br == None:
-            if verbose:
-                print >> sys.stderr, "- Looking for jobs in " + exp_folder
-            fids = dx.find_file(exp_folder + '*',self.proj_name,verbose=False,multiple=True, recurse=False)
-            if fids != None:
-                for fid in fids:
-                    file_dx_obj = self.retrieve_dx_obj(fid,self.obj_cache["exp"]["files"])
-                    if file_dx_obj["name"].endswith('fastq.gz') or file_dx_obj["name"].endswith('fq.gz'):
-                        continue
-                    if verbose:
-                        print >> sys.stderr, "  " + file_dx_obj["name"]
-                    if "createdBy" in file_dx_obj and "job" in file_dx_obj["createdBy"]:
-                        job_id = file_dx_obj["createdBy"]["job"]
-                        job_ids.append(job_id)
+            folders.append( (exp_folder, "- Looking for jobs in " + exp_folder, "  ") )
         for rep_folder in rep_folders:
             rep_br = rep_folder.split('_')[0][-1] #  rep2_1 or reps2_1.2.3.4
             if br == None or br == rep_br:
+                folders.append( (exp_folder + rep_folder, "  - Looking for jobs in " + exp_folder + rep_folder, "    ") )
+        for (folder, looking, indent) in folders:
+            if verbose:
+                print >> sys.stderr, looking
+            # Descriptions are remembered as they stream by since gather_job_tree() will want many of them
+            for file_dx_obj in dx.iter_files(self.proj_name, folder, recurse=False, fields=['name','createdBy'],
+                                             remember=True):
+                if file_dx_obj["name"].endswith('fastq.gz') or file_dx_obj["name"].endswith('fq.gz'):
+                    continue
                 if verbose:
-                    print >> sys.stderr, "  - Looking for jobs in " + exp_folder + rep_folder
-                fids = dx.find_file(exp_folder + rep_folder + '/*',self.proj_name,verbose=False,multiple=True, recurse=False)
-                for fid in fids:
-                    file_dx_obj = self.retrieve_dx_obj(fid,self.obj_cache["exp"]["files"])
-                    if file_dx_obj["name"].endswith('fastq.gz') or file_dx_obj["name"].endswith('fq.gz'):
-                        continue
-                    if verbose:
-                        print >> sys.stderr, "    " + file_dx_obj["name"]
-                    if "createdBy" in file_dx_obj and "job" in file_dx_obj["createdBy"]:
-                        job_id = file_dx_obj["createdBy"]["job"]
-                        job_ids.append(job_id)
+                    print >> sys.stderr, indent + file_dx_obj["name"]
+                if "createdBy" in file_dx_obj and "job" in file_dx_obj["createdBy"]:
+                    job_id = file_dx_obj["createdBy"]["job"]
+                    job_ids.append(job_id)
         unique_job_ids = list( set(job_ids) )
         if verbose:
             print >> sys.stderr, "- Found %d jobs" % len(job_ids)
@@ -771,8 +782,7 @@ class Mission_log(object):
             print >> sys.stderr, "Looking for special metric: %s" % ( metric_id )
             
         metric = {}
-        if "jobs" not in self.obj_cache["exp"]:
-            self.obj_cache["exp"]["jobs"] = {}
+        self.obj_cache["exp"].load("jobs", dx.SharedCache)
         try:
             job_id = file_dx_obj["createdBy"]["job"]
             job = self.retrieve_dx_obj(job_id,self.obj_cache["exp"]["jobs"])
@@ -886,7 +896,7 @@ class Mission_log(object):
         metrics = []
         combo_metrics = []
         metric_ids = []
-        self.obj_cache["exp"]["metrics"] = {}
+        self.obj_cache["exp"]["metrics"] = dx.SharedCache()
         for (out_type,sub_type,rep_tech,fid) in target_files:
             file_dx_obj = self.obj_cache["exp"]["files"][fid]
             
@@ -1096,8 +1106,8 @@ class Mission_log(object):
         metrics = []
         combo_metrics = []
         metric_ids = []
-        self.obj_cache["exp"]["metrics"] = {}
-        self.obj_cache["exp"]["step_runs"] = {}
+        self.obj_cache["exp"]["metrics"] = dx.SharedCache()
+        self.obj_cache["exp"]["step_runs"] = dx.SharedCache()
         for (out_type,sub_type,rep_tech,acc) in target_files:
             file_enc_obj = self.obj_cache["exp"]["files"][acc]
             if sub_type != None:
@@ -1565,12 +1575,15 @@ class Mission_log(object):
             
         self.server_key = args.server
         encd.set_server_key(self.server_key) # TODO: change to self.encd = Encd(self.server_key)
+        encd.set_response_cache(stale_secs=args.stale_cache) # Only reads, so encodeD objects can be cached
         #(self.authid, self.authpw, self.server) = encd.find_keys(self.server_key)
         self.data_mine = "encodeD"
         if args.dx:
             self.data_mine = "DX"
             self.proj_name = dx.env_get_current_project()
             self.project = dx.get_project(self.proj_name)
+            if args.mirror:
+                dx.project_mirror(self.project, verbose=args.verbose)
             self.folder = args.folder
             print >> sys.stderr, "Using %s as data mine" % self.data_mine
         
@@ -1598,9 +1611,10 @@ class Mission_log(object):
 
         exp_count = 0
         for exp_id in self.exp_ids:
+            dx.enter_cache_scope(exp_id) # forgets only what the previous experiment cached
             sys.stdout.flush() # Slow running job should flush to piped log
             self.exp_id = exp_id
-            self.obj_cache["exp"] = {}  # clear exp cache, which will hold exp specific wf_run and step_run objects
+            self.obj_cache["exp"] = dx.SharedCache()  # clear exp cache, which will hold exp specific wf_run and step_run objects
             # Lookup experiment type from encoded, based on accession
             print >> sys.stderr, "Working on %s..." % self.exp_id
             self.exp = encd.get_exp(self.exp_id,must_find=True)
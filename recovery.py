@@ -18,6 +18,8 @@ from datetime import datetime
 
 import dxpy
 import dxencode
+import dx
+import encd
 from splashdown import Splashdown
 
 class Recovery(Splashdown):
@@ -258,10 +260,10 @@ class Recovery(Splashdown):
                 print >> sys.stderr, "> Enc file derived_from:"
                 print >> sys.stderr, json.dumps(enc_derived,indent=4)
             if append_derived_by or len(enc_derived) == derived_diffs:
+                enc_derived_index = encd.FileIndex(enc_derived)
                 for acc in payload['derived_from']:
-                    for inp_file in enc_derived:
-                        if acc == inp_file.get('accession'):
-                            derived_diffs -= 1
+                    if enc_derived_index.find(accession=acc) != None:
+                        derived_diffs -= 1
         else:
             if verbose:
                 print >> sys.stderr, "Enc file derived_from: Not Found"
@@ -390,7 +392,7 @@ class Recovery(Splashdown):
         for exp_id in args.experiments:
             sys.stdout.flush() # Slow running job should flush to piped log
             self.exp_id = exp_id
-            self.obj_cache["exp"] = {}  # clear exp cache, which will hold exp specific wf_run and step_run objects
+            self.obj_cache["exp"] = dx.SharedCache()  # clear exp cache, which will hold exp specific wf_run and step_run objects
             # 1) Lookup experiment type from encoded, based on accession
             print "Working on %s..." % self.exp_id
             self.exp = dxencode.get_exp(self.exp_id,must_find=True,key=self.server_key)
@@ -106,6 +106,11 @@ class Rollover(object):
                         default=0,
                         required=False)
 
+        ap.add_argument('--mirror',
+                        help='Keep and consult a local mirror of the project file metadata (faster on repeat runs).',
+                        action='store_true',
+                        required=False)
+
         ap.add_argument('--verbose',
                         help='More debugging output.',
                         action='store_true',
@@ -189,29 +194,35 @@ class Rollover(object):
         '''Returns tuple list of (rep_tech,fid) of fastq files found in replicate folders.'''
         #verbose=True
         fastq_files = []
+        fastq_globs = ['*.fastq.gz','*.fq.gz','*.fastq','*.fq']
         for rep_tech in replicates:
-            fids = []
-            for glob in ['*.fastq.gz','*.fq.gz','*.fastq','*.fq']:
-                some_fids = dx.find_file(exp_folder + rep_tech + '/' + glob,self.proj_id, multiple=True,recurse=False)
-                if some_fids != None and len(some_fids) > 0:
+            by_glob = dict([ (glob, []) for glob in fastq_globs ])
+            for rec in dx.iter_files(self.proj_id, exp_folder + rep_tech + '/', recurse=False,
+                                     fields=['name','properties']):
+                for glob in fastq_globs:
+                    if rec['name'].endswith(glob[1:]):
+                        by_glob[glob].append(rec)
+                        break
+            recs = []
+            for glob in fastq_globs:
+                if len(by_glob[glob]) > 0:
                     if verbose:
-                        print >> sys.stderr, " - Found %d matching '%s'" % (len(some_fids), glob)
-                    fids.extend( some_fids )
+                        print >> sys.stderr, " - Found %d matching '%s'" % (len(by_glob[glob]), glob)
+                    recs.extend( by_glob[glob] )
             if verbose:
-                print >> sys.stderr, " - Found %d fastq files" % (len(fids))
-            if len(fids) > 0: 
-                for fid in fids:
-                    acc = dx.file_get_property("accession",fid)
-                    if acc != None:
+                print >> sys.stderr, " - Found %d fastq files" % (len(recs))
+            for rec in recs:
+                acc = rec.get('properties',{}).get("accession")
+                if acc != None:
+                    if verbose:
+                        print >> sys.stderr, " - Verified by accession %s" % (acc)
+                    fastq_files.append( (rep_tech,rec['id']) )
+                else:
+                    file_root = rec['name'].split('.')[0]
+                    if len(file_root) == 11:   # Expecting ENCFF000ABC.fastq.gz
                         if verbose:
-                            print >> sys.stderr, " - Verified by accession %s" % (acc)
-                        fastq_files.append( (rep_tech,fid) )
-                    else:
-                        file_root = dx.description_from_fid(fid)['name'].split('.')[0]
-                        if len(file_root) == 11:   # Expecting ENCFF000ABC.fastq.gz
-                            if verbose:
-                                print >> sys.stderr, " - Verified by file_root %s" % (file_root)
-                        fastq_files.append( (rep_tech,fid) )
+                            print >> sys.stderr, " - Verified by file_root %s" % (file_root)
+                    fastq_files.append( (rep_tech,rec['id']) )
 
         if verbose:
             print >> sys.stderr, "Fastq files:"
@@ -246,6 +257,8 @@ class Rollover(object):
 
         self.project = dx.get_project(self.proj_name)
         self.proj_id = self.project.get_id()
+        if args.mirror:
+            dx.project_mirror(self.proj_id, verbose=args.verbose)
         print "== Running in project [%s] and expect files already posted to the [%s] server ==" % \
                                                         (self.proj_name,self.server_key)
 
@@ -258,7 +271,7 @@ class Rollover(object):
         exp_count = 0
         total_moved = 0
         for exp_id in self.exp_ids:
-            dx.clear_cache()
+            dx.enter_cache_scope(exp_id) # forgets only what the previous experiment cached
             sys.stdout.flush() # Slow running job should flush to piped log
             self.exp_id = exp_id
             # 1) Lookup experiment type from encoded, based on accession
@@ -300,6 +313,7 @@ class Rollover(object):
 
             # 5) For each hg19 replicate:
             files_moved = 0
+            to_move = {}
             for rep_tech in self.hg19_replicates:
                 sys.stdout.flush() # Slow running job should flush to piped log
                 rep_fids = self.rep_fids_from_fastq_list(rep_tech,fastq_files)
@@ -309,8 +323,10 @@ class Rollover(object):
                         print "  * Would move %d file(s) to %s..." % (len(rep_fids),destination_folder)
                     else:
                         print "  * Moving %d file(s) to %s..." % (len(rep_fids),destination_folder)
-                        dx.move_files(rep_fids,destination_folder,self.proj_id)
+                        to_move[destination_folder] = rep_fids
                     files_moved += len(rep_fids) 
+            if len(to_move) > 0:
+                dx.transfer_files(to_move,self.proj_id,move=True)
 
             if not args.test:
                 print "- For %s processed %d fasqs(s), moved %d file(s)" % (self.exp_id, len(fastq_files), files_moved)
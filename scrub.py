@@ -276,6 +276,11 @@ class Scrub(object):
                         action='store_true',
                         required=False)
 
+        ap.add_argument('--mirror',
+                        help='Keep and consult a local mirror of the project file metadata (faster on repeat runs).',
+                        action='store_true',
+                        required=False)
+
         ap.add_argument('--verbose',
                         help='More debugging output.',
                         action='store_true',
@@ -476,9 +481,20 @@ class Scrub(object):
         not_posted = 0
         acc_key = dx.property_accesion_key(self.server_key) # 'accession'
 
+        # Stream the experiment's files once for the accessions rather than describing each expected file
+        expected_fids = set([ fid for (out_type, rep_tech, fid, QC_only) in files_expected if not QC_only ])
+        accessions = {}
+        if self.proj_id not in dx.MIRRORS: # A mirror answers locally anyway
+            for rec in dx.iter_files(self.proj_id, self.exp_folder, recurse=True, fields=['properties']):
+                if rec['id'] in expected_fids:
+                    accessions[rec['id']] = rec.get('properties',{}).get(acc_key)
+
         for (out_type, rep_tech, fid, QC_only) in files_expected:
             if not QC_only:
-                acc = dx.file_get_property(acc_key,fid)
+                if fid in accessions:
+                    acc = accessions[fid]
+                else:
+                    acc = dx.file_get_property(acc_key,fid)
                 if acc != None or self.force:
                     removable.append( (out_type,rep_tech,fid, False) )
                 elif self.input_exception(fid):
@@ -527,6 +543,8 @@ class Scrub(object):
 
         self.project = dx.get_project(self.proj_name)
         self.proj_id = self.project.get_id()
+        if args.mirror:
+            dx.project_mirror(self.proj_id, verbose=args.verbose)
         print "== Running in project [%s] and expect files already posted to the [%s] server ==" % \
                                                         (self.proj_name,self.server_key)
 
@@ -542,7 +560,7 @@ class Scrub(object):
         deprecates_removed = 0
         total_removed = 0
         for exp_id in self.exp_ids:
-            dx.clear_cache()
+            dx.enter_cache_scope(exp_id) # forgets only what the previous experiment cached
             sys.stdout.flush() # Slow running job should flush to piped log
             self.exp_id = exp_id
             # 1) Lookup experiment type from encoded, based on accession
@@ -575,7 +593,7 @@ class Scrub(object):
                     print "* Would remove %s:%s and all results within..." % (self.proj_name, self.exp_folder)
                 else:
                     print "* Removing %s:%s and all results within..." % (self.proj_name, self.exp_folder)
-                    dxpy.api.project_remove_folder(self.proj_id,{'folder':self.exp_folder,'recurse':True})
+                    dx.project_remove_folder(self.proj_id, self.exp_folder, recurse=True)
                 continue
             
             # Remove any 'deprecated' subfolder
@@ -586,7 +604,7 @@ class Scrub(object):
                     print "* Would remove %s:%s and all results within..." % (self.proj_name, deprecated_folder)
                 else:
                     print "* Removing %s:%s and all results within..." % (self.proj_name, deprecated_folder)
-                    dxpy.api.project_remove_folder(self.proj_id,{'folder':deprecated_folder,'recurse':True})
+                    dx.project_remove_folder(self.proj_id, deprecated_folder, recurse=True)
 
                        
             # 3) Given the experiment type, determine the expected results
@@ -636,6 +654,8 @@ class Scrub(object):
                 else:
                     print "  * Removing file %s..." % file_name
                     dxpy.api.project_remove_objects(self.proj_id,{'objects':[fid]})
+                    dx.invalidate_folder_listing(self.proj_id)
+                    dx.forget_descriptions([fid])
                 files_removed += 1
                 
             if not args.test:
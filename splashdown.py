@@ -462,12 +462,15 @@ class Splashdown(object):
         self.pipeline = None # pipeline definitions (filled in when experiment type is known)
         self.replicates = None # lost replicate folders currently found beneath experiment folder
         self.test = True # assume Test until told otherwise
-        self.obj_cache = {} # certain things take time to find or create and are needed multiple times
+        self.obj_cache = dx.SharedCache() # certain things take time to find or create and are needed multiple times
+        self.obj_cache["exp"] = dx.SharedCache() # exp specific objects, renewed with each experiment
         self.workflow_runs_created = 0
         self.step_runs_created = 0
         self.way_back_machine = False # Don't support methods/expectations used on very old runs.  Only modern methods!
-        self.exp_files = None # Currently only used by 'recovery' and the way_back_machine
+        self.exp_files = None # encd.FileIndex currently only used by 'recovery' and the way_back_machine
         self.alt_accessions = False # Support looking up alternate accessions?
+        self.enc_prefetched = {} # encoded objects looked up together by enc_prefetch(), awaiting enc_lookup()
+        self.watcher = dx.ExecutionWatcher(max_interval=10) # Follows post jobs without a wait_on_done() loop each
         self.found = {} # stores file objects from encode to avoid repeated lookups
         logging.basicConfig(format='%(asctime)s  %(levelname)s: %(message)s')
         encd.logger = logging.getLogger(__name__ + '.dxe') # I need this to avoid some errors
@@ -542,6 +545,11 @@ class Splashdown(object):
                         action='store_true',
                         required=False)
 
+        ap.add_argument('--mirror',
+                        help='Keep and consult a local mirror of the project file metadata (faster on repeat runs).',
+                        action='store_true',
+                        required=False)
+
         ap.add_argument('--verbose',
                         help='More debugging output.',
                         action='store_true',
@@ -690,12 +698,40 @@ class Splashdown(object):
         return expected
 
 
+    def enc_prefetch(self,paths):
+        '''Looks up many encoded objects at once, so that enc_lookup() can answer each without a round trip.'''
+        paths = list(set(paths))
+        self.enc_prefetched = dict(zip(paths, encd.lookup_many(paths)))
+
+
+    def enc_lookup(self,path):
+        '''Returns an encoded object (or None), as prefetched by enc_prefetch() if it was, else looked up now.'''
+        if path in self.enc_prefetched:
+            return self.enc_prefetched.pop(path) # Only once, as it may be patched after this
+        return encd.lookup_json(path,must_find=False)
+
+
+    def enc_accession_paths(self,fids):
+        '''Returns the encoded paths by which files might be found: their dnanexus alias and accession properties.'''
+        acc_keys = [ dx.property_accesion_key(encd.PRODUCTION_SERVER) ]
+        if self.server_key != 'www':
+            acc_keys.append(dx.property_accesion_key(self.server))
+        paths = []
+        for fid in fids:
+            paths.append('files/dnanexus:' + fid)
+            properties = dx.description_from_fid(fid,properties=True).get('properties') or {}
+            for acc_key in acc_keys:
+                if acc_key in properties:
+                    paths.append('files/' + properties[acc_key])
+        return paths
+
+
     def enc_file_find_by_dxid(self,dx_fid):
         '''Finds a encoded 'file' object by dnanexus alias.'''
         file_obj = None
 
         file_alias = 'dnanexus:' + dx_fid
-        file_obj = encd.lookup_json( 'files/' + file_alias,must_find=False)
+        file_obj = self.enc_lookup( 'files/' + file_alias)
         return file_obj
 
 
@@ -708,8 +744,10 @@ class Splashdown(object):
         if verbose:
             print >> sys.stderr, "Looking for '%s' of size: %d" % (file_name, file_size)
 
+        if not isinstance(exp_files,encd.FileIndex):
+            exp_files = encd.FileIndex(exp_files)
         found_file = None
-        for enc_file in exp_files:
+        for enc_file in exp_files.named(file_name):
             if enc_file.get("submitted_file_name").endswith(file_name):
                 if enc_file.get('file_size') == file_size:
                     # Check file.notes['dx_id']
@@ -721,9 +759,10 @@ class Splashdown(object):
                     else:
                         found_file = enc_file
                         break
-            if verbose:
-                print >> sys.stderr, "  %s %d" % (enc_file.get("submitted_file_name"),enc_file.get('file_size'))
 
+        if verbose:
+            for enc_file in exp_files:
+                print >> sys.stderr, "  %s %d" % (enc_file.get("submitted_file_name"),enc_file.get('file_size'))
         if found_file != None and verbose:
             print >> sys.stderr, "Found file:"
             print >> sys.stderr, json.dumps(found_file,indent=4)
@@ -766,13 +805,17 @@ class Splashdown(object):
         '''Returns the tuple list of files already posted to ENCODEd.'''
         #verbose=True
         # get all files associated with the experiment up front, just in case it is needed:
-        self.exp_files = encd.get_exp_files(self.exp)
+        self.exp_files = encd.get_exp_file_index(self.exp)
         if len(self.exp_files) == 0:
             print "* ERROR: found no files associated with experiment: " + self.exp_id
 
         posted = []
         self.found = {}
         self.revoked = []
+        dx.describe_files([ fid for (out_type, rep_tech, fid, QC_only) in files_expected ]) # in bulk, up front
+        # Look for every file by alias and accession at once, rather than one round trip at a time below
+        self.enc_prefetch(self.enc_accession_paths([ fid for (out_type, rep_tech, fid, QC_only) in files_expected \
+                                                                                                  if not QC_only ]))
         for (out_type, rep_tech, fid, QC_only) in files_expected:
             if QC_only: # Use new qc_object posting methods
                 continue
@@ -824,7 +867,7 @@ class Splashdown(object):
                     # look by accession
                     if verbose:
                         print >> sys.stderr, "* DEBUG   Not found by alias: dnanexus:" + fid
-                    f_obj = encd.lookup_json( 'files/' + accession,must_find=False)
+                    f_obj = self.enc_lookup( 'files/' + accession)
                     if f_obj != None: # Verifyably posted
                         if f_obj.get('status') == 'revoked':
                             if verbose:
@@ -905,6 +948,8 @@ class Splashdown(object):
                     print >> sys.stderr, "* DEBUG   Not Found using 'way back machine'.  VERBOSE..."
                     f_obj =  self.find_files_using_way_back_machine(fid,self.exp_files,verbose=True)
 
+        self.enc_prefetched = {} # Anything not used may be stale by the next time it is wanted
+
         # Special in order to ensure that cost accounting covers all files/jobs
         for (out_type,rep_tech,fid) in posted:
             job = self.dx_job_find(None,fid)
@@ -998,10 +1043,12 @@ class Splashdown(object):
             sw_versions = { "software_versions": versions }
         else:
             # if no 'SW' property then try grepping from the log.
-            regoop = '\* (\S+)\s+version:\s+(\S+)'
+            sw_regoop = '\* (\S+)\s+version:\s+(\S+)'
+            app_regoop = '\* Running:\s(\S+)\s+\S*\[(\S+)\]'
             if dx_app:
-                regoop = '\* Running:\s(\S+)\s+\S*\[(\S+)\]'
-            sw_versions = dx.get_sw_from_log(dxFile, regoop) # * STAR version: 2.4.0k
+                sw_versions = dx.get_sw_from_log(dxFile, app_regoop, also=[sw_regoop])
+            else:
+                sw_versions = dx.get_sw_from_log(dxFile, sw_regoop, also=[app_regoop]) # * STAR version: 2.4.0k
 
         if verbose:
             print >> sys.stderr, "sw_versions:"
@@ -1062,7 +1109,8 @@ class Splashdown(object):
         if verbose:
             print >> sys.stderr, "* derived from: Expecting %d input files." % len(file_inputs)
 
-        # For each file input, verify it is for a file and then look for an accession.
+        # For each file input, verify it is for a file and describe it.
+        inputs = []
         for inp in file_inputs:
             if not type(inp) == dict:
                 print type(inp)
@@ -1089,6 +1137,12 @@ class Splashdown(object):
                     del dx.FILES[inp_fid]
                     print "WARNING: can't find "+ inp_fid # may try to append derived_from below.
                     continue
+            inputs.append( (inp_fid, inp_obj) )
+
+        # Then check every accession found in their properties with encoded at once.
+        self.enc_prefetch([ path for path in self.enc_accession_paths([ inp_fid for (inp_fid, inp_obj) in inputs ]) \
+                                                                            if not path.startswith('files/dnanexus:') ])
+        for (inp_fid, inp_obj) in inputs:
             if verbose:
                 print >> sys.stderr, "* derived from: " + inp_fid + " " + inp_obj["project"] + ":" + \
                                                                         dx.file_path_from_fid(inp_fid)
@@ -1109,7 +1163,7 @@ class Splashdown(object):
                     if verbose:
                         print >> sys.stderr, "Found accession."
                     # Must check if file exists!!
-                    file_obj = encd.lookup_json( 'files/' + accession,must_find=False)
+                    file_obj = self.enc_lookup( 'files/' + accession)
                     if file_obj == None:
                         if verbose:
                             print >> sys.stderr, "Accession found but file not on '"+self.server_key+"'"
@@ -1127,7 +1181,7 @@ class Splashdown(object):
                         if verbose:
                             print >> sys.stderr, "Found accession for '"+self.server_key+"'."
                         # Must check if file exists!!
-                        file_obj = encd.lookup_json( 'files/' + accession,must_find=False)
+                        file_obj = self.enc_lookup( 'files/' + accession)
                         if file_obj == None:
                             if verbose:
                                 print >> sys.stderr, "Accession found but file not on '"+self.server_key+"'"
@@ -1181,6 +1235,8 @@ class Splashdown(object):
                     accession = f_obj["accession"]
                     input_accessions.append(accession)
 
+        self.enc_prefetched = {} # Anything not used may be stale by the next time it is wanted
+
         if len(input_accessions) < input_file_count:
             file_obj = dx.description_from_fid(fid, properties=True)
             derived_from = file_obj.get('properties',{}).get('derived_from')
@@ -1297,18 +1353,18 @@ class Splashdown(object):
             if qc_fid == None:
                 return {}
 
-            # 1) copy locally to tmp.txt  (should be fast)
-            if not os.path.isfile("tmp/"+qc_fid+".txt") :
-                try:
-                    os.system('mkdir -p tmp > /dev/null 2>&1')
-                    dxpy.download_dxfile(qc_fid, "tmp/"+qc_fid+".txt")  # should be short
-                except:
-                    print >> sys.stderr, "ERROR: Unable to download '"+folder + "/*_star_Log.final.out'."
-                    return {}
+            # 1) copy locally (should be fast and is only done once per file)
+            try:
+                qc_path = dx.cached_content_path(qc_fid)
+            except:
+                qc_path = None
+            if qc_path == None:
+                print >> sys.stderr, "ERROR: Unable to download '"+folder + "/*_star_Log.final.out'."
+                return {}
 
             # 2) use qc_metrics.py to shlurp in the json
             qc_parser = "~/tim/long-rna-seq-pipeline/dnanexus/tools/qc_metrics.py"
-            err, out = commands.getstatusoutput(qc_parser + " -n STAR_log_final --json -f tmp/"+qc_fid+".txt 2> /dev/null")
+            err, out = commands.getstatusoutput(qc_parser + " -n STAR_log_final --json -f "+qc_path+" 2> /dev/null")
             # ignore stderr as it is used to echo results
             if len(out) > 0:
                 qc_json = { "STAR_log_final": json.loads(out) }
@@ -1321,7 +1377,7 @@ class Splashdown(object):
     def enc_qc_metric_find(self,fid,qc_key,job_id=None,collection=None,must_find=False):
         '''Returns the qc_mtrics object from either cache or encodeD.'''
         qc_alias = self.qc_metric_make_alias(fid,qc_key,job_id)
-        if "exp" in self.obj_cache and qc_alias in self.obj_cache["exp"]:
+        if qc_alias in self.obj_cache["exp"]:
             return self.obj_cache["exp"][qc_alias]
 
         # What collection (schema type) will this metric belong to?
@@ -1411,7 +1467,7 @@ class Splashdown(object):
 
         # Stream the file and fill in attachment
         try:
-            with dxpy.open_dxfile(blob_fid) as stream:
+            with dx.open_cached(blob_fid) as stream:
                 attachment = {
                     'download': blob_name, #Just echoes the given filename as the download name
                     'size':     blob_size,
@@ -1719,19 +1775,12 @@ class Splashdown(object):
             except:
                 return None
 
-        if "exp" not in self.obj_cache:
-            self.obj_cache['exp'] = {}
-        if 'jobs' not in self.obj_cache['exp']:
-            self.obj_cache['exp']['jobs'] = {}
-        if job_id in self.obj_cache['exp']['jobs']:
-            return self.obj_cache['exp']['jobs'][job_id]
-        else:
-            try:
-                job =  dxpy.api.job_describe(job_id)
-            except:
-                return None
+        jobs = self.obj_cache['exp'].load('jobs', dx.SharedCache)
+        try:
+            job = jobs.load(job_id, lambda: dxpy.api.job_describe(job_id))
+        except:
+            return None
 
-        self.obj_cache['exp']['jobs'][job_id] = job
         if verbose:
             print >> sys.stderr, "Found job:"
             print >> sys.stderr, json.dumps(job,indent=4,sort_keys=True)
@@ -1768,13 +1817,11 @@ class Splashdown(object):
         step_run = None
         job_id = job.get('id')
         step_alias = 'dnanexus:' + job_id
-        if "exp" in self.obj_cache and step_alias in self.obj_cache["exp"]:
+        if step_alias in self.obj_cache["exp"]:
             step_run = self.obj_cache["exp"][step_alias]
         else:
             step_run = encd.lookup_json( 'analysis-step-runs/' + step_alias,must_find=False)
             if step_run:
-                if "exp" not in self.obj_cache:
-                     self.obj_cache["exp"] = {}
                 self.obj_cache["exp"][step_alias] = step_run
                 print "  - Found step_run: '%s'" % step_alias
 
@@ -1849,10 +1896,9 @@ class Splashdown(object):
             notes["dx_app_id"] = dx_app_id
             notes["step_name"] = step_ver['analysis_step']
             notes["dx_analysis_id"] = job.get('analysis')
-            if "ana_id" not in self.obj_cache["exp"]:
-                self.obj_cache["exp"]["ana_id"] = [ notes["dx_analysis_id"] ]
-            elif notes["dx_analysis_id"] not in self.obj_cache["exp"]["ana_id"]:
-                self.obj_cache["exp"]["ana_id"].append( notes["dx_analysis_id"] )
+            ana_ids = self.obj_cache["exp"].load("ana_id", list)
+            if notes["dx_analysis_id"] not in ana_ids:
+                ana_ids.append( notes["dx_analysis_id"] )
             notes["dx_project_id"] = self.proj_id
             notes["dx_project_name"] = self.proj_name
 
@@ -2216,6 +2262,7 @@ class Splashdown(object):
                 return "TSTFF00FAKE"
             return "ENCFF00FAKE"
         else:
+            dx.flush_properties([fid]) # validate-post reads and writes this file's properties
             out_folder = self.exp_folder + "posts"
             dx.find_or_create_folder(self.project, out_folder)
             applet = dx.find_applet_by_name('validate-post', self.proj_id )
@@ -2230,18 +2277,21 @@ class Splashdown(object):
             print "  - Job: %s <%s> (derived:%d)" % \
                                                      (job_name,job.id, derived_count)
             sys.stdout.flush() # Slow running job should flush to piped log
+            # Posts stay one at a time: a failed post could compromise the 'derived_from' of those that follow.
             try:
-                job.wait_on_done(interval=1)
+                watched = self.watcher.wait([job.id])[0]
             except Exception as e:
                 print "  " + e.message
                 return None
 
-            job_dict = job.describe()
+            job_dict = watched.desc
+            dx.forget_descriptions([fid]) # properties may have been changed by the job
             #error = job_dict['output'].get('error', None)
-            if job_dict["state"] == "done":
+            if watched.succeeded():
                 accession = job_dict['output'].get('accession', None)
                 return accession
             else:
+                print "  %s: %s" % (job_dict.get('failureReason',watched.state),job_dict.get('failureMessage',''))
                 return None
 
         return None
@@ -2312,6 +2362,8 @@ class Splashdown(object):
 
         self.project = dx.get_project(self.proj_name)
         self.proj_id = self.project.get_id()
+        if args.mirror:
+            dx.project_mirror(self.proj_id, verbose=args.verbose)
         print "== Running in project [%s] and will post to the [%s] server ==" % \
                                                         (self.proj_name,self.server_key)
 
@@ -2320,10 +2372,13 @@ class Splashdown(object):
         total_posted = 0
         total_patched = 0
         total_qc_objs = 0
+        dx.buffer_properties(True) # dx file properties are written once per file at experiment boundaries
         for exp_id in args.experiments:
+            dx.flush_properties()
+            dx.enter_cache_scope(exp_id) # forgets only what the previous experiment cached
             sys.stdout.flush() # Slow running job should flush to piped log
             self.exp_id = exp_id
-            self.obj_cache["exp"] = {}  # clear exp cache, which will hold exp specific wf_run and step_run objects
+            self.obj_cache["exp"] = dx.SharedCache()  # clear exp cache, which will hold exp specific wf_run and step_run objects
             # 1) Lookup experiment type from encoded, based on accession
             print "Working on %s..." % self.exp_id
             self.exp = encd.get_exp(self.exp_id,must_find=True)
@@ -2454,6 +2509,9 @@ class Splashdown(object):
         else:
             print "Processed %d experiment(s), halted %d, would post %d file(s), patched %d file(s), %d qc object(s)" % \
                                                       (exp_count, total_halted, total_posted, total_patched, total_qc_objs)
+        dx.buffer_properties(False)
+        if args.verbose:
+            print >> sys.stderr, dx.listing_cache_stats()
         if total_halted == exp_count:
             sys.exit(1)
         print "(finished)"
@@ -7,6 +7,7 @@ from datetime import datetime
 from collections import deque
 
 import dxpy
+import dx
 
 # The purpose of this module is to provide an alternative to dxencode/launch.py which does not rely upon encode at all.
 # By making launchers derived from template, one can build all necessary dx applets and create a template workflow for
@@ -1194,7 +1195,7 @@ class Launch(object):
         # Make sure results folder exists first.
         if not self.test:
             if not self.project_has_folder(self.project, rep['resultsFolder']):
-                self.project.new_folder(rep['resultsFolder'],parents=True)
+                dx.project_new_folder(self.project, rep['resultsFolder'], parents=True)
         self.build_applets_if_necessary()
                 
         if len(rep['stepsToDo']) < 1:
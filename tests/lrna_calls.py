@@ -0,0 +1,62 @@
+#!/usr/bin/env python2.7
+# lrna_calls.py 0.0.1
+#
+# A splashdown-like pass over the experiments in tests/lrna.json, for counting the DNAnexus api calls dx.py makes:
+#     fakedx.py --fixtures tests/lrna.json --calls --max-calls 40 tests/lrna_calls.py
+#
+# For every experiment it locates the experiment and replicate folders (folder snapshots), finds results by glob
+# and by exact name (folder listings and find plans), describes them with their paths, properties and details
+# (bulk describe) and copies the bams to a publishing project (bulk clone).  Reference files are resolved by name.
+# It makes 38 calls.  Against the dx.py these replaced the same pass made 392: a find per glob or name and per
+# folder level, several describes and a get_details per file, and a clone and describe per file copied.
+
+import os, sys, json, tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import dx
+
+PROJECT = 'ENCODE - Production runs'
+REF_PROJECT = 'ENCODE Reference Files'
+PUBLISH_PROJECT = 'ENCODE - Publishing'
+RESULTS_FOLDER = '/lrna/runs/'
+PUBLISH_FOLDER = '/published/'
+EXPERIMENTS = [ 'ENCSR000AAA', 'ENCSR000AAB', 'ENCSR000AAC', 'ENCSR000AAD', 'ENCSR000AAE', 'ENCSR000AAF' ]
+RESULTS = [ 'rsem_genes.tsv', 'rsem_isoforms.tsv' ] ## Found by exact name, as well as '*.bam' by glob
+REFERENCES = [ 'GRCh38_v24_star_index.tgz', 'GRCh38_v24_rsem_index.tgz', 'GRCh38_chrom_sizes.txt' ]
+
+
+def main():
+    dx.NAMES_FILE = os.path.join(tempfile.mkdtemp(), 'names.json') # Counts must not depend on an earlier run
+    project = dx.get_project(PROJECT)
+    proj_id = project.get_id()
+    publish_proj_id = dx.get_project(PUBLISH_PROJECT).get_id()
+    for ref in REFERENCES:
+        dx.find_reference_file_by_name(ref, REF_PROJECT)
+    published = 0
+    for exp_id in EXPERIMENTS:
+        exp_folder = dx.find_exp_folder(project, exp_id, RESULTS_FOLDER)
+        if exp_folder == None:
+            print >> sys.stderr, "ERROR: no folder for %s" % exp_id
+            sys.exit(1)
+        fids = []
+        for rep in dx.find_replicate_folders(project, exp_folder):
+            fids.extend(dx.find_file(exp_folder + rep + '/*.bam', proj_id, multiple=True, recurse=False) or [])
+            for result in RESULTS:
+                fid = dx.find_file(exp_folder + rep + '/' + '_'.join([ exp_id, rep, result ]), proj_id, recurse=False)
+                if fid != None:
+                    fids.append(fid)
+        dx.describe_files(fids) # in bulk, up front, as splashdown does
+        for fid in fids:
+            path = dx.file_path_from_fid(fid, projectToo=True)
+            properties = dx.file_get_properties(fid)
+            details = dx.file_get_details(fid)
+            print "%s %s %s" % (path, json.dumps(properties, sort_keys=True), json.dumps(details, sort_keys=True))
+        bams = [ fid for fid in fids if dx.description_from_fid(fid)['name'].endswith('.bam') ]
+        published += len(dx.copy_files(bams, publish_proj_id, PUBLISH_FOLDER + exp_id))
+    print >> sys.stderr, "Published %d bams from %d experiments." % (published, len(EXPERIMENTS))
+    print >> sys.stderr, dx.listing_cache_stats()
+
+
+if __name__ == '__main__':
+    '''Run from the command line.'''
+    main()